@@ -0,0 +1,156 @@
+"""
+Memory allocated per frame on the acquisition and recording path of IrFrameCollector - camera read into a pooled
+frame buffer (FrameBufferPool), latest frame slot, recording of the raw frames and the video, activity monitor -
+measured with tracemalloc on replayed frames. With --no_pool every frame is read into a new array instead
+(as IrCamera.get_frame without `out`).
+
+Frames are passed on one by one, each after the previous one was written by the recording thread. For every frame
+the peak of the traced memory over the memory at its start is measured (allocations of the reading and the recording
+thread, temporary or not), and the memory retained after all frames (leaks, growing buffers).
+The inference is not included (it runs on the latest frames, not on every frame).
+
+Run from data_collection directory:
+    python misc/frame_allocation_benchmark.py --replay <recorded data> | --synthetic [--frames 500] [--no_pool]
+        [--raw_only] [--pre_roll 10]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from activity_monitor import ActivityMonitor  # noqa: E402
+from devices.replay_ir_camera import ReplayIrCamera  # noqa: E402
+from frame_publication import FrameBufferPool, FrameTimestamps, IrFrame, LatestFrameSlot  # noqa: E402
+from ir_frame_recorder import IrFrameRecorder  # noqa: E402
+from pipeline_metrics import PipelineMetrics  # noqa: E402
+from thermal_renderer import ThermalRenderer  # noqa: E402
+
+
+NUMBER_OF_WARM_UP_FRAMES = 50
+FRAME_WRITE_TIMEOUT = 5  # [s]
+
+
+class _Pipeline:
+    """ Consumers of the frames as set up by IrFrameCollector """
+
+    def __init__(self, ir_camera: ReplayIrCamera, output_dir_path, use_pool: bool, save_video: bool,
+                 pre_roll_duration: float):
+        self.ir_camera = ir_camera
+        self.pipeline_metrics = PipelineMetrics(expected_fps=ir_camera.get_fps())
+        self.latest_frame_slot = LatestFrameSlot()
+        self.frame_recorder = IrFrameRecorder(
+            resolution=ir_camera.RESOLUTION, fps=ir_camera.get_fps(),
+            video_renderer=ThermalRenderer(resolution=ir_camera.RESOLUTION, zoom=8),
+            pipeline_metrics=self.pipeline_metrics, save_video=save_video, pre_roll_duration=pre_roll_duration)
+        self.frame_buffer_pool = FrameBufferPool(
+            shape=(ir_camera.RESOLUTION_Y * ir_camera.RESOLUTION_X,),
+            size=self.latest_frame_slot.get_ring_size() + self.frame_recorder.get_max_held_frames() + 1) \
+            if use_pool else None
+        self.activity_monitor = ActivityMonitor()
+        self.frame_recorder.start()
+        self.frame_recorder.start_recording_frames(video_file_path=os.path.join(output_dir_path, 'ir.avi'),
+                                                   frames_file_path_prefix=os.path.join(output_dir_path, 'ir'))
+        self._sequence_number = 0
+
+    def pass_frame(self) -> IrFrame:
+        """ As IrFrameCollector._run_reading """
+        self._sequence_number += 1
+        frame_timestamps = FrameTimestamps(read_start=time.monotonic())
+        if self.frame_buffer_pool is None:
+            frame_data = self.ir_camera.get_frame()
+            frame_timestamps.read_end = time.monotonic()
+            frame = IrFrame(data=frame_data, timestamp=time.time(), sequence_number=self._sequence_number,
+                            timestamps=frame_timestamps, monotonic_timestamp=frame_timestamps.read_end)
+        else:
+            buffer_index = self.frame_buffer_pool.acquire()
+            self.ir_camera.get_frame(out=self.frame_buffer_pool.get_buffer(buffer_index))
+            frame_timestamps.read_end = time.monotonic()
+            frame = IrFrame(data=self.frame_buffer_pool.get_read_only_view(buffer_index), timestamp=time.time(),
+                            sequence_number=self._sequence_number, timestamps=frame_timestamps,
+                            monotonic_timestamp=frame_timestamps.read_end, buffer_index=buffer_index,
+                            buffer_pool=self.frame_buffer_pool)
+        self.pipeline_metrics.record_acquired_frame(frame_timestamps)
+        self.latest_frame_slot.publish(frame)
+        self.frame_recorder.add_frame(frame)
+        self.activity_monitor.add_frame('ir', frame)
+        frame.release()
+        return frame
+
+    def wait_for_written(self, frame: IrFrame):
+        timeout_time = time.monotonic() + FRAME_WRITE_TIMEOUT
+        while not frame.timestamps.video_written:
+            if time.monotonic() > timeout_time:
+                raise Exception(f"Frame {frame.sequence_number} not written in {FRAME_WRITE_TIMEOUT} s!")
+            time.sleep(0.0005)
+
+    def stop(self):
+        self.frame_recorder.stop_recording_frames()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', default=None, help='recorded data to replay (see ReplayIrCamera)')
+    parser.add_argument('--synthetic', action='store_true', help='replay a generated recording')
+    parser.add_argument('--frames', type=int, default=500, help='number of measured frames')
+    parser.add_argument('--no_pool', action='store_true', help='a new array for every frame')
+    parser.add_argument('--raw_only', action='store_true', help='record only the raw frames, without the video')
+    parser.add_argument('--pre_roll', type=float, default=0.0,
+                        help='[s] of the pre-roll (the recording is started before the measured frames)')
+    args = parser.parse_args()
+    if (args.replay is None) == (not args.synthetic):
+        parser.error('one of --replay or --synthetic is required')
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        replay_path = args.replay
+        if args.synthetic:
+            from soak_test import create_synthetic_recording
+            replay_path = os.path.join(temp_dir, 'synthetic', '000')
+            create_synthetic_recording(replay_path)
+        output_dir_path = os.path.join(temp_dir, 'recording')
+        os.makedirs(output_dir_path)
+        pipeline = _Pipeline(ReplayIrCamera(replay_path, speed=0), output_dir_path, use_pool=not args.no_pool,
+                             save_video=not args.raw_only, pre_roll_duration=args.pre_roll)
+
+        tracemalloc.start()
+        for _ in range(NUMBER_OF_WARM_UP_FRAMES):
+            pipeline.wait_for_written(pipeline.pass_frame())
+        frame_peaks = np.zeros(args.frames)
+        start_size, _ = tracemalloc.get_traced_memory()
+        start_time = time.perf_counter()
+        for frame_number in range(args.frames):
+            tracemalloc.reset_peak()
+            frame_start_size, _ = tracemalloc.get_traced_memory()
+            pipeline.wait_for_written(pipeline.pass_frame())
+            _, peak_size = tracemalloc.get_traced_memory()
+            frame_peaks[frame_number] = peak_size - frame_start_size
+        duration = time.perf_counter() - start_time
+        end_size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        pipeline.stop()
+
+        frame_size = pipeline.ir_camera.RESOLUTION_X * pipeline.ir_camera.RESOLUTION_Y * np.dtype(np.float64).itemsize
+        print(f'# {args.frames} frames, {"new array per frame" if args.no_pool else "frame buffer pool"}, '
+              f'{"raw frames only" if args.raw_only else "raw frames and video"}, '
+              f'{duration / args.frames * 1000:.2f} ms/frame (with tracemalloc)')
+        print(f'# allocation peak per frame: mean {np.mean(frame_peaks):.0f} B, median {np.median(frame_peaks):.0f} B, '
+              f'max {np.max(frame_peaks):.0f} B ({np.mean(frame_peaks) / frame_size:.2f} float64 frames on average)')
+        print(f'# frames allocating at least a float64 frame ({frame_size} B): '
+              f'{np.count_nonzero(frame_peaks >= frame_size)}')
+        print(f'# retained: {(end_size - start_size) / args.frames:.1f} B per frame')
+        if pipeline.frame_buffer_pool is not None:
+            print(f'# frame buffer pool: {pipeline.frame_buffer_pool.get_stats()}')
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
+    os._exit(0)  # recorder threads are not stoppable
@@ -0,0 +1,82 @@
+"""
+Check numerical equivalence of the optimized model (folded BatchNorm and input normalization, TorchScript)
+with the eager model, and compare per-frame latency.
+
+Run from data_collection directory:
+    python misc/inference_optimization_check.py [--model_path PATH] [--random_weights]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from trained_model.frame_processor import AutoEncoder, FrameProcessor, DEFAULT_MODEL_PATH  # noqa: E402
+
+
+NUMBER_OF_FRAMES = 500
+MAX_ALLOWED_ABSOLUTE_DIFFERENCE = 1e-9
+
+
+def create_random_checkpoint(directory_path) -> str:
+    """ AutoEncoder with random weights and non-trivial BatchNorm statistics """
+    model = AutoEncoder(1, 1).double()
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.2, 0.2)
+    checkpoint_path = os.path.join(directory_path, 'random_model')
+    torch.save(model.state_dict(), checkpoint_path)
+    return checkpoint_path
+
+
+def get_per_frame_latency_ms(frame_processor, frames):
+    for frame in frames[:10]:
+        frame_processor.process_frame(frame)  # warm up
+    start_time = time.perf_counter()
+    for frame in frames:
+        frame_processor.process_frame(frame)
+    return (time.perf_counter() - start_time) * 1000 / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--random_weights', action='store_true', help='use a random model instead of the checkpoint')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        model_path = create_random_checkpoint(temp_dir) if args.random_weights else args.model_path
+
+        eager_frame_processor = FrameProcessor(model_path=model_path)
+        start_time = time.perf_counter()
+        optimized_frame_processor = FrameProcessor(model_path=model_path, optimized=True)
+        print(f'# optimized model build/save: {(time.perf_counter() - start_time) * 1000:.1f} ms')
+        start_time = time.perf_counter()
+        FrameProcessor(model_path=model_path, optimized=True)
+        print(f'# optimized model load from cache: {(time.perf_counter() - start_time) * 1000:.1f} ms')
+
+        # realistic range of temperatures, including values outside of the normalization range
+        frames = np.random.uniform(15, 40, (NUMBER_OF_FRAMES, 24, 32))
+        eager_output, eager_counts = eager_frame_processor.process_frames(frames)
+        optimized_output, optimized_counts = optimized_frame_processor.process_frames(frames)
+        max_difference = np.max(np.abs(eager_output - optimized_output))
+        max_count_difference = np.max(np.abs(eager_counts - optimized_counts))
+        print(f'# max absolute output difference: {max_difference:.3e}, count difference: {max_count_difference:.3e}')
+        assert max_difference < MAX_ALLOWED_ABSOLUTE_DIFFERENCE, "Optimized model is not equivalent!"
+
+        eager_ms = get_per_frame_latency_ms(eager_frame_processor, frames)
+        optimized_ms = get_per_frame_latency_ms(optimized_frame_processor, frames)
+        print(f'# per-frame latency: eager {eager_ms:.3f} ms, optimized {optimized_ms:.3f} ms '
+              f'(x{eager_ms / optimized_ms:.2f})')
+
+
+if __name__ == '__main__':
+    main()
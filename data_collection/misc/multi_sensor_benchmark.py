@@ -0,0 +1,133 @@
+"""
+Throughput of the threaded mode with 1 to N sensors (IrSensorGroup), replaying recorded data on all of them.
+
+Every sensor has its own reading thread and recording, inference is batched across the sensors.
+Reported per number of sensors: acquired, inferred and recorded frames per second (summed over the sensors),
+number of inference batches per second with the mean batch size and frames skipped by the inference.
+Each number of sensors runs in a separate subprocess.
+
+Run from data_collection directory:
+    python misc/multi_sensor_benchmark.py --replay <recorded data> [--max_sensors 4] [--duration 30] [--speed 0]
+    python misc/multi_sensor_benchmark.py --synthetic --random_weights
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(SRC_DIR_PATH)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pipeline_metrics import OUTPUT_RECORDED  # noqa: E402
+from trained_model.frame_processor import DEFAULT_MODEL_PATH  # noqa: E402
+
+
+WARM_UP_DURATION = 5
+
+
+def get_counters(ir_sensor_group) -> tuple:
+    """
+    :return: acquired, recorded, inferred and skipped frames (summed over the sensors) and the number of inference
+             batches
+    """
+    collectors = ir_sensor_group.get_collectors()
+    acquired_frames = sum(collector.get_latest_frame().sequence_number
+                          for collector in collectors if collector.get_latest_frame() is not None)
+    recorded_frames = sum(collector.get_pipeline_metrics().get_frame_age_histogram(OUTPUT_RECORDED).get_count()
+                          for collector in collectors)
+    worker_stats = [collector.get_inference_stats()['worker'] for collector in collectors]
+    return (acquired_frames,
+            recorded_frames,
+            sum(stats['processed_frames'] for stats in worker_stats),
+            sum(stats['skipped_frames'] for stats in worker_stats),
+            worker_stats[0]['batches'])
+
+
+def run_sensors(args) -> dict:
+    from data_collector import DataCollector
+    from devices.replay_ir_camera import ReplayIrCamera
+    from ir_sensor_group import create_ir_sensor_group
+    from trained_model.frame_processor import FrameProcessor
+
+    ir_cameras = {f'ir{i}': ReplayIrCamera(args.replay, speed=args.speed) for i in range(args.sensors)}
+    ir_sensor_group = create_ir_sensor_group(ir_cameras, video_zoom=8, save_video=True,
+                                             frame_processor=FrameProcessor(optimized=True,
+                                                                            model_path=args.model_path))
+    ir_sensor_group.start()
+    data_collector = DataCollector(ir_frame_collector=ir_sensor_group, rgb_camera=None)
+    data_collector.start_batch_recording()
+    time.sleep(WARM_UP_DURATION)
+
+    start_counters = get_counters(ir_sensor_group)
+    start_time = time.monotonic()
+    time.sleep(args.duration)
+    end_counters = get_counters(ir_sensor_group)
+    measured_duration = time.monotonic() - start_time
+
+    acquired_frames, recorded_frames, inferred_frames, skipped_frames, batches = [
+        end - start for start, end in zip(start_counters, end_counters)]
+    return {
+        'frame_rate': acquired_frames / measured_duration,
+        'recording_rate': recorded_frames / measured_duration,
+        'inference_rate': inferred_frames / measured_duration,
+        'batch_rate': batches / measured_duration,
+        'mean_batch_size': inferred_frames / batches if batches else 0.0,
+        'skipped_frames': skipped_frames,
+        'recording_queue_size': sum(collector.get_recording_queue_size()
+                                    for collector in ir_sensor_group.get_collectors()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', default=None, help='recorded data replayed by all sensors')
+    parser.add_argument('--synthetic', action='store_true', help='replay a generated recording instead')
+    parser.add_argument('--max_sensors', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30, help='measurement duration [s]')
+    parser.add_argument('--speed', type=float, default=0, help='replay speed, 0 - as fast as possible')
+    parser.add_argument('--model_path', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--random_weights', action='store_true', help='use a random model instead of the checkpoint')
+    parser.add_argument('--sensors', type=int, help='run only one number of sensors (used internally)')
+    args = parser.parse_args()
+
+    if args.sensors is None:
+        if args.replay is None and not args.synthetic:
+            parser.error("--replay or --synthetic is required")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if args.synthetic:
+                from soak_test import create_synthetic_recording
+                args.replay = os.path.join(temp_dir, 'replay', '000')
+                create_synthetic_recording(args.replay)
+            if args.random_weights:
+                from inference_optimization_check import create_random_checkpoint
+                args.model_path = create_random_checkpoint(temp_dir)
+            print(f'# replay speed {args.speed:g} (0 - as fast as possible), {os.cpu_count()} CPU cores')
+            for number_of_sensors in range(1, args.max_sensors + 1):
+                sensors_args = [sys.executable, os.path.abspath(__file__), '--sensors', str(number_of_sensors),
+                                '--replay', os.path.abspath(args.replay), '--duration', str(args.duration),
+                                '--speed', str(args.speed), '--model_path', os.path.abspath(args.model_path)]
+                output = subprocess.run(sensors_args, check=True, stdout=subprocess.PIPE).stdout.decode()
+                result = json.loads(output.strip().splitlines()[-1])
+                print(f'# {number_of_sensors} sensors: acquired {result["frame_rate"]:.1f} frames/s, '
+                      f'recorded {result["recording_rate"]:.1f} frames/s (queue {result["recording_queue_size"]}), '
+                      f'{result["inference_rate"]:.1f} inferences/s in {result["batch_rate"]:.1f} batches/s '
+                      f'(mean batch {result["mean_batch_size"]:.2f}), skipped {result["skipped_frames"]}')
+        return
+
+    # DataCollector records to '../data' - run in a temporary directory
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir_path = os.path.join(temp_dir, 'src')
+        os.makedirs(work_dir_path)
+        os.chdir(work_dir_path)
+        result = run_sensors(args)
+        print(json.dumps(result))
+        sys.stdout.flush()
+        os._exit(0)  # threads of the collectors are not stoppable
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Maximum sustained IR frame rate of the threaded mode vs the multi-process mode (main.py --multiprocess).
+
+The camera is emulated with SyntheticIrCamera, which returns frames as fast as possible but burns `--frame_cost`
+milliseconds of pure-Python CPU time per frame while holding the GIL (like the MLX90640 Python driver does).
+Recording, inference and the HTTP server with `--clients` streaming clients run in both modes.
+Each mode runs in a separate subprocess.
+
+Run from data_collection directory:
+    python misc/multiprocess_benchmark.py [--duration 30] [--clients 4] [--frame_cost 10] [--random_weights]
+"""
+
+import argparse
+import functools
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+SRC_DIR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(SRC_DIR_PATH)
+from ir_frame_recording import IrFrameBinaryReader  # noqa: E402
+from trained_model.frame_processor import DEFAULT_MODEL_PATH  # noqa: E402
+
+
+SERVER_URL = 'http://127.0.0.1:8888'
+WARM_UP_DURATION = 5
+MODES = ['threaded', 'multiprocess']
+
+
+class SyntheticIrCamera:
+    RESOLUTION_X = 32
+    RESOLUTION_Y = 24
+    RESOLUTION = (RESOLUTION_Y, RESOLUTION_X)
+    RESOLUTION_CV = (RESOLUTION_X, RESOLUTION_Y)
+
+    def __init__(self, frame_cost: float):
+        self._frame_cost = frame_cost
+
+    def get_fps(self):
+        return 32
+
+    def get_frame(self, out: np.ndarray = None):
+        end_time = time.perf_counter() + self._frame_cost
+        while time.perf_counter() < end_time:
+            sum(range(100))  # pure-Python work, holding the GIL
+        frame = np.random.uniform(18, 35, self.RESOLUTION_Y * self.RESOLUTION_X)
+        if out is None:
+            return frame
+        np.copyto(out, frame)
+        return out
+
+
+def run_streaming_client(stop_event):
+    while not stop_event.is_set():
+        try:
+            with urllib.request.urlopen(SERVER_URL + '/processed_ir_video?format=png', timeout=5) as response:
+                while not stop_event.is_set():
+                    response.read(4096)
+        except Exception:
+            time.sleep(0.5)
+
+
+def wait_for_server():
+    while True:
+        try:
+            urllib.request.urlopen(SERVER_URL + '/status', timeout=1).read()
+            return
+        except Exception:
+            time.sleep(0.2)
+
+
+def get_number_of_recorded_frames(data_dir_path) -> int:
+    chunk_prefixes = {file_path[:-len('_000.bin')] for file_path in
+                      glob.glob(os.path.join(data_dir_path, '**', 'ir_[0-9][0-9][0-9].bin'), recursive=True)}
+    return sum(IrFrameBinaryReader(prefix).get_number_of_frames() for prefix in chunk_prefixes)
+
+
+def measure(get_counters, number_of_clients, duration) -> dict:
+    """ :param get_counters: function returning (number of acquired frames, number of inference results) """
+    stop_event = threading.Event()
+    for _ in range(number_of_clients):
+        threading.Thread(target=run_streaming_client, args=(stop_event,), daemon=True).start()
+    time.sleep(WARM_UP_DURATION)
+
+    start_frames, start_results = get_counters()
+    start_time = time.monotonic()
+    time.sleep(duration)
+    end_frames, end_results = get_counters()
+    measured_duration = time.monotonic() - start_time
+    stop_event.set()
+    return {
+        'frame_rate': (end_frames - start_frames) / measured_duration,
+        'inference_rate': (end_results - start_results) / measured_duration,
+        'acquired_frames': end_frames,
+    }
+
+
+def run_threaded(args) -> dict:
+    import server
+    from data_collector import DataCollector
+    from ir_frame_collector import IrFrameCollector
+    from trained_model.frame_processor import FrameProcessor
+
+    ir_frame_collector = IrFrameCollector(
+        ir_camera=SyntheticIrCamera(args.frame_cost / 1000), video_zoom=8, save_video=True,
+        frame_processor=FrameProcessor(optimized=True, model_path=args.model_path))
+    ir_frame_collector.start()
+    threading.Thread(target=server.run_server, args=(ir_frame_collector, None), daemon=True).start()
+    wait_for_server()
+    data_collector = DataCollector(ir_frame_collector=ir_frame_collector, rgb_camera=None)
+    data_collector.start_batch_recording()
+
+    def get_counters():
+        return (ir_frame_collector.get_latest_frame().sequence_number,
+                ir_frame_collector.get_inference_stats()['worker']['processed_frames'])
+
+    result = measure(get_counters, args.clients, args.duration)
+    result['acquired_frames'] = ir_frame_collector.get_latest_frame().sequence_number
+    data_collector.finish_batch_recording()
+    return result
+
+
+def run_multiprocess(args) -> dict:
+    from multiprocess_pipeline import (PipelineConfig, PipelineSupervisor, get_frame_record_dtype,
+                                       get_inference_result_record_dtype)
+    from shared_ring import SharedRecordRing
+
+    config = PipelineConfig(
+        create_ir_camera=functools.partial(SyntheticIrCamera, args.frame_cost / 1000),
+        ir_camera_resolution=SyntheticIrCamera.RESOLUTION,
+        ir_camera_fps=32,
+        model_path=args.model_path,
+        batch_recording_duration=3600,
+        ring_name_prefix=f'ir_vision_benchmark_{os.getpid()}')
+    pipeline_supervisor = PipelineSupervisor(config)
+    pipeline_supervisor.start()
+    frame_ring = SharedRecordRing(config.get_frame_ring_name(), get_frame_record_dtype(config.ir_camera_resolution))
+    result_ring = SharedRecordRing(config.get_result_ring_name(),
+                                   get_inference_result_record_dtype(config.ir_camera_resolution))
+    wait_for_server()
+
+    def get_counters():
+        return frame_ring.get_latest_sequence_number(), result_ring.get_latest_sequence_number()
+
+    result = measure(get_counters, args.clients, args.duration)
+    pipeline_supervisor.stop()  # the recording process finishes the batch
+    result['acquired_frames'] = frame_ring.get_latest_sequence_number()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=30, help='measurement duration [s]')
+    parser.add_argument('--clients', type=int, default=4, help='number of /processed_ir_video clients')
+    parser.add_argument('--frame_cost', type=float, default=10, help='CPU time of the emulated driver [ms/frame]')
+    parser.add_argument('--model_path', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--random_weights', action='store_true', help='use a random model instead of the checkpoint')
+    parser.add_argument('--mode', choices=MODES, help='run only one mode (used internally)')
+    args = parser.parse_args()
+
+    if args.mode is None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if args.random_weights:
+                sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+                from inference_optimization_check import create_random_checkpoint
+                args.model_path = create_random_checkpoint(temp_dir)
+            print(f'# {args.clients} streaming clients, emulated driver {args.frame_cost} ms/frame')
+            for mode in MODES:
+                mode_args = [sys.executable, os.path.abspath(__file__), '--mode', mode,
+                             '--duration', str(args.duration), '--clients', str(args.clients),
+                             '--frame_cost', str(args.frame_cost), '--model_path', os.path.abspath(args.model_path)]
+                output = subprocess.run(mode_args, check=True, stdout=subprocess.PIPE).stdout.decode()
+                result = json.loads(output.strip().splitlines()[-1])
+                print(f'# {mode:>12}: {result["frame_rate"]:.1f} frames/s, {result["inference_rate"]:.1f} inferences/s, '
+                      f'recorded {result["recorded_frames"]}/{result["acquired_frames"]} frames')
+        return
+
+    # DataCollector records to '../data' - run in a temporary directory
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir_path = os.path.join(temp_dir, 'src')
+        os.makedirs(work_dir_path)
+        os.chdir(work_dir_path)
+        result = run_threaded(args) if args.mode == 'threaded' else run_multiprocess(args)
+        result['recorded_frames'] = get_number_of_recorded_frames(os.path.join(temp_dir, 'data'))
+        print(json.dumps(result))
+        sys.stdout.flush()
+        os._exit(0)  # threads of the threaded mode are not stoppable
+
+
+if __name__ == '__main__':
+    main()
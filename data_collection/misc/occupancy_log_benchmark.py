@@ -0,0 +1,81 @@
+"""
+Throughput of the occupancy log (SQLite WAL, group commit) and its impact on the producing thread.
+ - real-time run: rows added at 32 Hz from a simulated reading thread, `add` latency and writer lag are measured,
+ - burst run: maximum sustained write throughput,
+ - time range query on the filled database.
+
+Run from data_collection directory:
+    python misc/occupancy_log_benchmark.py [--duration 20]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from occupancy_log import OccupancyLog  # noqa: E402
+
+
+FRAME_RATE = 32
+NUMBER_OF_BURST_ROWS = 200000
+QUERY_RANGE_DURATION = 3600
+
+
+def run_real_time(occupancy_log: OccupancyLog, duration: float):
+    add_durations = []
+    frame_interval = 1 / FRAME_RATE
+    next_frame_time = time.monotonic()
+    for frame_number in range(int(duration * FRAME_RATE)):
+        next_frame_time += frame_interval
+        time.sleep(max(0.0, next_frame_time - time.monotonic()))
+        start_time = time.perf_counter()
+        occupancy_log.add(time.time(), np.random.uniform(0, 5), frame_number)
+        add_durations.append(time.perf_counter() - start_time)
+
+    flush_start_time = time.perf_counter()
+    occupancy_log.flush()
+    add_durations_us = np.array(add_durations) * 1e6
+    print(f'# real time {FRAME_RATE} Hz, {len(add_durations)} rows: add() mean {np.mean(add_durations_us):.1f} us, '
+          f'p99 {np.percentile(add_durations_us, 99):.1f} us, max {np.max(add_durations_us):.1f} us; '
+          f'final flush {(time.perf_counter() - flush_start_time) * 1000:.1f} ms; stats {occupancy_log.get_stats()}')
+
+
+def run_burst(occupancy_log: OccupancyLog):
+    start_timestamp = time.time()
+    start_time = time.perf_counter()
+    for row_number in range(NUMBER_OF_BURST_ROWS):
+        occupancy_log.add(start_timestamp + row_number / FRAME_RATE, 1.0, row_number)
+    occupancy_log.flush()
+    rows_per_second = NUMBER_OF_BURST_ROWS / (time.perf_counter() - start_time)
+    print(f'# burst: {rows_per_second:.0f} rows/s ({rows_per_second / FRAME_RATE:.0f}x the {FRAME_RATE} Hz frame rate)')
+    return start_timestamp
+
+
+def run_query(occupancy_log: OccupancyLog, start_timestamp: float):
+    query_start_timestamp = start_timestamp + NUMBER_OF_BURST_ROWS / FRAME_RATE / 2
+    start_time = time.perf_counter()
+    rows = occupancy_log.query(query_start_timestamp, query_start_timestamp + QUERY_RANGE_DURATION)
+    query_ms = (time.perf_counter() - start_time) * 1000
+    print(f'# query of {QUERY_RANGE_DURATION} s range: {len(rows)} rows in {query_ms:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=20, help='duration of the real-time run [s]')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        occupancy_log = OccupancyLog(os.path.join(temp_dir, 'occupancy.sqlite'), commit_interval=1.0)
+        occupancy_log.start()
+        run_real_time(occupancy_log, args.duration)
+        start_timestamp = run_burst(occupancy_log)
+        run_query(occupancy_log, start_timestamp)
+        os._exit(0)  # the writing thread is not stoppable
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,23 @@
+"""
+Time of reading single frames from the IR camera, and the overhead of the pipeline instrumentation
+(FrameTimestamps and PipelineMetrics of all stages of a frame) relative to the frame time.
+
+Run from data_collection directory (on the Raspberry Pi, or with --replay on any machine):
+    python misc/performance_test.py [--doubled_freq_hz 4] [--frames 20] [--replay <recorded data>]
+"""
+
+import argparse
+import os
+import sys
 import time
 
-from data_collection.src.devices.ir_camera import IrCamera
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from frame_publication import FrameTimestamps  # noqa: E402
+from pipeline_metrics import (OUTPUTS, QUANTILES, STAGE_FRAMES_WRITE, STAGE_HTTP_ENCODE, STAGE_HTTP_SEND,  # noqa: E402
+                              STAGE_I2C_READ, STAGE_INFERENCE, STAGE_QUEUE_WAIT, STAGE_VIDEO_WRITE, PipelineMetrics)
+
+
+NUMBER_OF_INSTRUMENTED_FRAMES = 20000
 
 
 def timed(f):
@@ -8,27 +25,76 @@ def timed(f):
     Just add decorator to the function
     """
     def wrap(*args, **kw):
-        start_time = time.time()
+        start_time = time.monotonic()
         result = f(*args, **kw)
-        end_time = time.time()
+        end_time = time.monotonic()
         duration_ms = (end_time - start_time) * 1000
         print(f'# {f.__name__}: {duration_ms:.3f} ms')
         return result
     return wrap
 
 
-ir_camera = RgbCamera()
+def create_ir_camera(args):
+    if args.replay is not None:
+        from devices.replay_ir_camera import ReplayIrCamera
+        return ReplayIrCamera(args.replay, speed=1)
+    from devices.ir_camera import IrCamera
+    return IrCamera(doubled_freq_hz=args.doubled_freq_hz)
 
 
-@timed
-def get_single_frame():
-    ir_camera.get_frame()
+def measure_instrumentation_duration(expected_fps) -> float:
+    """ :return: time of the instrumentation of one frame passing all stages [s] """
+    pipeline_metrics = PipelineMetrics(expected_fps=expected_fps)
+    start_time = time.perf_counter()
+    for _ in range(NUMBER_OF_INSTRUMENTED_FRAMES):
+        timestamps = FrameTimestamps(read_start=time.monotonic())
+        timestamps.read_end = time.monotonic()
+        pipeline_metrics.record_acquired_frame(timestamps)
+        timestamps.enqueue = timestamps.dequeue = time.monotonic()
+        timestamps.frames_written = timestamps.video_written = time.monotonic()
+        timestamps.inference_start = timestamps.inference_end = time.monotonic()
+        timestamps.encode_start = timestamps.encode_end = timestamps.sent = time.monotonic()
+        for stage in [STAGE_QUEUE_WAIT, STAGE_FRAMES_WRITE, STAGE_VIDEO_WRITE, STAGE_INFERENCE,
+                      STAGE_HTTP_ENCODE, STAGE_HTTP_SEND]:
+            pipeline_metrics.record_stage(stage, 0.001)
+        for output in OUTPUTS:
+            pipeline_metrics.record_output(output, timestamps, time.monotonic())
+    return (time.perf_counter() - start_time) / NUMBER_OF_INSTRUMENTED_FRAMES
 
 
-if __name__ == '__main__':
-    while 1:
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--doubled_freq_hz', type=int, default=4, help='refresh rate of the camera')
+    parser.add_argument('--frames', type=int, default=20, help='number of frames to read')
+    parser.add_argument('--replay', default=None, help='replay recorded data instead of using the camera')
+    args = parser.parse_args()
+
+    ir_camera = create_ir_camera(args)
+    pipeline_metrics = PipelineMetrics(expected_fps=ir_camera.get_fps())
+
+    @timed
+    def get_single_frame():
+        timestamps = FrameTimestamps(read_start=time.monotonic())
+        ir_camera.get_frame()
+        timestamps.read_end = time.monotonic()
+        pipeline_metrics.record_acquired_frame(timestamps)
+
+    for _ in range(args.frames):
         get_single_frame()
 
+    read_durations = pipeline_metrics.get_stage_histogram(STAGE_I2C_READ).get_quantiles(QUANTILES)
+    print('# frame read time: ' + ', '.join(f'p{quantile * 100:g} {duration * 1000:.1f} ms'
+                                            for quantile, duration in zip(QUANTILES, read_durations)))
+
+    frame_time = 1 / ir_camera.get_fps()
+    instrumentation_duration = measure_instrumentation_duration(ir_camera.get_fps())
+    print(f'# instrumentation of all stages: {instrumentation_duration * 1e6:.1f} us per frame, '
+          f'{instrumentation_duration / frame_time * 100:.4f}% of the frame time ({frame_time * 1000:.1f} ms)')
+
+
+if __name__ == '__main__':
+    main()
+
 """
 At refresh rate of 8Hz:
 
@@ -0,0 +1,151 @@
+"""
+Offline rendering of the IR preview videos of recorded batches - for batches recorded with `--raw_only` (raw frames
+only, without 'ir.avi'), or to render them again with another zoom or format. Meant for a workstation.
+
+Recordings ('ir_000.bin', ..., also compressed and in the sensor subdirectories) are rendered in a pool
+of processes, one recording per task - each worker call reads and renders all frames of a recording.
+Formats: avi - 'ir.avi' as recorded on the device (MJPG), mp4 - 'ir.mp4', png - 'ir_png/000000.png', ...
+Existing outputs (also compressed ones) are skipped unless --overwrite is given.
+
+Run from data_collection directory:
+    python misc/render_batches.py <batch directory | directory with batches | data directory> [...]
+        [--format avi|mp4|png] [--zoom 8] [--workers N] [--overwrite]
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from batch_archive import find_batch_file, get_original_file_path  # noqa: E402
+from ir_frame_recorder import VIDEO_FOURCC, VIDEO_MAX_TEMP, VIDEO_MIN_TEMP  # noqa: E402
+from ir_frame_recording import IrFrameBinaryReader, get_chunk_file_path  # noqa: E402
+from thermal_renderer import ThermalRenderer  # noqa: E402
+
+
+FORMAT_AVI = 'avi'
+FORMAT_MP4 = 'mp4'
+FORMAT_PNG = 'png'
+FORMATS = [FORMAT_AVI, FORMAT_MP4, FORMAT_PNG]
+_FOURCCS = {FORMAT_AVI: VIDEO_FOURCC, FORMAT_MP4: 'mp4v'}
+DEFAULT_FPS = 2  # for recordings without metadata and timestamps
+
+
+def find_recordings(paths) -> list:
+    """ :return: file path prefixes of the IR frames recordings found in the paths (recursively) """
+    first_chunk_suffix = get_chunk_file_path('', 0)
+    prefixes = set()
+    for path in paths:
+        for dir_path, _, file_names in os.walk(path):
+            for file_name in file_names:
+                original_file_path = get_original_file_path(os.path.join(dir_path, file_name))
+                if original_file_path.endswith(first_chunk_suffix):
+                    prefixes.add(original_file_path[:-len(first_chunk_suffix)])
+    return sorted(prefixes)
+
+
+def get_output_path(frames_file_path_prefix, output_format) -> str:
+    """ Video file, or directory of the PNG images """
+    if output_format == FORMAT_PNG:
+        return frames_file_path_prefix + '_png'
+    return frames_file_path_prefix + '.' + output_format
+
+
+def get_fps(reader: IrFrameBinaryReader) -> float:
+    fps = reader.get_metadata().get('fps')
+    if fps:
+        return fps
+    timestamps = reader.get_all_timestamps()
+    if len(timestamps) > 1 and timestamps[-1] > timestamps[0]:
+        return (len(timestamps) - 1) / (timestamps[-1] - timestamps[0])
+    return DEFAULT_FPS
+
+
+def render_recording(frames_file_path_prefix, output_format, zoom, overwrite) -> dict:
+    """ Worker task - render one recording. The output is written under a temporary name and renamed at the end """
+    output_path = get_output_path(frames_file_path_prefix, output_format)
+    if not overwrite and (os.path.isdir(output_path) or find_batch_file(output_path)):
+        return {'prefix': frames_file_path_prefix, 'frames': 0, 'skipped': True}
+
+    start_time = time.monotonic()
+    reader = IrFrameBinaryReader(frames_file_path_prefix)
+    frames = reader.get_all_frames()
+    renderer = ThermalRenderer(resolution=reader.resolution, zoom=zoom)
+    frame_buffer = renderer.create_output_buffer()
+    temp_output_path = get_output_path(frames_file_path_prefix + '.tmp', output_format)
+
+    if output_format == FORMAT_PNG:
+        os.makedirs(temp_output_path, exist_ok=True)
+        for frame_number, frame in enumerate(frames):
+            renderer.render(frame, min_temp=VIDEO_MIN_TEMP, max_temp=VIDEO_MAX_TEMP, as_bgr=True, out=frame_buffer)
+            cv2.imwrite(os.path.join(temp_output_path, f'{frame_number:06}.png'), frame_buffer)
+    else:
+        video_writer = cv2.VideoWriter(temp_output_path, cv2.VideoWriter_fourcc(*_FOURCCS[output_format]),
+                                       get_fps(reader), renderer.output_size_cv)
+        for frame in frames:
+            renderer.render(frame, min_temp=VIDEO_MIN_TEMP, max_temp=VIDEO_MAX_TEMP, as_bgr=True, out=frame_buffer)
+            video_writer.write(frame_buffer)
+        video_writer.release()
+
+    _remove_output(output_path)
+    os.replace(temp_output_path, output_path)
+    return {'prefix': frames_file_path_prefix, 'frames': len(frames), 'skipped': False,
+            'duration': time.monotonic() - start_time}
+
+
+def _remove_output(output_path):
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+    existing_file_path = find_batch_file(output_path)
+    while existing_file_path is not None:
+        os.remove(existing_file_path)
+        existing_file_path = find_batch_file(output_path)
+
+
+def _render_recording_task(task) -> dict:
+    try:
+        return render_recording(*task)
+    except Exception as e:
+        return {'prefix': task[0], 'frames': 0, 'skipped': False, 'error': repr(e)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='batch directories or directories with batches (searched recursively)')
+    parser.add_argument('--format', choices=FORMATS, default=FORMAT_AVI)
+    parser.add_argument('--zoom', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--overwrite', action='store_true', help='render also recordings which have the output')
+    args = parser.parse_args()
+
+    prefixes = find_recordings(args.paths)
+    print(f'# {len(prefixes)} recordings, {args.workers} workers')
+    tasks = [(prefix, args.format, args.zoom, args.overwrite) for prefix in prefixes]
+    start_time = time.monotonic()
+    results = []
+    with multiprocessing.Pool(args.workers) as pool:
+        for result in pool.imap_unordered(_render_recording_task, tasks):
+            results.append(result)
+            if 'error' in result:
+                print(f"{result['prefix']}: failed - {result['error']}")
+            elif result['skipped']:
+                print(f"{result['prefix']}: skipped ({get_output_path(result['prefix'], args.format)} exists)")
+            else:
+                print(f"{result['prefix']}: {result['frames']} frames in {result['duration']:.1f} s")
+    duration = time.monotonic() - start_time
+
+    number_of_frames = sum(result['frames'] for result in results)
+    number_of_rendered = sum(1 for result in results if not result['skipped'] and 'error' not in result)
+    number_of_failed = sum(1 for result in results if 'error' in result)
+    print(f'# rendered {number_of_rendered} recordings, {number_of_frames} frames in {duration:.1f} s '
+          f'({number_of_frames / duration if duration else 0.0:.0f} frames/s), {number_of_failed} failed')
+    sys.exit(1 if number_of_failed else 0)
+
+
+if __name__ == '__main__':
+    main()
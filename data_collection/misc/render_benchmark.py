@@ -0,0 +1,87 @@
+"""
+Compare the legacy per-frame rendering (IrFrameCollector.raw_frame_to_frame_for_video + rotate/flip
+as done in the server) with the LUT based ThermalRenderer.
+
+Run from data_collection directory:
+    python misc/render_benchmark.py
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from matplotlib import pyplot as plt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from thermal_renderer import ThermalRenderer  # noqa: E402
+
+
+RESOLUTION = (24, 32)
+ZOOM = 8
+NUMBER_OF_FRAMES = 2000
+_colormap = plt.get_cmap('inferno')
+
+
+def legacy_raw_frame_to_frame_for_video(raw_frame, min_temp=None, max_temp=None, as_bgr=True):
+    frame_2d = np.reshape(raw_frame, RESOLUTION)
+    frame_resized_not_clipped = cv2.resize(
+        src=frame_2d, dsize=(RESOLUTION[1] * ZOOM, RESOLUTION[0] * ZOOM), interpolation=cv2.INTER_CUBIC)
+    if min_temp is None:
+        min_temp = np.min(raw_frame)
+    if max_temp is None:
+        max_temp = np.max(raw_frame)
+    frame_resized = np.clip(frame_resized_not_clipped, min_temp, max_temp)
+    frame_resized_normalized = (frame_resized - min_temp) * (255 / (max_temp - min_temp))
+    frame_resized_normalized_u8 = frame_resized_normalized.astype(np.uint8)
+    heatmap_u8 = (_colormap(frame_resized_normalized_u8) * 2**8).astype(np.uint8)[:, :, :3]
+    if as_bgr:
+        return cv2.cvtColor(heatmap_u8, cv2.COLOR_RGB2BGR)
+    return heatmap_u8
+
+
+def legacy_stream_frame(raw_frame):
+    video_frame_3d = legacy_raw_frame_to_frame_for_video(raw_frame, min_temp=18, max_temp=35, as_bgr=False)
+    video_frame_3d = cv2.rotate(video_frame_3d, cv2.ROTATE_90_CLOCKWISE)
+    return cv2.flip(video_frame_3d, 0)
+
+
+def timed_per_frame_ms(function, frames):
+    start_time = time.perf_counter()
+    for frame in frames:
+        function(frame)
+    return (time.perf_counter() - start_time) * 1000 / len(frames)
+
+
+def main():
+    frames = [np.random.uniform(18, 35, RESOLUTION[0] * RESOLUTION[1]) for _ in range(NUMBER_OF_FRAMES)]
+
+    video_renderer = ThermalRenderer(resolution=RESOLUTION, zoom=ZOOM)
+    video_buffer = video_renderer.create_output_buffer()
+    stream_renderer = ThermalRenderer(resolution=RESOLUTION, zoom=ZOOM,
+                                      rotation=cv2.ROTATE_90_CLOCKWISE, flip_code=0)
+    stream_buffer = stream_renderer.create_output_buffer()
+
+    results = [
+        ('video (BGR)', 'legacy', timed_per_frame_ms(
+            lambda f: legacy_raw_frame_to_frame_for_video(f, min_temp=18, max_temp=35), frames)),
+        ('video (BGR)', 'renderer', timed_per_frame_ms(
+            lambda f: video_renderer.render(f, min_temp=18, max_temp=35, as_bgr=True, out=video_buffer), frames)),
+        ('stream (RGB, rotated)', 'legacy', timed_per_frame_ms(legacy_stream_frame, frames)),
+        ('stream (RGB, rotated)', 'renderer', timed_per_frame_ms(
+            lambda f: stream_renderer.render(f, min_temp=18, max_temp=35, as_bgr=False, out=stream_buffer), frames)),
+    ]
+    for i in range(0, len(results), 2):
+        name, _, legacy_ms = results[i]
+        _, _, renderer_ms = results[i + 1]
+        print(f'# {name}: legacy {legacy_ms:.3f} ms, renderer {renderer_ms:.3f} ms '
+              f'(x{legacy_ms / renderer_ms:.1f})')
+
+    legacy = legacy_stream_frame(frames[0]).astype(int)
+    new = stream_renderer.render(frames[0], min_temp=18, max_temp=35, as_bgr=False).astype(int)
+    print(f'# mean absolute pixel difference legacy vs renderer: {np.mean(np.abs(legacy - new)):.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Soak test of the data collection service (threaded mode) with replayed data - reports throughput and memory (RSS)
+over a simulated long run (24 h by default). Everything runs as in main.py: acquisition, recording with batch
+rotation, inference, occupancy log and the HTTP server with streaming clients polling it.
+Finished batches are deleted, to keep the disk usage bounded.
+
+Run from data_collection directory:
+    python misc/soak_test.py --replay <batch directory | directory with batches | HDF file | directory with HDFs>
+    python misc/soak_test.py --synthetic --random_weights   (no recording or model needed)
+Options: [--simulated_hours 24] [--speed 300] [--clients 2]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from data_collector import DataCollector  # noqa: E402
+from devices.replay_ir_camera import ReplayIrCamera  # noqa: E402
+from devices.replay_rgb_camera import ReplayRgbCamera  # noqa: E402
+from ir_frame_collector import IrFrameCollector  # noqa: E402
+from ir_frame_recording import IrFrameBinaryWriter  # noqa: E402
+from occupancy_log import OccupancyLog  # noqa: E402
+from trained_model.frame_processor import DEFAULT_MODEL_PATH, FrameProcessor  # noqa: E402
+import server  # noqa: E402
+
+
+SERVER_URL = 'http://127.0.0.1:8888'
+SIMULATED_BATCH_DURATION = 4 * 60  # as in main.py
+NUMBER_OF_REPORTS = 24
+SYNTHETIC_FRAME_RATE = 4 / 2 / 1.02
+SYNTHETIC_RECORDING_DURATION = 10 * 60
+
+
+def get_rss_mb() -> float:
+    with open('/proc/self/status') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def create_synthetic_recording(batch_dir_path):
+    """ Recording with a few people (warm blobs) walking around """
+    os.makedirs(batch_dir_path)
+    writer = IrFrameBinaryWriter(os.path.join(batch_dir_path, 'ir'), resolution=ReplayIrCamera.RESOLUTION)
+    y, x = np.mgrid[0:ReplayIrCamera.RESOLUTION[0], 0:ReplayIrCamera.RESOLUTION[1]]
+    positions = np.random.uniform((0, 0), ReplayIrCamera.RESOLUTION, (3, 2))
+    for frame_number in range(int(SYNTHETIC_RECORDING_DURATION * SYNTHETIC_FRAME_RATE)):
+        positions = np.clip(positions + np.random.normal(0, 0.3, positions.shape), 0, ReplayIrCamera.RESOLUTION)
+        frame = np.full(ReplayIrCamera.RESOLUTION, 21.0) + np.random.normal(0, 0.3, ReplayIrCamera.RESOLUTION)
+        for position_y, position_x in positions:
+            frame += 10 * np.exp(-((y - position_y) ** 2 + (x - position_x) ** 2) / 4)
+        writer.write_frame(timestamp=frame_number / SYNTHETIC_FRAME_RATE, data=frame.flatten())
+    writer.close()
+
+
+def run_streaming_client(url):
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=10) as response:
+                while True:
+                    response.read(4096)
+        except Exception:
+            time.sleep(1)
+
+
+def run_polling_client():
+    while True:
+        try:
+            urllib.request.urlopen(SERVER_URL + '/people', timeout=10).read()
+            urllib.request.urlopen(SERVER_URL + '/people/history?resolution=10s', timeout=10).read()
+        except Exception:
+            pass
+        time.sleep(1)
+
+
+def wait_for_server():
+    while True:
+        try:
+            urllib.request.urlopen(SERVER_URL + '/status', timeout=1).read()
+            return
+        except Exception:
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', help='recorded data to replay')
+    parser.add_argument('--synthetic', action='store_true', help='replay a generated recording')
+    parser.add_argument('--simulated_hours', type=float, default=24)
+    parser.add_argument('--speed', type=float, default=300, help='replay speed, 0 - as fast as possible')
+    parser.add_argument('--clients', type=int, default=2, help='number of streaming clients')
+    parser.add_argument('--model_path', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--random_weights', action='store_true', help='use a random model instead of the checkpoint')
+    args = parser.parse_args()
+    if (args.replay is None) == (not args.synthetic):
+        parser.error('one of --replay or --synthetic is required')
+
+    temp_dir = tempfile.mkdtemp()
+    replay_path = os.path.abspath(args.replay) if args.replay else os.path.join(temp_dir, 'synthetic', '000')
+    model_path = os.path.abspath(args.model_path)
+    work_dir_path = os.path.join(temp_dir, 'src')  # DataCollector records to '../data'
+    os.makedirs(work_dir_path)
+    os.chdir(work_dir_path)
+    if args.synthetic:
+        create_synthetic_recording(replay_path)
+    if args.random_weights:
+        sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+        from inference_optimization_check import create_random_checkpoint
+        model_path = create_random_checkpoint(temp_dir)
+
+    ir_camera = ReplayIrCamera(replay_path, speed=args.speed)
+    rgb_camera = ReplayRgbCamera(replay_path, fps=4, resolution=(1920 // 8, 1080 // 8), speed=1)
+    ir_frame_collector = IrFrameCollector(ir_camera=ir_camera, video_zoom=8, save_video=True,
+                                          frame_processor=FrameProcessor(optimized=True, model_path=model_path))
+    occupancy_log = OccupancyLog(os.path.join(temp_dir, 'occupancy.sqlite'))
+    ir_frame_collector.get_inference_worker().add_result_listener(occupancy_log.add_inference_result)
+    occupancy_log.start()
+    ir_frame_collector.start()
+    threading.Thread(target=server.run_server, args=(ir_frame_collector, rgb_camera, occupancy_log),
+                     daemon=True).start()
+    wait_for_server()
+    for client_number in range(args.clients):
+        stream_url = SERVER_URL + ('/processed_ir_video?format=jpeg' if client_number % 2 else '/ir_video?format=png')
+        threading.Thread(target=run_streaming_client, args=(stream_url,), daemon=True).start()
+    threading.Thread(target=run_polling_client, daemon=True).start()
+
+    data_collector = DataCollector(ir_frame_collector=ir_frame_collector, rgb_camera=rgb_camera)
+    data_collector.start_batch_recording()
+    batch_dir_path = data_collector._batch_subdir_path
+    next_batch_time = SIMULATED_BATCH_DURATION
+
+    source_fps = ir_camera.get_source_fps()
+    simulated_duration = args.simulated_hours * 3600
+    report_interval = simulated_duration / NUMBER_OF_REPORTS
+    next_report_time = report_interval
+    start_time = time.monotonic()
+    rss_samples = []
+    print(f'# replaying at {source_fps:.2f} fps x{args.speed or "max"}, {args.clients} streaming clients')
+    print(f'{"simulated [h]":>13} {"real [s]":>9} {"frames":>9} {"fps":>8} {"inferences":>10} '
+          f'{"log rows":>9} {"RSS [MB]":>9}')
+    while True:
+        time.sleep(0.1)
+        simulated_time = ir_camera.get_number_of_replayed_frames() / source_fps
+        if simulated_time >= next_batch_time:
+            data_collector.finish_batch_recording()
+            shutil.rmtree(batch_dir_path, ignore_errors=True)
+            data_collector.start_batch_recording()
+            batch_dir_path = data_collector._batch_subdir_path
+            next_batch_time += SIMULATED_BATCH_DURATION
+        if simulated_time >= next_report_time:
+            real_time = time.monotonic() - start_time
+            number_of_frames = ir_camera.get_number_of_replayed_frames()
+            rss_samples.append((simulated_time / 3600, get_rss_mb()))
+            print(f'{simulated_time / 3600:>13.1f} {real_time:>9.0f} {number_of_frames:>9} '
+                  f'{number_of_frames / real_time:>8.1f} '
+                  f'{ir_frame_collector.get_inference_stats()["worker"]["processed_frames"]:>10} '
+                  f'{occupancy_log.get_stats()["rows_written"]:>9} {rss_samples[-1][1]:>9.1f}')
+            sys.stdout.flush()
+            next_report_time += report_interval
+        if simulated_time >= simulated_duration:
+            break
+
+    # growth after the warm-up (first report), when caches and ring buffers are already filled
+    hours, rss = np.array(rss_samples[1:]).T if len(rss_samples) > 2 else np.array(rss_samples).T
+    rss_growth_per_hour = np.polyfit(hours, rss, 1)[0] if len(hours) > 1 else float('nan')
+    print(f'# RSS growth after warm-up: {rss_growth_per_hour:.2f} MB per simulated hour, '
+          f'{rss[-1] - rss[0]:.1f} MB in total')
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os._exit(0)  # threads are not stoppable
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compare encode time and size of the IR stream frames for the available stream formats
+(and the pure-Python pypng encoder used previously, if installed).
+
+Run from data_collection directory:
+    python misc/stream_encoding_benchmark.py
+"""
+
+import os
+import sys
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from stream_encoders import FORMAT_JPEG, FORMAT_PNG, FORMAT_WEBP, StreamFrameEncoder, get_supported_formats  # noqa
+from thermal_renderer import ThermalRenderer  # noqa: E402
+
+
+RESOLUTION = (24, 32)
+ZOOM = 8
+NUMBER_OF_FRAMES = 200
+ENCODER_OPTIONS = [
+    (FORMAT_JPEG, 50),
+    (FORMAT_JPEG, 80),
+    (FORMAT_JPEG, 95),
+    (FORMAT_PNG, 0),
+    (FORMAT_PNG, 1),
+    (FORMAT_PNG, 3),
+    (FORMAT_PNG, 9),
+    (FORMAT_WEBP, 50),
+    (FORMAT_WEBP, 80),
+    (FORMAT_WEBP, 100),
+]
+
+
+def get_test_frames():
+    """ Smooth frames with a few warm blobs, closer to the real sensor data than uniform noise """
+    y, x = np.mgrid[0:RESOLUTION[0], 0:RESOLUTION[1]]
+    frames = []
+    for _ in range(NUMBER_OF_FRAMES):
+        frame = np.full(RESOLUTION, 21.0) + np.random.normal(0, 0.3, RESOLUTION)
+        for _ in range(np.random.randint(0, 4)):
+            center_y, center_x = np.random.uniform(0, RESOLUTION[0]), np.random.uniform(0, RESOLUTION[1])
+            frame += 10 * np.exp(-((y - center_y) ** 2 + (x - center_x) ** 2) / 8)
+        frames.append(frame.flatten())
+    return frames
+
+
+def encode_with_pypng(png_module, frame_bgr):
+    frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+    frame_png = png_module.from_array(frame_rgb.reshape(frame_rgb.shape[0], -1), 'RGB')
+    output = BytesIO()
+    frame_png.write(output)
+    return output.getvalue()
+
+
+def benchmark(name, encode_function, rendered_frames):
+    start_time = time.perf_counter()
+    encoded_sizes = [len(encode_function(frame)) for frame in rendered_frames]
+    encode_ms = (time.perf_counter() - start_time) * 1000 / len(rendered_frames)
+    print(f'{name:<16} {encode_ms:>10.3f} {np.mean(encoded_sizes):>14.0f}')
+
+
+def main():
+    renderer = ThermalRenderer(resolution=RESOLUTION, zoom=ZOOM, rotation=cv2.ROTATE_90_CLOCKWISE, flip_code=0)
+    rendered_frames = [renderer.render(frame, min_temp=18, max_temp=35, as_bgr=True) for frame in get_test_frames()]
+    print(f'# {len(rendered_frames)} frames {rendered_frames[0].shape[1]}x{rendered_frames[0].shape[0]}')
+    print(f'{"encoder":<16} {"encode [ms]":>10} {"bytes/frame":>14}')
+
+    try:
+        import png
+        benchmark('pypng', lambda frame: encode_with_pypng(png, frame), rendered_frames)
+    except ImportError:
+        print('pypng not installed - skipping')
+
+    supported_formats = get_supported_formats()
+    for format_name, quality in ENCODER_OPTIONS:
+        if format_name not in supported_formats:
+            print(f'{format_name} not supported by OpenCV - skipping')
+            continue
+        encoder = StreamFrameEncoder(format_name, quality)
+        benchmark(f'{format_name} q={quality}', encoder.encode, rendered_frames)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Activity detection for the activity-triggered recording - batches are recorded only while something happens in the
+room (see DataCollector), instead of 24/7 also when the room is empty and every frame is just background.
+
+The change score of a frame is the fraction of its pixels which differ from a running background of the sensor
+(exponential moving average of its frames) by more than `pixel_threshold`. Activity is triggered when the score
+of any sensor reaches `min_changed_fraction`, or when the inference counts at least `min_people_count` people
+(people sitting still blend into the background after a while). It is held for `post_roll_duration` after the last
+trigger. The frames before the trigger (pre-roll) are kept by IrFrameRecorder.
+"""
+
+import logging
+import math
+import threading
+import time
+from typing import Union
+
+import numpy as np
+
+from frame_publication import IrFrame
+from inference_worker import InferenceResult
+from pipeline_metrics import MetricRegistry
+
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityMonitor:
+    """ Change scores of the frames of all sensors and the people count, see the module docstring """
+
+    def __init__(self, pixel_threshold=1.0, min_changed_fraction=0.01, background_time_constant=60.0,
+                 min_people_count=0.5, post_roll_duration=30.0):
+        """
+        :param pixel_threshold: [deg C] difference from the background of a changed pixel
+        :param background_time_constant: [s] of the running background, a change blends into it in a few of them
+        :param min_people_count: None - the people count does not trigger the activity
+        """
+        self._pixel_threshold = pixel_threshold
+        self._min_changed_fraction = min_changed_fraction
+        self._background_time_constant = background_time_constant
+        self._min_people_count = min_people_count
+        self._post_roll_duration = post_roll_duration
+        self._lock = threading.Lock()
+        self._backgrounds = {}  # sensor_name: (np.ndarray, timestamp of the last frame)
+        self._difference_buffers = {}  # sensor_name: (difference, absolute difference, changed pixels mask)
+        self._change_scores = {}  # sensor_name: score of the latest frame
+        self._people_count = None  # type: Union[float, None]
+        self._last_trigger_time = None  # type: Union[float, None]  # time.time()
+        self._last_trigger_reason = ''
+        self._number_of_triggered_frames = 0
+        self._number_of_frames = 0
+
+    def add_frame(self, sensor_name: str, frame: IrFrame):
+        """ To be registered as a frame listener of the sensors (called from their reading threads) """
+        with self._lock:
+            background, previous_timestamp = self._backgrounds.get(sensor_name, (None, None))
+            if background is None:
+                background = np.array(frame.data, dtype=np.float64)
+                self._backgrounds[sensor_name] = (background, frame.timestamp)
+                # preallocated, not to allocate temporary arrays for every frame
+                self._difference_buffers[sensor_name] = (np.zeros(background.shape), np.zeros(background.shape),
+                                                         np.zeros(background.shape, dtype=bool))
+                return
+            difference, absolute_difference, is_changed = self._difference_buffers[sensor_name]
+            np.copyto(difference, frame.data)  # a ufunc on float32 frame and float64 background would allocate
+            np.subtract(difference, background, out=difference)
+            np.absolute(difference, out=absolute_difference)
+            np.greater(absolute_difference, self._pixel_threshold, out=is_changed)
+            changed_fraction = np.count_nonzero(is_changed) / is_changed.size
+            weight = 1 - math.exp(-max(0.0, frame.timestamp - previous_timestamp) / self._background_time_constant)
+            np.multiply(difference, weight, out=difference)
+            np.add(background, difference, out=background)
+            self._backgrounds[sensor_name] = (background, frame.timestamp)
+            self._change_scores[sensor_name] = changed_fraction
+            self._number_of_frames += 1
+            if changed_fraction >= self._min_changed_fraction:
+                self._number_of_triggered_frames += 1
+                self._trigger(frame.timestamp, f"change score {changed_fraction:.3f} of sensor '{sensor_name}'")
+
+    def add_people_count(self, timestamp: float, people_count: float, sequence_number: int = 0):
+        """ To be registered as a people count listener (e.g. IrSensorGroup.add_people_count_listener) """
+        with self._lock:
+            self._people_count = people_count
+            if self._min_people_count is not None and people_count >= self._min_people_count:
+                self._trigger(timestamp, f"people count {people_count:.1f}")
+
+    def add_inference_result(self, inference_result: InferenceResult):
+        """ To be registered as an inference result listener of a single sensor """
+        self.add_people_count(inference_result.frame_timestamp, inference_result.people_count,
+                              inference_result.frame_sequence_number)
+
+    def is_active(self) -> bool:
+        """ Activity triggered within the post-roll duration """
+        last_trigger_time = self._last_trigger_time
+        return last_trigger_time is not None and time.time() - last_trigger_time <= self._post_roll_duration
+
+    def get_last_trigger_reason(self) -> str:
+        return self._last_trigger_reason
+
+    def get_stats(self) -> dict:
+        last_trigger_time = self._last_trigger_time
+        return {
+            'active': self.is_active(),
+            'change_scores': dict(self._change_scores),
+            'people_count': self._people_count,
+            'seconds_since_trigger': time.time() - last_trigger_time if last_trigger_time is not None else None,
+            'last_trigger_reason': self._last_trigger_reason,
+            # fraction of the frames over the change score threshold
+            'triggered_frames_ratio': self._number_of_triggered_frames / self._number_of_frames
+            if self._number_of_frames else 0.0,
+        }
+
+    def add_metrics(self, metric_registry: MetricRegistry):
+        metric_registry.add_gauge('activity_change_score', 'Fraction of the pixels of the latest frame differing '
+                                  'from the background', lambda: dict(self._change_scores), label_name='sensor')
+        metric_registry.add_gauge('activity_present', 'Activity triggered within the post-roll duration (0 or 1)',
+                                  lambda: float(self.is_active()))
+
+    def _trigger(self, timestamp: float, reason: str):
+        if not self.is_active():
+            logger.info(f"Activity triggered by {reason}")
+        self._last_trigger_time = max(timestamp, self._last_trigger_time or timestamp)
+        self._last_trigger_reason = reason
@@ -0,0 +1,94 @@
+"""
+Incremental per-pixel model of the empty-room background, to skip the inference of frames without people
+(see InferenceResultCache) - the model is the most expensive stage of the pipeline, and in an empty room
+every frame is just background.
+
+The running mean and variance of every pixel (exponentially weighted, with slow adaptation) are not updated
+where the model detected people. A frame is empty when no pixel exceeds its background mean by more than
+`margin + std_factor * std`. The inference of an empty frame is skipped (reported as 0 people with an all-zero
+density map) once the model has seen `min_frames` frames, if the latest inference detected nobody (after
+a detection the model runs on every frame until it reports an empty one), and at most `max_skipped_frames`
+in a row (then the model runs to confirm).
+The skip ratio and the accuracy impact are measured on the dataset with evaluation/evaluate_background_gate.py.
+"""
+
+from typing import Union
+
+import numpy as np
+
+
+class BackgroundModel:
+    """ Background of one sensor, see the module docstring. Not thread-safe """
+
+    def __init__(self, margin=1.0, std_factor=3.0, adaptation_rate=0.01, min_frames=16, max_skipped_frames=8,
+                 detection_density_threshold=0.05, min_people_count=0.5, initial_std=0.5):
+        """
+        :param margin: [deg C] over the background mean (plus `std_factor` standard deviations) of a non-empty pixel
+        :param adaptation_rate: weight of a new frame in the running mean and variance (per frame)
+        :param detection_density_threshold: pixels with at least this density are not updated (a detected person)
+        :param min_people_count: an inference with a lower people count detected nobody
+        :param initial_std: [deg C] of the pixels after the first frame
+        """
+        self._margin = margin
+        self._std_factor = std_factor
+        self._adaptation_rate = adaptation_rate
+        self._min_frames = min_frames
+        self._max_skipped_frames = max_skipped_frames
+        self._detection_density_threshold = detection_density_threshold
+        self._min_people_count = min_people_count
+        self._initial_variance = initial_std ** 2
+        self._mean = None  # type: Union[np.ndarray, None]
+        self._variance = None  # type: Union[np.ndarray, None]
+        self._is_latest_inference_empty = False
+        self._number_of_skipped_frames_in_row = 0
+        self._number_of_frames = 0
+        self._number_of_skipped_frames = 0
+
+    def is_empty(self, frame_data: np.ndarray) -> bool:
+        """ No pixel over the background """
+        if self._mean is None:
+            return False
+        threshold = self._mean + self._margin + self._std_factor * np.sqrt(self._variance)
+        return not np.any(np.reshape(frame_data, -1) > threshold)
+
+    def should_skip_inference(self, frame_data: np.ndarray) -> bool:
+        return (self._number_of_frames >= self._min_frames
+                and self._is_latest_inference_empty
+                and self._number_of_skipped_frames_in_row < self._max_skipped_frames
+                and self.is_empty(frame_data))
+
+    def add_frame(self, frame_data: np.ndarray, density_map: np.ndarray = None, people_count: float = None):
+        """
+        Update the background with the next frame - processed by the model (with its density map and people count)
+        or skipped (without them)
+        """
+        frame_data = np.asarray(frame_data, dtype=np.float64).reshape(-1)
+        self._number_of_frames += 1
+        if density_map is None:
+            self._number_of_skipped_frames += 1
+            self._number_of_skipped_frames_in_row += 1
+            update_mask = None
+        else:
+            self._is_latest_inference_empty = people_count < self._min_people_count
+            self._number_of_skipped_frames_in_row = 0
+            update_mask = np.reshape(density_map, -1) < self._detection_density_threshold
+
+        if self._mean is None:
+            self._mean = frame_data.copy()
+            self._variance = np.full(frame_data.shape, self._initial_variance)
+            return
+        difference = frame_data - self._mean
+        mean = self._mean + self._adaptation_rate * difference
+        variance = (1 - self._adaptation_rate) * (self._variance + self._adaptation_rate * difference ** 2)
+        if update_mask is None:
+            self._mean, self._variance = mean, variance
+        else:
+            self._mean = np.where(update_mask, mean, self._mean)
+            self._variance = np.where(update_mask, variance, self._variance)
+
+    def get_stats(self) -> dict:
+        return {
+            'frames': self._number_of_frames,
+            'skipped_frames': self._number_of_skipped_frames,
+            'skip_ratio': self._number_of_skipped_frames / self._number_of_frames if self._number_of_frames else 0.0,
+        }
@@ -0,0 +1,356 @@
+"""
+Compression and retention of the recorded batches (`../data/data__<date>/NNN__HH_MM_SS`).
+
+BatchArchiver runs in a low-priority background thread. It compresses the files of completed batches with
+stdlib codecs chosen by the file type (see CODECS_BY_EXTENSION) and writes 'manifest.json' to the batch
+directory - original and stored size and SHA-256 of the original content of every file. It deletes the oldest
+batches first when the data is over the disk quota or older than the retention time.
+
+Compressed files keep the original name with the codec extension ('ir_000.bin.xz', 'rgb.mjpeg.gz').
+Readers open them transparently with `open_batch_file` / `find_batch_file`.
+"""
+
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import os
+import shutil
+import threading
+import time
+from typing import Callable, List, Union
+
+
+logger = logging.getLogger(__name__)
+
+
+CODEC_LZMA = 'lzma'  # slow, best ratio - raw frames and text
+CODEC_ZLIB = 'zlib'  # fast (gzip container, readable by the standard tools) - already compressed video
+CODEC_FILE_EXTENSIONS = {CODEC_LZMA: '.xz', CODEC_ZLIB: '.gz'}
+CODECS_BY_EXTENSION = {
+    '.bin': CODEC_LZMA,
+    '.csv': CODEC_LZMA,
+    '.avi': CODEC_ZLIB,
+    '.mjpeg': CODEC_ZLIB,
+}  # other files (e.g. the small json metadata) are kept as they are
+LZMA_PRESET = 6
+ZLIB_LEVEL = 1
+MIN_COMPRESSION_GAIN = 0.05  # files which do not get smaller by this ratio are kept uncompressed
+MANIFEST_FILE_NAME = 'manifest.json'
+BLOCK_SIZE = 1024 * 1024
+
+
+def find_batch_file(file_path) -> Union[str, None]:
+    """ Path of the file or of its compressed version, None if there is neither """
+    for candidate_file_path in [file_path] + [file_path + extension for extension in CODEC_FILE_EXTENSIONS.values()]:
+        if os.path.isfile(candidate_file_path):
+            return candidate_file_path
+    return None
+
+
+def get_codec(file_path) -> Union[str, None]:
+    """ Codec of a compressed file (by its extension), None for an uncompressed one """
+    for codec, extension in CODEC_FILE_EXTENSIONS.items():
+        if file_path.endswith(extension):
+            return codec
+    return None
+
+
+def get_original_file_path(file_path) -> str:
+    """ Path without the codec extension """
+    codec = get_codec(file_path)
+    return file_path[:-len(CODEC_FILE_EXTENSIONS[codec])] if codec is not None else file_path
+
+
+def open_batch_file(file_path, mode='rb'):
+    """ Open a recorded file for reading, or its compressed version. `mode` - 'rb' or 'rt' """
+    found_file_path = find_batch_file(file_path)
+    if found_file_path is None:
+        raise FileNotFoundError(f"No file '{file_path}' (or compressed) found!")
+    return _open_with_codec(found_file_path, get_codec(found_file_path), mode)
+
+
+def _open_with_codec(file_path, codec: Union[str, None], mode):
+    if codec == CODEC_LZMA:
+        return lzma.open(file_path, mode, preset=LZMA_PRESET if mode.startswith('w') else None)
+    if codec == CODEC_ZLIB:
+        return gzip.open(file_path, mode, compresslevel=ZLIB_LEVEL)
+    return open(file_path, mode)
+
+
+def _read_content_info(file_path) -> tuple:
+    """ :return: size and SHA-256 of the (decompressed) content """
+    content_hash = hashlib.sha256()
+    size = 0
+    with _open_with_codec(file_path, get_codec(file_path), 'rb') as file:
+        while True:
+            block = file.read(BLOCK_SIZE)
+            if not block:
+                break
+            content_hash.update(block)
+            size += len(block)
+    return size, content_hash.hexdigest()
+
+
+def compress_file(file_path, codec: str) -> dict:
+    """
+    Replace the file with its compressed version (unless the compression does not pay off).
+    :return: manifest entry of the file
+    """
+    stored_file_path = file_path + CODEC_FILE_EXTENSIONS[codec]
+    temp_file_path = stored_file_path + '.tmp'
+    content_hash = hashlib.sha256()
+    size = 0
+    try:
+        with open(file_path, 'rb') as source_file, _open_with_codec(temp_file_path, codec, 'wb') as stored_file:
+            while True:
+                block = source_file.read(BLOCK_SIZE)
+                if not block:
+                    break
+                content_hash.update(block)
+                stored_file.write(block)
+                size += len(block)
+    except:
+        # e.g. no space left - the partial file would stay in the batch (skipped by the archiving)
+        if os.path.isfile(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+
+    stored_size = os.path.getsize(temp_file_path)
+    if stored_size > size * (1 - MIN_COMPRESSION_GAIN):
+        os.remove(temp_file_path)
+        stored_file_path, stored_size, codec = file_path, size, None
+    else:
+        shutil.copystat(file_path, temp_file_path)
+        os.replace(temp_file_path, stored_file_path)
+        os.remove(file_path)
+    return {
+        'stored_as': os.path.basename(stored_file_path),
+        'codec': codec,
+        'size': size,
+        'stored_size': stored_size,
+        'sha256': content_hash.hexdigest(),
+    }
+
+
+def read_manifest(batch_dir_path) -> Union[dict, None]:
+    """ None if the batch was not archived yet """
+    manifest_file_path = os.path.join(batch_dir_path, MANIFEST_FILE_NAME)
+    if not os.path.isfile(manifest_file_path):
+        return None
+    with open(manifest_file_path, 'rt') as file:
+        return json.loads(file.read())
+
+
+def verify_batch(batch_dir_path) -> List[str]:
+    """ :return: files of an archived batch which are missing or do not match the manifest checksums """
+    manifest = read_manifest(batch_dir_path) or {'files': {}}
+    invalid_file_names = []
+    for file_name, entry in manifest['files'].items():
+        stored_file_path = os.path.join(batch_dir_path, os.path.dirname(file_name), entry['stored_as'])
+        if not os.path.isfile(stored_file_path) \
+                or _read_content_info(stored_file_path) != (entry['size'], entry['sha256']):
+            invalid_file_names.append(file_name)
+    return invalid_file_names
+
+
+def get_batch_size(batch_dir_path) -> int:
+    """ Size of the batch files as recorded - before the compression (from the manifest) for an archived batch """
+    manifest = read_manifest(batch_dir_path)
+    if manifest is not None:
+        return manifest['size']
+    return sum(os.path.getsize(file_path) for file_path in _get_batch_file_paths(batch_dir_path))
+
+
+def _get_batch_file_paths(batch_dir_path) -> List[str]:
+    """ All files of the batch, including the sensor subdirectories """
+    file_paths = []
+    for dir_path, _, file_names in os.walk(batch_dir_path):
+        file_paths += [os.path.join(dir_path, file_name) for file_name in sorted(file_names)]
+    return file_paths
+
+
+class _BatchInfo:
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+        file_paths = _get_batch_file_paths(dir_path)
+        self.size = sum(os.path.getsize(file_path) for file_path in file_paths)
+        self.modification_time = max([os.path.getmtime(file_path) for file_path in file_paths]
+                                     + [os.path.getmtime(dir_path)])
+        self.manifest = read_manifest(dir_path)
+        # time of the recording, the archiving changes the modification time of the files and the directory
+        self.recording_time = self.manifest['recording_time'] if self.manifest is not None \
+            else self.modification_time
+
+
+class BatchArchiver:
+    """
+    Background compression and retention of the batches in `data_dir_path`, see the module docstring.
+    A batch is completed once none of its files changed for `min_batch_age` and it is not the active one.
+    """
+
+    def __init__(self, data_dir_path: str, get_active_batch_dir_path: Callable[[], str] = None,
+                 max_total_size: int = None, min_free_space: int = None, max_age: float = None,
+                 check_interval=60.0, min_batch_age=60.0, compress=True, nice_increment=19):
+        """
+        :param get_active_batch_dir_path: () -> batch being recorded (never compressed or deleted)
+        :param max_total_size: [bytes] of all batches, None - no limit
+        :param min_free_space: [bytes] on the disk of the data, None - no limit
+        :param max_age: [s] of the batches, None - no limit
+        :param nice_increment: lower priority of the archiving thread (Linux), 0 - unchanged
+        """
+        self._data_dir_path = data_dir_path
+        self._get_active_batch_dir_path = get_active_batch_dir_path or (lambda: None)
+        self._max_total_size = max_total_size
+        self._min_free_space = min_free_space
+        self._max_age = max_age
+        self._check_interval = check_interval
+        self._min_batch_age = min_batch_age
+        self._compress = compress
+        self._nice_increment = nice_increment
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__, daemon=True)
+        self._number_of_archived_batches = 0
+        self._number_of_deleted_batches = 0
+        self._number_of_saved_bytes = 0
+        self._total_size = 0
+
+    def start(self):
+        self._thread.start()
+
+    def get_stats(self) -> dict:
+        return {
+            'archived_batches': self._number_of_archived_batches,
+            'deleted_batches': self._number_of_deleted_batches,
+            'saved_bytes': self._number_of_saved_bytes,
+            'total_size': self._total_size,
+        }
+
+    def run_once(self):
+        """
+        Enforce the quota and the retention, then compress the remaining completed batches. Called by the thread.
+        Deleting first frees the space also when the compression fails (e.g. on a full disk) and does not compress
+        batches which are deleted anyway
+        """
+        batches = self._get_batches()
+        self._total_size = sum(batch.size for batch in batches)
+        completed_batches = [batch for batch in batches if self._is_completed(batch)]
+        completed_batches = self._delete_old_batches(completed_batches, total_size=self._total_size)
+        if not self._compress:
+            return
+        for batch in completed_batches:
+            if batch.manifest is None:
+                try:
+                    self.archive_batch(batch.dir_path)
+                except:
+                    logger.exception(f"Failed to archive batch '{batch.dir_path}'!")
+        self._total_size = sum(batch.size for batch in self._get_batches())
+
+    def archive_batch(self, batch_dir_path) -> dict:
+        """ Compress the files of the batch and write its manifest """
+        start_time = time.monotonic()
+        recording_time = _BatchInfo(batch_dir_path).modification_time
+        files = {}
+        for file_path in _get_batch_file_paths(batch_dir_path):
+            file_name = os.path.relpath(file_path, batch_dir_path)
+            if file_name == MANIFEST_FILE_NAME or file_path.endswith('.tmp'):
+                continue
+            original_file_path = get_original_file_path(file_path)
+            codec = CODECS_BY_EXTENSION.get(os.path.splitext(original_file_path)[1])
+            if get_codec(file_path) is not None:  # compressed before an interruption of the archiving
+                if os.path.isfile(original_file_path):
+                    continue  # compressed again from the original
+                size, content_hash = _read_content_info(file_path)
+                entry = dict(stored_as=os.path.basename(file_path), codec=get_codec(file_path), size=size,
+                             stored_size=os.path.getsize(file_path), sha256=content_hash)
+            elif codec is not None:
+                entry = compress_file(file_path, codec)
+            else:
+                size, content_hash = _read_content_info(file_path)
+                entry = dict(stored_as=os.path.basename(file_path), codec=None, size=size, stored_size=size,
+                             sha256=content_hash)
+            files[os.path.relpath(original_file_path, batch_dir_path)] = entry
+
+        manifest = {
+            'recording_time': recording_time,
+            'archiving_time': time.time(),
+            'size': sum(entry['size'] for entry in files.values()),
+            'stored_size': sum(entry['stored_size'] for entry in files.values()),
+            'files': files,
+        }
+        manifest_file_path = os.path.join(batch_dir_path, MANIFEST_FILE_NAME)
+        with open(manifest_file_path + '.tmp', 'wt') as file:
+            file.write(json.dumps(manifest, indent=2))
+        os.replace(manifest_file_path + '.tmp', manifest_file_path)
+
+        self._number_of_archived_batches += 1
+        self._number_of_saved_bytes += manifest['size'] - manifest['stored_size']
+        logger.info(f"Batch '{batch_dir_path}' archived in {time.monotonic() - start_time:.1f} s: "
+                    f"{manifest['size']} -> {manifest['stored_size']} bytes")
+        return manifest
+
+    def _get_batches(self) -> List[_BatchInfo]:
+        """ Batches of all recordings, the oldest first """
+        batches = []
+        for root_dir_name in sorted(os.listdir(self._data_dir_path)):
+            root_dir_path = os.path.join(self._data_dir_path, root_dir_name)
+            if not root_dir_name.startswith('data__') or not os.path.isdir(root_dir_path):
+                continue
+            for batch_dir_name in sorted(os.listdir(root_dir_path)):
+                batch_dir_path = os.path.join(root_dir_path, batch_dir_name)
+                if os.path.isdir(batch_dir_path):
+                    batches.append(_BatchInfo(batch_dir_path))
+        return sorted(batches, key=lambda batch: (batch.recording_time, batch.dir_path))
+
+    def _is_completed(self, batch: _BatchInfo) -> bool:
+        active_batch_dir_path = self._get_active_batch_dir_path()
+        if active_batch_dir_path and os.path.abspath(batch.dir_path) == os.path.abspath(active_batch_dir_path):
+            return False
+        # not the modification time of an archived batch - changed by the archiving
+        return time.time() - batch.recording_time >= self._min_batch_age
+
+    def _delete_old_batches(self, completed_batches: List[_BatchInfo], total_size: int) -> List[_BatchInfo]:
+        """ :return: the batches which were kept """
+        for i, batch in enumerate(completed_batches):  # the oldest first
+            reason = self._get_deletion_reason(batch, total_size)
+            if reason is None:
+                return completed_batches[i:]
+            logger.warning(f"Deleting batch '{batch.dir_path}' ({batch.size} bytes, recorded "
+                           f"{datetime.datetime.fromtimestamp(batch.recording_time):%Y-%m-%d %H:%M:%S}): {reason}")
+            shutil.rmtree(batch.dir_path, ignore_errors=True)
+            total_size -= batch.size
+            self._total_size = total_size
+            self._number_of_deleted_batches += 1
+            root_dir_path = os.path.dirname(batch.dir_path)
+            if not os.listdir(root_dir_path):
+                os.rmdir(root_dir_path)
+        return []
+
+    def _get_deletion_reason(self, batch: _BatchInfo, total_size: int) -> Union[str, None]:
+        if self._max_age is not None and time.time() - batch.recording_time > self._max_age:
+            return f'older than {self._max_age / 3600:g} h'
+        if self._max_total_size is not None and total_size > self._max_total_size:
+            return f'total size {total_size} bytes over the quota of {self._max_total_size} bytes'
+        if self._min_free_space is not None:
+            free_space = shutil.disk_usage(self._data_dir_path).free
+            if free_space < self._min_free_space:
+                return f'free space {free_space} bytes below {self._min_free_space} bytes'
+        return None
+
+    def _run(self):
+        if self._nice_increment:
+            try:
+                # on Linux the priority of a thread can be changed separately
+                thread_id = threading.get_native_id()
+                os.setpriority(os.PRIO_PROCESS, thread_id,
+                               min(19, os.getpriority(os.PRIO_PROCESS, thread_id) + self._nice_increment))
+            except (AttributeError, OSError):
+                logger.warning("Failed to lower the priority of the archiving thread")
+        logger.info(f"_run batch archiving started, data in '{self._data_dir_path}'")
+        while True:
+            try:
+                self.run_once()
+            except:
+                logger.exception("Batch archiving iteration error!")
+            time.sleep(self._check_interval)
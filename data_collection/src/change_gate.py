@@ -0,0 +1,81 @@
+"""
+Temporal change gate - reuse of the previous inference output for a frame nearly identical to the one which produced
+it (see InferenceResultCache). At 2-8 Hz the consecutive frames of people sitting still differ only by the sensor
+noise, but the model would compute the same density map again.
+
+A new frame is compared with the reference frame (the last one processed by the model), not with the previous frame,
+so that slow changes accumulate until they exceed `threshold`. The difference is the maximum absolute difference
+of the pixels ('max_abs') or their mean absolute difference ('l1'). The model runs at least every
+`max_reused_frames + 1` frames (forced refresh).
+The hit ratio and the accuracy impact are measured on the test sequences with evaluation/evaluate_change_gate.py.
+"""
+
+from typing import Tuple, Union
+
+import numpy as np
+
+
+METRIC_MAX_ABS = 'max_abs'
+METRIC_L1 = 'l1'
+METRICS = [METRIC_MAX_ABS, METRIC_L1]
+
+
+class TemporalChangeGate:
+    """ Reference frame and output of one sensor, see the module docstring. Not thread-safe """
+
+    def __init__(self, threshold=0.5, metric=METRIC_MAX_ABS, max_reused_frames=8):
+        """
+        :param threshold: [deg C] difference from the reference frame up to which its output is reused
+        :param max_reused_frames: in a row, then the model runs on the frame (forced refresh)
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+        self._threshold = threshold
+        self._metric = metric
+        self._max_reused_frames = max_reused_frames
+        self._reference_frame = None  # type: Union[np.ndarray, None]
+        self._density_map = None  # type: Union[np.ndarray, None]
+        self._people_count = 0.0
+        self._number_of_reused_frames_in_row = 0
+        self._number_of_frames = 0
+        self._number_of_reused_frames = 0
+        self._number_of_forced_refreshes = 0
+
+    def get_difference(self, frame_data: np.ndarray) -> float:
+        """ [deg C] of the frame from the reference frame, inf without one """
+        if self._reference_frame is None:
+            return float('inf')
+        difference = np.abs(np.reshape(frame_data, -1) - self._reference_frame)
+        return float(np.max(difference) if self._metric == METRIC_MAX_ABS else np.mean(difference))
+
+    def get_cached_output(self, frame_data: np.ndarray) -> Union[Tuple[np.ndarray, float], None]:
+        """
+        Density map and people count of the reference frame if they can be reused for the frame (counted as
+        a reused frame), None if the model has to run on it (then `set_output` has to be called with its output)
+        """
+        self._number_of_frames += 1
+        if self._reference_frame is None or self.get_difference(frame_data) > self._threshold:
+            return None
+        if self._number_of_reused_frames_in_row >= self._max_reused_frames:
+            self._number_of_forced_refreshes += 1
+            return None
+        self._number_of_reused_frames_in_row += 1
+        self._number_of_reused_frames += 1
+        return self._density_map, self._people_count
+
+    def set_output(self, frame_data: np.ndarray, density_map: np.ndarray, people_count: float):
+        """ The frame processed by the model becomes the reference frame """
+        self._reference_frame = np.array(frame_data, dtype=np.float64).reshape(-1)
+        self._density_map = density_map
+        self._people_count = people_count
+        self._number_of_reused_frames_in_row = 0
+
+    def get_stats(self) -> dict:
+        return {
+            'frames': self._number_of_frames,
+            'reused_frames': self._number_of_reused_frames,
+            'forced_refreshes': self._number_of_forced_refreshes,
+            'hit_ratio': self._number_of_reused_frames / self._number_of_frames if self._number_of_frames else 0.0,
+            'threshold': self._threshold,
+            'metric': self._metric,
+        }
@@ -2,45 +2,182 @@ import datetime
 import logging
 import os
 import time
+from typing import TYPE_CHECKING, Union
 
-from devices.rgb_camera import RgbCamera
+from activity_monitor import ActivityMonitor
+from batch_archive import get_batch_size
 from ir_frame_collector import IrFrameCollector
+from ir_sensor_group import IrSensorGroup
+from pipeline_metrics import MetricRegistry
+
+if TYPE_CHECKING:
+    from devices.rgb_camera import RgbCamera  # the driver can be imported only on the Raspberry Pi
 
 logger = logging.getLogger(__name__)
 
 
+DATA_DIR_PATH = '../data'
+
+
 class DataCollector:
-    def __init__(self, rgb_camera: RgbCamera, ir_frame_collector: IrFrameCollector):
+    """
+    Records IR frames and RGB video to numbered batch subdirectories. `rotate_batch_recording` switches
+    to the next batch without a gap (the previous batch is closed in the background).
+
+    `update_batch_recording` records continuously, or with an ActivityMonitor only while there is activity:
+    a batch is started when the activity is triggered (with the pre-roll frames kept by the IR recorder)
+    and finished after the post-roll. The recorded time and bytes, compared to a continuous recording,
+    are logged after each activity and available in `get_recording_stats`.
+    """
+
+    ACTIVITY_CHECK_INTERVAL = 0.5  # [s]
+
+    def __init__(self, rgb_camera: 'RgbCamera', ir_frame_collector: Union[IrFrameCollector, IrSensorGroup],
+                 activity_monitor: ActivityMonitor = None):
+        """
+        :param ir_frame_collector: with a sensor group, each sensor is recorded to its own batch subdirectory
+        :param activity_monitor: None - continuous recording
+        """
         self._rgb_camera = rgb_camera
         self._ir_frame_collector = ir_frame_collector
+        self._activity_monitor = activity_monitor
 
         root_dir_name = datetime.datetime.now().strftime("data__%d_%m_%Y__%H_%M_%S")
-        self._root_dir_path = os.path.abspath(os.path.join('../data', root_dir_name))
+        self._root_dir_path = os.path.abspath(os.path.join(DATA_DIR_PATH, root_dir_name))
         os.makedirs(self._root_dir_path, exist_ok=True)
         logger.info(f"Starting recording to root directory '{self._root_dir_path}'")
         self._data_batch_number = 0
         self._batch_subdir_path = ''
+        self._is_recording = False
+        self._start_time = time.monotonic()
+        self._batch_start_time = None  # type: Union[float, None]
+        self._recording_start_time = None  # type: Union[float, None]  # of the batches since the start
+        self._recording_batch_subdir_paths = []  # measured when the recording is finished
+        self._recorded_duration = 0.0  # of the finished recordings
+        self._recorded_bytes = 0
 
-    def start_batch_recording(self):
-        subdir_name = f"{self._data_batch_number:03}__" + datetime.datetime.now().strftime("%H_%M_%S")
-        self._batch_subdir_path = os.path.join(self._root_dir_path, subdir_name)
+    def is_recording(self) -> bool:
+        return self._is_recording
 
-        logger.info(f"Starting batch recording to subdirectory '{self._batch_subdir_path}'")
-        os.makedirs(self._batch_subdir_path, exist_ok=True)
-        rgb_video_path = os.path.join(self._batch_subdir_path, 'rgb.mjpeg')
+    def get_batch_subdir_path(self) -> str:
+        """ Batch being recorded (empty when not recording) """
+        return self._batch_subdir_path if self._is_recording else ''
+
+    def update_batch_recording(self, batch_recording_duration: float) -> float:
+        """
+        Called by the main loop - rotates the batches of a continuous recording, or starts, rotates and finishes
+        the activity-triggered one (a long activity is split into batches of the duration too).
+        :return: [s] time until the next call
+        """
+        if self._activity_monitor is None:
+            logger.info("Batch iteration started...")
+            self.rotate_batch_recording()  # starts the first batch
+            return batch_recording_duration
+
+        if self._activity_monitor.is_active():
+            if not self._is_recording:
+                logger.info(f"Activity detected ({self._activity_monitor.get_last_trigger_reason()}) "
+                            f"- starting batch recording")
+                self.start_batch_recording()
+            elif time.monotonic() - self._batch_start_time >= batch_recording_duration:
+                self.rotate_batch_recording()
+        elif self._is_recording:
+            logger.info("No activity - finishing batch recording")
+            self.finish_batch_recording()
+        return self.ACTIVITY_CHECK_INTERVAL
 
-        ir_video_path = os.path.join(self._batch_subdir_path, 'ir.avi')
-        ir_csv_path = os.path.join(self._batch_subdir_path, 'ir.csv')
+    def get_recording_stats(self) -> dict:
+        """ Recorded time and bytes, with the estimate for a continuous recording (at the same bytes per second) """
+        elapsed_duration = time.monotonic() - self._start_time
+        recorded_duration = self._recorded_duration
+        if self._recording_start_time is not None:
+            recorded_duration += time.monotonic() - self._recording_start_time
+        continuous_bytes_estimate = None
+        if self._recorded_duration > 0:
+            continuous_bytes_estimate = self._recorded_bytes / self._recorded_duration * elapsed_duration
+        return {
+            'activity_triggered': self._activity_monitor is not None,
+            'activity': self._activity_monitor.get_stats() if self._activity_monitor is not None else None,
+            'recording': self._is_recording,
+            'elapsed_duration': elapsed_duration,
+            'recorded_duration': recorded_duration,
+            'recorded_bytes': self._recorded_bytes,  # of the finished recordings
+            'continuous_bytes_estimate': continuous_bytes_estimate,
+            'written_bytes_reduction': 1 - recorded_duration / elapsed_duration if elapsed_duration > 0 else 0.0,
+        }
 
+    def add_metrics(self, metric_registry: MetricRegistry):
+        metric_registry.add_gauge('recording_active', 'Batch recording in progress (0 or 1)',
+                                  lambda: float(self._is_recording))
+        metric_registry.add_counter('recording_finished_bytes_total', 'Bytes of the finished batch recordings',
+                                    lambda: self._recorded_bytes)
+        if self._activity_monitor is not None:
+            self._activity_monitor.add_metrics(metric_registry)
+
+    def start_batch_recording(self):
+        self._create_batch_subdir()
+        self._batch_start_time = self._recording_start_time = time.monotonic()
+        logger.info(f"Starting batch recording to subdirectory '{self._batch_subdir_path}'")
         self._ir_frame_collector.start_recording_frames(
-            video_file_path=ir_video_path, csv_file_path=ir_csv_path)
-        self._rgb_camera.start_recording_to_file(rgb_video_path)
+            video_file_path=self._get_file_path('ir.avi'), frames_file_path_prefix=self._get_file_path('ir'))
+        if self._rgb_camera is not None:
+            self._rgb_camera.start_recording_to_file(self._get_file_path('rgb.mjpeg'))
+        self._is_recording = True
+
+    def rotate_batch_recording(self):
+        """ Finish the current batch and continue in the next one without dropping frames. Starts if not recording """
+        if not self._is_recording:
+            self.start_batch_recording()
+            return
+
+        start_time = time.monotonic()
+        self._data_batch_number += 1
+        self._create_batch_subdir()
+        self._batch_start_time = time.monotonic()
+        self._ir_frame_collector.rotate_recording_frames(
+            video_file_path=self._get_file_path('ir.avi'), frames_file_path_prefix=self._get_file_path('ir'))
+        if self._rgb_camera is not None:
+            self._rgb_camera.split_recording_to_file(self._get_file_path('rgb.mjpeg'))
+        logger.info(f"Batch recording rotated to subdirectory '{self._batch_subdir_path}' "
+                    f"in {time.monotonic() - start_time:.3f} s")
 
     def finish_batch_recording(self):
+        """ Returns after all queued frames are written """
+        if not self._is_recording:
+            return
         try:
             self._ir_frame_collector.stop_recording_frames()
-            self._rgb_camera.stop_recording_to_file()
+            if self._rgb_camera is not None:
+                self._rgb_camera.stop_recording_to_file()
         except:
             logger.exception("Failed to finish recording batch!")
 
+        self._is_recording = False
         self._data_batch_number += 1
+        self._measure_finished_recording()
+
+    def _measure_finished_recording(self):
+        recording_duration = time.monotonic() - self._recording_start_time
+        recording_bytes = sum(get_batch_size(batch_subdir_path)
+                              for batch_subdir_path in self._recording_batch_subdir_paths)
+        self._recording_start_time = None
+        self._recording_batch_subdir_paths = []
+        self._recorded_duration += recording_duration
+        self._recorded_bytes += recording_bytes
+        if self._activity_monitor is None:
+            return
+        stats = self.get_recording_stats()
+        logger.info(f"Recorded {recording_bytes / 1e6:.1f} MB in {recording_duration:.0f} s. Since the start: "
+                    f"{stats['recorded_bytes'] / 1e6:.1f} MB in {stats['recorded_duration'] / 60:.1f} min "
+                    f"of {stats['elapsed_duration'] / 60:.1f} min, continuous recording would write "
+                    f"~{stats['continuous_bytes_estimate'] / 1e6:.1f} MB "
+                    f"({stats['written_bytes_reduction']:.0%} less)")
+
+    def _create_batch_subdir(self):
+        subdir_name = f"{self._data_batch_number:03}__" + datetime.datetime.now().strftime("%H_%M_%S")
+        self._batch_subdir_path = os.path.join(self._root_dir_path, subdir_name)
+        os.makedirs(self._batch_subdir_path, exist_ok=True)
+        self._recording_batch_subdir_paths.append(self._batch_subdir_path)
+
+    def _get_file_path(self, file_name: str) -> str:
+        return os.path.join(self._batch_subdir_path, file_name)
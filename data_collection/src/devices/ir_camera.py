@@ -4,31 +4,76 @@ import numpy as np
 import adafruit_mlx90640
 
 
+# buses and multiplexers shared by the cameras (all MLX90640 have the same I2C address, so several cameras need
+# separate buses or a TCA9548A multiplexer)
+_i2c_buses = {}  # i2c_bus_number (None - the default GPIO bus): I2C
+_multiplexers = {}  # i2c_bus_number: TCA9548A
+
+freq_to_enum = {
+    1: adafruit_mlx90640.RefreshRate.REFRESH_1_HZ,
+    2: adafruit_mlx90640.RefreshRate.REFRESH_2_HZ,
+    4: adafruit_mlx90640.RefreshRate.REFRESH_4_HZ,
+    8: adafruit_mlx90640.RefreshRate.REFRESH_8_HZ,
+    16: adafruit_mlx90640.RefreshRate.REFRESH_16_HZ,
+    32: adafruit_mlx90640.RefreshRate.REFRESH_32_HZ,
+}
+
+
+def _get_i2c_bus(i2c_bus_number=None):
+    if i2c_bus_number not in _i2c_buses:
+        if i2c_bus_number is None:
+            _i2c_buses[i2c_bus_number] = busio.I2C(board.SCL, board.SDA, frequency=400_000)
+        else:
+            from adafruit_extended_bus import ExtendedI2C  # additional buses enabled with dtoverlay=i2c-gpio
+            _i2c_buses[i2c_bus_number] = ExtendedI2C(i2c_bus_number, frequency=400_000)
+    return _i2c_buses[i2c_bus_number]
+
+
+def _get_multiplexer_channel(i2c_bus_number, multiplexer_channel: int):
+    if i2c_bus_number not in _multiplexers:
+        import adafruit_tca9548a
+        _multiplexers[i2c_bus_number] = adafruit_tca9548a.TCA9548A(_get_i2c_bus(i2c_bus_number))
+    return _multiplexers[i2c_bus_number][multiplexer_channel]
+
+
 class IrCamera:
     RESOLUTION_X = 32
     RESOLUTION_Y = 24
     RESOLUTION = (RESOLUTION_Y, RESOLUTION_X)
     RESOLUTION_CV = (RESOLUTION_X, RESOLUTION_Y)
 
-    def __init__(self, doubled_freq_hz: int):
-        self._i2c = busio.I2C(board.SCL, board.SDA, frequency=400_000)
+    def __init__(self, doubled_freq_hz: int, i2c_bus_number: int = None, multiplexer_channel: int = None):
+        """
+        :param i2c_bus_number: number of /dev/i2c-N bus, None for the default GPIO bus
+        :param multiplexer_channel: channel of the TCA9548A multiplexer on the bus, None if there is no multiplexer
+        """
+        if multiplexer_channel is None:
+            self._i2c = _get_i2c_bus(i2c_bus_number)
+        else:
+            self._i2c = _get_multiplexer_channel(i2c_bus_number, multiplexer_channel)
         self._mlx = adafruit_mlx90640.MLX90640(self._i2c)
-        self._fps = doubled_freq_hz / 2 / 1.02  # it is a little bit slower than the requested fps, maybe due to processing in the library
-
-        freq_to_enum = {
-            1: adafruit_mlx90640.RefreshRate.REFRESH_1_HZ,
-            2: adafruit_mlx90640.RefreshRate.REFRESH_2_HZ,
-            4: adafruit_mlx90640.RefreshRate.REFRESH_4_HZ,
-            8: adafruit_mlx90640.RefreshRate.REFRESH_8_HZ,
-            16: adafruit_mlx90640.RefreshRate.REFRESH_16_HZ,
-            32: adafruit_mlx90640.RefreshRate.REFRESH_32_HZ,
-        }
+        self._doubled_freq_hz = None
+        self._fps = None
+        self.set_doubled_freq_hz(doubled_freq_hz)
+
+    def set_doubled_freq_hz(self, doubled_freq_hz: int):
+        """ Change the refresh rate. Must not be called during `get_frame` (from another thread) """
         self._mlx.refresh_rate = freq_to_enum[doubled_freq_hz]
+        self._doubled_freq_hz = doubled_freq_hz
+        self._fps = IrCamera.get_expected_fps(doubled_freq_hz)
+
+    def get_doubled_freq_hz(self) -> int:
+        return self._doubled_freq_hz
+
+    @staticmethod
+    def get_expected_fps(doubled_freq_hz: int) -> float:
+        return doubled_freq_hz / 2 / 1.02  # it is a little bit slower than the requested fps, maybe due to processing in the library
 
     def get_fps(self):
         return self._fps
 
-    def get_frame(self):
-        frame = np.zeros((IrCamera.RESOLUTION_Y * IrCamera.RESOLUTION_X))
+    def get_frame(self, out: np.ndarray = None):
+        """ :param out: flat array of RESOLUTION_Y * RESOLUTION_X values to read the frame into, None - a new array """
+        frame = out if out is not None else np.zeros((IrCamera.RESOLUTION_Y * IrCamera.RESOLUTION_X))
         self._mlx.getFrame(frame)
         return frame
@@ -0,0 +1,139 @@
+import glob
+import logging
+import os
+import time
+
+import numpy as np
+
+from batch_archive import find_batch_file, open_batch_file
+from ir_frame_recording import IrFrameBinaryReader
+
+
+logger = logging.getLogger(__name__)
+
+
+RECORDED_DOUBLED_FREQ_HZ = 4  # refresh rate of the recordings (IrCamera.doubled_freq_hz)
+HDF_FRAME_RATE = RECORDED_DOUBLED_FREQ_HZ / 2 / 1.02  # dataset HDFs have no timestamps
+
+
+def _load_batch_frames(batch_dir_path):
+    """ :return: frames (N, 768) and timestamps (N,) from ir_*.bin or ir.csv (or compressed) of a recorded batch """
+    if find_batch_file(os.path.join(batch_dir_path, 'ir_000.bin')):
+        reader = IrFrameBinaryReader(os.path.join(batch_dir_path, 'ir'))
+        return reader.get_all_frames().astype(np.float64), reader.get_all_timestamps()
+
+    with open_batch_file(os.path.join(batch_dir_path, 'ir.csv'), 'rt') as file:
+        csv_data = np.loadtxt(file, delimiter=',', skiprows=1, ndmin=2)
+    return csv_data[:, 2:], csv_data[:, 1]
+
+
+def _load_hdf_frames(hdf_file_path):
+    import pandas as pd
+
+    df = pd.read_hdf(hdf_file_path)
+    frames = np.stack([np.asarray(frame, dtype=np.float64).flatten() for frame in df['data']])
+    return frames, np.arange(frames.shape[0]) / HDF_FRAME_RATE
+
+
+def _is_batch_dir(dir_path) -> bool:
+    return bool(find_batch_file(os.path.join(dir_path, 'ir_000.bin'))
+                or find_batch_file(os.path.join(dir_path, 'ir.csv')))
+
+
+def get_replay_batch_dirs(source_path) -> list:
+    """ Recorded batches of a source: a single batch directory or a directory with batch subdirectories """
+    if _is_batch_dir(source_path):
+        return [source_path]
+    return sorted(dir_path for dir_path in glob.glob(os.path.join(source_path, '*')) if _is_batch_dir(dir_path))
+
+
+def load_replay_frames(source_path):
+    """
+    Frames to replay from a recorded batch directory, a directory with batches, an HDF file from the dataset
+    or a directory with HDF files. Sources are concatenated in name order, with continuous timestamps.
+    :return: frames (N, 768) and timestamps (N,)
+    """
+    if os.path.isfile(source_path):
+        sources = [(_load_hdf_frames, source_path)]
+    else:
+        hdf_file_paths = sorted(glob.glob(os.path.join(source_path, '*.h5')))
+        sources = [(_load_hdf_frames, file_path) for file_path in hdf_file_paths] \
+            + [(_load_batch_frames, dir_path) for dir_path in get_replay_batch_dirs(source_path)]
+    if not sources:
+        raise Exception(f"No IR recordings found in '{source_path}'!")
+
+    all_frames = []
+    all_timestamps = []
+    next_timestamp = 0.0
+    for load_function, path in sources:
+        frames, timestamps = load_function(path)
+        if frames.shape[0] == 0:
+            continue
+        frame_interval = np.median(np.diff(timestamps)) if frames.shape[0] > 1 else 1 / HDF_FRAME_RATE
+        all_frames.append(frames)
+        all_timestamps.append(timestamps - timestamps[0] + next_timestamp)
+        next_timestamp = all_timestamps[-1][-1] + frame_interval
+        logger.info(f"Loaded {frames.shape[0]} frames to replay from '{path}'")
+    return np.concatenate(all_frames), np.concatenate(all_timestamps)
+
+
+class ReplayIrCamera:
+    """
+    Drop-in replacement of IrCamera, replaying recorded frames in a loop.
+    `speed` - 1 for real time, N for N times faster than real time, 0 for as fast as possible.
+    The refresh rate (`set_doubled_freq_hz`) scales the speed, relative to RECORDED_DOUBLED_FREQ_HZ
+    """
+
+    RESOLUTION_X = 32
+    RESOLUTION_Y = 24
+    RESOLUTION = (RESOLUTION_Y, RESOLUTION_X)
+    RESOLUTION_CV = (RESOLUTION_X, RESOLUTION_Y)
+
+    def __init__(self, source_path: str, speed: float = 1.0):
+        self._frames, self._timestamps = load_replay_frames(source_path)
+        self._base_speed = speed
+        self._speed = speed
+        self._doubled_freq_hz = RECORDED_DOUBLED_FREQ_HZ
+        number_of_frames = self._frames.shape[0]
+        recording_duration = self._timestamps[-1] - self._timestamps[0]
+        self._source_fps = (number_of_frames - 1) / recording_duration if recording_duration > 0 else HDF_FRAME_RATE
+        self._loop_duration = recording_duration + 1 / self._source_fps
+        self._frame_number = 0
+        self._replay_start_time = None
+        self._replay_start_frame_time = 0.0
+
+    def get_fps(self):
+        return self._source_fps * self._speed if self._speed else self._source_fps
+
+    def set_doubled_freq_hz(self, doubled_freq_hz: int):
+        self._doubled_freq_hz = doubled_freq_hz
+        self._speed = self._base_speed * doubled_freq_hz / RECORDED_DOUBLED_FREQ_HZ
+        self._replay_start_time = None  # continue with the new speed from the next frame
+
+    def get_doubled_freq_hz(self) -> int:
+        return self._doubled_freq_hz
+
+    def get_source_fps(self) -> float:
+        """ Frame rate of the replayed recording """
+        return self._source_fps
+
+    def get_number_of_replayed_frames(self) -> int:
+        return self._frame_number
+
+    def get_frame(self, out: np.ndarray = None):
+        """ :param out: flat array to copy the frame into (see IrCamera.get_frame), None - a new array """
+        loop_number, frame_index = divmod(self._frame_number, self._frames.shape[0])
+        if self._speed:
+            frame_time = loop_number * self._loop_duration + self._timestamps[frame_index] - self._timestamps[0]
+            if self._replay_start_time is None:
+                self._replay_start_time = time.monotonic()
+                self._replay_start_frame_time = frame_time
+            remaining_time = (self._replay_start_time + (frame_time - self._replay_start_frame_time) / self._speed
+                              - time.monotonic())
+            if remaining_time > 0:
+                time.sleep(remaining_time)
+        self._frame_number += 1
+        if out is None:
+            return self._frames[frame_index].copy()
+        np.copyto(out, self._frames[frame_index])
+        return out
@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from batch_archive import find_batch_file, open_batch_file
+from devices.replay_ir_camera import get_replay_batch_dirs
+
+
+logger = logging.getLogger(__name__)
+
+
+_JPEG_START_MARKER = b'\xff\xd8\xff'
+
+
+def split_mjpeg(mjpeg_data: bytes) -> list:
+    """ Split MJPEG stream (concatenated JPEG images, as recorded by RgbCamera) to single JPEG images """
+    frame_starts = []
+    position = mjpeg_data.find(_JPEG_START_MARKER)
+    while position != -1:
+        frame_starts.append(position)
+        position = mjpeg_data.find(_JPEG_START_MARKER, position + len(_JPEG_START_MARKER))
+    frame_ends = frame_starts[1:] + [len(mjpeg_data)]
+    return [mjpeg_data[start:end] for start, end in zip(frame_starts, frame_ends)]
+
+
+class ReplayRgbCamera:
+    """
+    Drop-in replacement of RgbCamera, replaying `rgb.mjpeg` of the first recorded batch found in `source_path`
+    in a loop. Sources without RGB recording (e.g. the dataset HDFs) get a blank image.
+    `speed` - 1 for real time, N for N times faster than real time, 0 for as fast as possible (in which case
+    RGB frames are produced at `fps`)
+    """
+
+    def __init__(self, source_path: str, fps, resolution, speed: float = 1.0):
+        self._frame_interval = 1 / (fps * speed if speed else fps)
+        self._jpeg_frames = self._load_jpeg_frames(source_path, resolution)
+        self._start_time = time.monotonic()
+        self._recording_thread = None  # type: threading.Thread
+        self._recording_stop_event = threading.Event()
+        self._next_recording_file = None  # opened by `split_recording_to_file`, switched to by the recording thread
+        self._recording_file_switched_event = threading.Event()
+
+    @staticmethod
+    def _load_jpeg_frames(source_path, resolution) -> list:
+        if os.path.isdir(source_path):
+            for batch_dir_path in get_replay_batch_dirs(source_path):
+                mjpeg_file_path = os.path.join(batch_dir_path, 'rgb.mjpeg')
+                if find_batch_file(mjpeg_file_path):
+                    with open_batch_file(mjpeg_file_path) as file:
+                        jpeg_frames = split_mjpeg(file.read())
+                    if jpeg_frames:
+                        logger.info(f"Loaded {len(jpeg_frames)} RGB frames to replay from '{mjpeg_file_path}'")
+                        return jpeg_frames
+
+        logger.info("No RGB recording to replay - using a blank image")
+        _, blank_jpeg = cv2.imencode('.jpg', np.zeros((resolution[1], resolution[0], 3), dtype=np.uint8))
+        return [blank_jpeg.tobytes()]
+
+    def start_recording_to_file(self, file_path):
+        self._recording_stop_event.clear()
+        self._recording_thread = threading.Thread(
+            target=self._run_recording, args=(file_path,), name=self.__class__.__name__ + '_record')
+        self._recording_thread.start()
+
+    def split_recording_to_file(self, file_path):
+        """ Like PiCamera.split_recording - the next frame goes to the new file """
+        if self._recording_thread is None or not self._recording_thread.is_alive():
+            raise Exception("Not recording!")
+        self._recording_file_switched_event.clear()
+        self._next_recording_file = open(file_path, 'wb')
+        self._recording_file_switched_event.wait()
+
+    def stop_recording_to_file(self):
+        self._recording_stop_event.set()
+        self._recording_thread.join()
+
+    def get_frame_as_array(self) -> np.ndarray:
+        image_bgr = cv2.imdecode(np.frombuffer(self.get_frame_as_jpeg_bin(), dtype=np.uint8), cv2.IMREAD_COLOR)
+        return cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+
+    def get_frame_as_jpeg_bin(self) -> bytes:
+        """ Like the camera video port - waits for the next frame """
+        frame_number = int((time.monotonic() - self._start_time) / self._frame_interval) + 1
+        time.sleep(max(0.0, self._start_time + frame_number * self._frame_interval - time.monotonic()))
+        return self._jpeg_frames[frame_number % len(self._jpeg_frames)]
+
+    def _run_recording(self, file_path):
+        file = open(file_path, 'wb')
+        try:
+            while not self._recording_stop_event.is_set():
+                frame_bin = self.get_frame_as_jpeg_bin()
+                if self._next_recording_file is not None:
+                    file.close()
+                    file, self._next_recording_file = self._next_recording_file, None
+                    self._recording_file_switched_event.set()
+                file.write(frame_bin)
+        finally:
+            file.close()
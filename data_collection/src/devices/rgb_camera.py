@@ -17,6 +17,10 @@ class RgbCamera:
     def start_recording_to_file(self, file_path):
         self._camera.start_recording(file_path)
 
+    def split_recording_to_file(self, file_path):
+        """ Continue the running recording in a new file, without dropping frames """
+        self._camera.split_recording(file_path)
+
     def stop_recording_to_file(self):
         self._camera.stop_recording()
 
@@ -0,0 +1,193 @@
+import collections
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Union
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FrameTimestamps:
+    """
+    time.monotonic() of the pipeline stages of one frame, 0 if the frame did not reach the stage (yet).
+    Shared by all consumers of the frame, each of them fills its own stages
+    """
+    read_start: float = 0.0  # I2C read
+    read_end: float = 0.0
+    enqueue: float = 0.0  # recording queue
+    dequeue: float = 0.0
+    frames_written: float = 0.0  # binary frames file
+    video_written: float = 0.0  # rendered and written to the video
+    inference_start: float = 0.0
+    inference_end: float = 0.0
+    encode_start: float = 0.0  # stream encoding (the first encoder of the frame)
+    encode_end: float = 0.0
+    sent: float = 0.0  # sent to the first stream client
+
+
+class FrameBufferPool:
+    """
+    Preallocated frame buffers (float32) recycled through the pipeline with reference counting, instead of a new
+    array for every frame read from the camera.
+
+    The reading thread acquires a buffer for every frame (holding one reference while it passes the frame on),
+    every consumer keeping the frame after that (the latest frame slot, the recording queue and pre-roll)
+    adds its own reference (`IrFrame.add_reference`) and releases it when done. A buffer without references
+    returns to the pool. If the consumers hold more frames than expected, the pool grows by a buffer (logged).
+    """
+
+    def __init__(self, shape, size: int, dtype=np.float32):
+        self._shape = shape
+        self._dtype = dtype
+        self._buffers = []
+        self._read_only_views = []
+        self._reference_counts = []
+        self._free_indexes = collections.deque()
+        self._lock = threading.Lock()
+        self._number_of_grown_buffers = 0
+        for _ in range(size):
+            self._add_buffer()
+
+    def acquire(self) -> int:
+        """ :return: index of a free buffer, with one reference (of the caller) """
+        with self._lock:
+            if not self._free_indexes:
+                self._add_buffer()
+                self._number_of_grown_buffers += 1
+                logger.warning(f"Frame buffer pool exhausted, grown to {len(self._buffers)} buffers")
+            index = self._free_indexes.popleft()
+            self._reference_counts[index] = 1
+            return index
+
+    def get_buffer(self, index: int) -> np.ndarray:
+        """ Writable buffer, only for the owner of a just acquired buffer """
+        return self._buffers[index]
+
+    def get_read_only_view(self, index: int) -> np.ndarray:
+        return self._read_only_views[index]
+
+    def add_reference(self, index: int):
+        with self._lock:
+            if self._reference_counts[index] <= 0:
+                raise Exception(f"Reference to the free frame buffer {index}!")
+            self._reference_counts[index] += 1
+
+    def release(self, index: int):
+        with self._lock:
+            if self._reference_counts[index] <= 0:
+                raise Exception(f"Frame buffer {index} released more times than referenced!")
+            self._reference_counts[index] -= 1
+            if self._reference_counts[index] == 0:
+                self._free_indexes.append(index)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._buffers),
+                'in_use': len(self._buffers) - len(self._free_indexes),
+                'grown_buffers': self._number_of_grown_buffers,
+            }
+
+    def _add_buffer(self):
+        buffer = np.zeros(self._shape, dtype=self._dtype)
+        view = buffer.view()
+        view.flags.writeable = False
+        self._buffers.append(buffer)
+        self._read_only_views.append(view)
+        self._reference_counts.append(0)
+        self._free_indexes.append(len(self._buffers) - 1)
+
+
+class IrFrame:
+    """
+    Frame of a sensor - a compact record (no `__dict__`, it is created for every frame), not to be modified.
+    `data` is a read-only view of the buffer `buffer_index` of `buffer_pool` (see FrameBufferPool), or an array
+    of its own with `buffer_pool` None (e.g. frames from the shared memory ring or from the recording spill file).
+    `timestamp` is time.time() of the acquisition, `monotonic_timestamp` its time.monotonic().
+    """
+
+    __slots__ = ('data', 'timestamp', 'sequence_number', 'timestamps', 'monotonic_timestamp', 'buffer_index',
+                 'buffer_pool')
+
+    def __init__(self, data: np.ndarray, timestamp: float, sequence_number: int = 0,
+                 timestamps: FrameTimestamps = None, monotonic_timestamp: float = 0.0, buffer_index: int = -1,
+                 buffer_pool: FrameBufferPool = None):
+        self.data = data
+        self.timestamp = timestamp
+        self.sequence_number = sequence_number
+        self.timestamps = timestamps  # type: Union[FrameTimestamps, None]
+        self.monotonic_timestamp = monotonic_timestamp
+        self.buffer_index = buffer_index
+        self.buffer_pool = buffer_pool  # type: Union[FrameBufferPool, None]
+
+    def __repr__(self):
+        return (f"IrFrame(sequence_number={self.sequence_number}, timestamp={self.timestamp}, "
+                f"buffer_index={self.buffer_index})")
+
+    def add_reference(self):
+        """ Keep the buffer of the frame (after the call in which the frame was received), until `release` """
+        if self.buffer_pool is not None:
+            self.buffer_pool.add_reference(self.buffer_index)
+
+    def release(self):
+        if self.buffer_pool is not None:
+            self.buffer_pool.release(self.buffer_index)
+
+    def replace(self, **changes) -> 'IrFrame':
+        """ Copy with some fields changed (as dataclasses.replace), sharing the buffer - without a reference """
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return IrFrame(**fields)
+
+
+class LatestFrameSlot:
+    """
+    Versioned publication of the latest frame for many readers.
+
+    The writer publishes frames with pooled buffers (see FrameBufferPool), the slot keeps a reference
+    to the latest `ring_size` of them. Readers get the frame with a read-only view of its buffer (no copy, no lock).
+    A buffer is reused only after `ring_size - 1` newer frames were published,
+    so readers which need a frame for longer than that have to copy it (or add a reference to it).
+    A `condition` shared by slots of several sensors lets a reader wait for a new frame of any of them.
+    """
+
+    def __init__(self, ring_size: int = 4, condition: threading.Condition = None):
+        self._ring_size = ring_size
+        self._frames = collections.deque()  # referenced by the slot, the latest last
+        self._condition = condition or threading.Condition()
+        self._sequence_number = 0
+        self._latest_frame = None  # type: Union[IrFrame, None]
+
+    def get_ring_size(self) -> int:
+        return self._ring_size
+
+    def publish(self, frame: IrFrame):
+        """ Should be called only from one (writer) thread, with increasing frame sequence numbers """
+        frame.add_reference()
+        self._frames.append(frame)
+        with self._condition:
+            self._latest_frame = frame
+            self._sequence_number = frame.sequence_number
+            self._condition.notify_all()
+        if len(self._frames) > self._ring_size:
+            self._frames.popleft().release()
+
+    def get_latest(self) -> Union[IrFrame, None]:
+        return self._latest_frame
+
+    def get_sequence_number(self) -> int:
+        return self._sequence_number
+
+    def wait_for_newer(self, sequence_number: int, timeout=None) -> Union[IrFrame, None]:
+        """
+        Block until a frame newer than `sequence_number` is published.
+        Returns the latest frame, or None on timeout.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._sequence_number > sequence_number, timeout=timeout):
+                return None
+            return self._latest_frame
@@ -0,0 +1,189 @@
+"""
+Bounded queue of frames waiting to be recorded, with a policy for a full queue:
+ - block - `put` waits for a free place (the acquisition stops reading, the camera frames are missed)
+ - drop_oldest - the oldest queued frame is discarded
+ - drop_newest - the new frame is discarded
+ - spill - the new frame is appended to a temporary file, drained after the queued frames (in order)
+The number of dropped, spilled and blocked frames is counted, so gaps can be recorded with the data.
+The queue takes over the references of the put frames (see FrameBufferPool) - dropped and spilled frames
+are released by the queue, the others by the consumer.
+"""
+
+import collections
+import logging
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from frame_publication import FrameTimestamps, IrFrame
+
+
+logger = logging.getLogger(__name__)
+
+
+QUEUE_POLICY_BLOCK = 'block'
+QUEUE_POLICY_DROP_OLDEST = 'drop_oldest'
+QUEUE_POLICY_DROP_NEWEST = 'drop_newest'
+QUEUE_POLICY_SPILL = 'spill'
+QUEUE_POLICIES = [QUEUE_POLICY_BLOCK, QUEUE_POLICY_DROP_OLDEST, QUEUE_POLICY_DROP_NEWEST, QUEUE_POLICY_SPILL]
+
+
+class _SpillSegment:
+    """ Frames appended to a temporary file and read back in the same order. The file is truncated when drained """
+
+    def __init__(self, number_of_pixels: int, dir_path=None):
+        self._record = np.zeros(1, dtype=[
+            ('sequence_number', '<u8'),
+            ('timestamp', '<f8'),
+            ('read_start', '<f8'),
+            ('read_end', '<f8'),
+            ('enqueue', '<f8'),
+            ('data', '<f4', (number_of_pixels,)),  # as the frame buffers
+        ])
+        self._file = tempfile.TemporaryFile(prefix='ir_spill_', dir=dir_path)
+        self._number_of_written_records = 0
+        self._number_of_read_records = 0
+
+    def get_size(self) -> int:
+        return self._number_of_written_records - self._number_of_read_records
+
+    def append(self, frame: IrFrame):
+        record = self._record[0]
+        record['sequence_number'] = frame.sequence_number
+        record['timestamp'] = frame.timestamp
+        timestamps = frame.timestamps or FrameTimestamps()
+        record['read_start'] = timestamps.read_start
+        record['read_end'] = timestamps.read_end
+        record['enqueue'] = timestamps.enqueue
+        record['data'] = np.reshape(frame.data, -1)
+        self._file.seek(self._number_of_written_records * self._record.itemsize)
+        self._file.write(self._record.tobytes())
+        self._number_of_written_records += 1
+
+    def pop(self) -> IrFrame:
+        record = np.zeros(1, dtype=self._record.dtype)
+        self._file.seek(self._number_of_read_records * self._record.itemsize)
+        self._file.readinto(memoryview(record).cast('B'))
+        self._number_of_read_records += 1
+        if self.get_size() == 0:
+            self._file.seek(0)
+            self._file.truncate()
+            self._number_of_written_records = self._number_of_read_records = 0
+
+        record = record[0]
+        timestamps = None
+        if record['read_end']:
+            timestamps = FrameTimestamps(read_start=float(record['read_start']), read_end=float(record['read_end']),
+                                         enqueue=float(record['enqueue']))
+        return IrFrame(data=record['data'], timestamp=float(record['timestamp']),
+                       sequence_number=int(record['sequence_number']), timestamps=timestamps)
+
+
+class BoundedFrameQueue:
+    """
+    Queue of at most `capacity` frames in memory (plus the spilled ones on disk), with the interface of queue.Queue
+    used by the recorder (`put`, `get`, `task_done`, `join`, `qsize`). See the module docstring for the policies.
+    """
+
+    def __init__(self, capacity: int, policy=QUEUE_POLICY_BLOCK, spill_dir_path=None):
+        """ :param spill_dir_path: directory of the spill file (policy `spill`), None for the system temp directory """
+        if policy not in QUEUE_POLICIES:
+            raise Exception(f"Unknown queue policy '{policy}'!")
+        self._capacity = capacity
+        self._policy = policy
+        self._spill_dir_path = spill_dir_path
+        self._frames = collections.deque()
+        self._spill_segment = None  # type: _SpillSegment
+        self._condition = threading.Condition()
+        self._number_of_unfinished_frames = 0
+        self._number_of_dropped_oldest_frames = 0
+        self._number_of_dropped_newest_frames = 0
+        self._number_of_spilled_frames = 0
+        self._number_of_blocked_puts = 0
+        self._blocked_duration = 0.0
+        self._max_size = 0
+
+    def get_policy(self) -> str:
+        return self._policy
+
+    def get_capacity(self) -> int:
+        return self._capacity
+
+    def put(self, frame: IrFrame):
+        with self._condition:
+            if self._get_spill_size() > 0:  # the new frame has to wait after the spilled ones
+                self._spill(frame)
+            elif len(self._frames) >= self._capacity:
+                if self._policy == QUEUE_POLICY_BLOCK:
+                    self._number_of_blocked_puts += 1
+                    block_start_time = time.monotonic()
+                    self._condition.wait_for(lambda: len(self._frames) < self._capacity)
+                    self._blocked_duration += time.monotonic() - block_start_time
+                    self._frames.append(frame)
+                elif self._policy == QUEUE_POLICY_DROP_OLDEST:
+                    self._frames.popleft().release()
+                    self._number_of_unfinished_frames -= 1
+                    self._number_of_dropped_oldest_frames += 1
+                    self._frames.append(frame)
+                elif self._policy == QUEUE_POLICY_DROP_NEWEST:
+                    self._number_of_dropped_newest_frames += 1
+                    frame.release()
+                    return
+                else:
+                    self._spill(frame)
+            else:
+                self._frames.append(frame)
+            self._number_of_unfinished_frames += 1
+            self._max_size = max(self._max_size, self.qsize())
+            self._condition.notify_all()
+
+    def get(self) -> IrFrame:
+        """ Blocks until a frame is available """
+        with self._condition:
+            self._condition.wait_for(lambda: self._frames or self._get_spill_size() > 0)
+            frame = self._frames.popleft() if self._frames else self._spill_segment.pop()
+            self._condition.notify_all()
+            return frame
+
+    def task_done(self):
+        with self._condition:
+            self._number_of_unfinished_frames -= 1
+            self._condition.notify_all()
+
+    def join(self):
+        """ Wait until all queued frames were processed (`task_done`) """
+        with self._condition:
+            self._condition.wait_for(lambda: self._number_of_unfinished_frames <= 0)
+
+    def qsize(self) -> int:
+        """ Number of frames in memory and spilled """
+        return len(self._frames) + self._get_spill_size()
+
+    def get_stats(self) -> dict:
+        """ Counters since the start """
+        return {
+            'dropped_oldest_frames': self._number_of_dropped_oldest_frames,
+            'dropped_newest_frames': self._number_of_dropped_newest_frames,
+            'spilled_frames': self._number_of_spilled_frames,
+            'blocked_puts': self._number_of_blocked_puts,
+            'blocked_duration': self._blocked_duration,
+            'max_size': self._max_size,
+        }
+
+    def reset_max_size(self):
+        with self._condition:
+            self._max_size = self.qsize()
+
+    def _get_spill_size(self) -> int:
+        return self._spill_segment.get_size() if self._spill_segment is not None else 0
+
+    def _spill(self, frame: IrFrame):
+        if self._spill_segment is None:
+            self._spill_segment = _SpillSegment(np.size(frame.data), dir_path=self._spill_dir_path)
+        if self._spill_segment.get_size() == 0:
+            logger.warning(f"Recording queue full ({self._capacity} frames), spilling frames to disk")
+        self._spill_segment.append(frame)
+        frame.release()
+        self._number_of_spilled_frames += 1
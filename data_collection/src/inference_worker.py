@@ -0,0 +1,338 @@
+import collections
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy as np
+
+from background_model import BackgroundModel
+from change_gate import TemporalChangeGate
+from frame_publication import IrFrame, LatestFrameSlot
+from pipeline_metrics import OUTPUT_INFERENCE, STAGE_INFERENCE, PipelineMetrics
+from trained_model.frame_processor import IR_CAMERA_RESOLUTION, FrameProcessor
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class InferenceResult:
+    density_map: np.ndarray
+    people_count: float
+    frame_sequence_number: int
+    frame_timestamp: float
+    # [s] model run time (of the whole batch), 0 if skipped (see background_model.py) or reused (see change_gate.py)
+    inference_duration: float
+    latency: float  # [s] from frame acquisition until the result was available
+
+
+def gate_frames(frames_data: np.ndarray, background_models: List[Union[BackgroundModel, None]],
+                change_gates: List[Union[TemporalChangeGate, None]],
+                frame_processor: FrameProcessor) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Run the model on the frames, except the ones skipped by the background model of their sensor (empty room,
+    see background_model.py) or reused by its change gate (see change_gate.py), and update the gates with them.
+    The gates are stateful - every one has to get the frames of its sensor in order, only from the inference loop
+    :param frames_data: (N, 768)
+    :param background_models: of the sensors of the frames, None for no background model (`change_gates` likewise)
+    :return: density maps (N, 24, 32), people counts (N,), skipped frames mask (N,), reused frames mask (N,)
+    """
+    number_of_frames = frames_data.shape[0]
+    density_maps = np.zeros((number_of_frames, *IR_CAMERA_RESOLUTION))
+    people_counts = np.zeros(number_of_frames)
+    is_skipped = np.zeros(number_of_frames, dtype=bool)
+    is_reused = np.zeros(number_of_frames, dtype=bool)
+    for i, (data, background_model, change_gate) in enumerate(zip(frames_data, background_models, change_gates)):
+        if background_model is not None and background_model.should_skip_inference(data):
+            is_skipped[i] = True
+        elif change_gate is not None:
+            cached_output = change_gate.get_cached_output(data)
+            if cached_output is not None:
+                density_maps[i], people_counts[i] = cached_output
+                is_reused[i] = True
+    is_processed = ~(is_skipped | is_reused)
+    if np.any(is_processed):
+        density_maps[is_processed], people_counts[is_processed] = \
+            frame_processor.process_frames(frames_data[is_processed])
+
+    for i, (data, background_model, change_gate) in enumerate(zip(frames_data, background_models, change_gates)):
+        if is_skipped[i]:
+            background_model.add_frame(data)
+        else:
+            _add_output_to_gates(data, density_maps[i], people_counts[i], background_model,
+                                 change_gate if is_processed[i] else None)
+    return density_maps, people_counts, is_skipped, is_reused
+
+
+def _add_output_to_gates(frame_data: np.ndarray, density_map: np.ndarray, people_count: float,
+                         background_model: Union[BackgroundModel, None], change_gate: Union[TemporalChangeGate, None]):
+    """ Model output (or the reused one, without `change_gate`) for the frame """
+    if background_model is not None:
+        background_model.add_frame(frame_data, density_map=density_map, people_count=people_count)
+    if change_gate is not None:
+        change_gate.set_output(frame_data, density_map=density_map, people_count=people_count)
+
+
+class InferenceResultCache:
+    """
+    Memoized inference results of one sensor, keyed by the frame sequence number.
+    The model runs at most once per frame - all consumers of the same frame share the result.
+    With a `background_model`, the model does not run on frames of the empty room (see background_model.py).
+    With a `change_gate`, the output of the previous frame is reused for a nearly identical frame (see change_gate.py).
+    The gates are stateful, they decide on (and are updated with) only the frames of the InferenceWorker,
+    which come in order - other consumers (streams) get the model output for a frame not processed yet.
+    """
+
+    def __init__(self, frame_processor: FrameProcessor, max_size=16, pipeline_metrics: PipelineMetrics = None,
+                 background_model: BackgroundModel = None, change_gate: TemporalChangeGate = None):
+        self._frame_processor = frame_processor
+        self._background_model = background_model
+        self._change_gate = change_gate
+        self._pipeline_metrics = pipeline_metrics
+        self._max_size = max_size
+        self._results = collections.OrderedDict()  # frame_sequence_number: InferenceResult
+        self._lock = threading.Lock()
+        self._computation_lock = threading.Lock()
+        self._number_of_hits = 0
+        self._number_of_misses = 0
+
+    def get_frame_processor(self) -> FrameProcessor:
+        return self._frame_processor
+
+    def get_result(self, frame: IrFrame) -> InferenceResult:
+        """ Result for the frame, computed if not cached yet. Blocks while the model processes another frame """
+        return self.get_results_batched([(self, frame)])[0]
+
+    @staticmethod
+    def get_results_batched(requests: List[Tuple['InferenceResultCache', IrFrame]],
+                            apply_gates=False) -> List[InferenceResult]:
+        """
+        Results for frames of many caches (of different sensors, sharing the frame processor).
+        The results not cached yet are computed in one batch
+        :param apply_gates: only for the InferenceWorker - frames of every cache in order, the background model
+            and the change gate decide on them and are updated with them (also with the results computed before
+            for other consumers)
+        """
+        results = [cache._get_cached_result(frame.sequence_number) for cache, frame in requests]
+        missing_indexes = [i for i, result in enumerate(results) if result is None]
+        indexes_to_compute = []
+        if missing_indexes:
+            caches_to_lock = sorted({id(requests[i][0]): requests[i][0] for i in missing_indexes}.items())
+            for _, cache in caches_to_lock:
+                cache._computation_lock.acquire()
+            try:
+                # the frames could have been processed by another consumer while we were waiting
+                for i in missing_indexes:
+                    cache, frame = requests[i]
+                    results[i] = cache._get_cached_result(frame.sequence_number, count_miss=True)
+                    if results[i] is None:
+                        indexes_to_compute.append(i)
+                if indexes_to_compute:
+                    computed_results = InferenceResultCache._compute([requests[i] for i in indexes_to_compute],
+                                                                     apply_gates)
+                    for i, result in zip(indexes_to_compute, computed_results):
+                        requests[i][0]._store_result(result)
+                        results[i] = result
+            finally:
+                for _, cache in caches_to_lock:
+                    cache._computation_lock.release()
+        if apply_gates:
+            # results computed before for other consumers, by the model
+            for i in set(range(len(requests))) - set(indexes_to_compute):
+                (cache, frame), result = requests[i], results[i]
+                _add_output_to_gates(np.reshape(frame.data, -1), result.density_map, result.people_count,
+                                     cache._background_model, cache._change_gate)
+        return results
+
+    def get_stats(self) -> dict:
+        number_of_requests = self._number_of_hits + self._number_of_misses
+        return {
+            'hits': self._number_of_hits,
+            'misses': self._number_of_misses,
+            'hit_ratio': self._number_of_hits / number_of_requests if number_of_requests else 0.0,
+            'background_model': self._background_model.get_stats() if self._background_model is not None else None,
+            'change_gate': self._change_gate.get_stats() if self._change_gate is not None else None,
+        }
+
+    def _get_cached_result(self, frame_sequence_number: int, count_miss=False) -> Union[InferenceResult, None]:
+        with self._lock:
+            result = self._results.get(frame_sequence_number)
+            if result is not None:
+                self._results.move_to_end(frame_sequence_number)
+                self._number_of_hits += 1
+            elif count_miss:
+                self._number_of_misses += 1
+            return result
+
+    def _store_result(self, result: InferenceResult):
+        with self._lock:
+            self._results[result.frame_sequence_number] = result
+            while len(self._results) > self._max_size:
+                self._results.popitem(last=False)
+
+    @staticmethod
+    def _compute(requests: List[Tuple['InferenceResultCache', IrFrame]], apply_gates: bool) -> List[InferenceResult]:
+        frame_processor = requests[0][0]._frame_processor
+        # a copy, as the slot buffers may be reused while the model is running
+        frames_data = np.stack([np.reshape(frame.data, -1) for _, frame in requests])
+        start_time = time.monotonic()
+        if apply_gates:
+            density_maps, people_counts, is_skipped, is_reused = gate_frames(
+                frames_data, [cache._background_model for cache, _ in requests],
+                [cache._change_gate for cache, _ in requests], frame_processor)
+        else:
+            density_maps, people_counts = frame_processor.process_frames(frames_data)
+            is_skipped = is_reused = np.zeros(len(requests), dtype=bool)
+        end_time = time.monotonic()
+        inference_duration = end_time - start_time
+
+        results = []
+        for (cache, frame), density_map, people_count, skipped, reused in zip(
+                requests, density_maps, people_counts, is_skipped, is_reused):
+            processed = not skipped and not reused
+            if frame.timestamps is not None:
+                frame.timestamps.inference_start = start_time
+                frame.timestamps.inference_end = end_time
+                if cache._pipeline_metrics is not None:
+                    if processed:
+                        cache._pipeline_metrics.record_stage(STAGE_INFERENCE, inference_duration)
+                    cache._pipeline_metrics.record_output(OUTPUT_INFERENCE, frame.timestamps, end_time)
+            results.append(InferenceResult(
+                density_map=density_map,
+                people_count=people_count,
+                frame_sequence_number=frame.sequence_number,
+                frame_timestamp=frame.timestamp,
+                inference_duration=inference_duration if processed else 0.0,
+                latency=time.time() - frame.timestamp,
+            ))
+        return results
+
+
+class _Sensor:
+    def __init__(self, frame_slot: LatestFrameSlot, result_cache: InferenceResultCache):
+        self.frame_slot = frame_slot
+        self.result_cache = result_cache
+        self.latest_result = None  # type: Union[InferenceResult, None]
+        self.result_listeners = []  # type: List[Callable[[InferenceResult], None]]
+        self.number_of_processed_frames = 0
+        self.number_of_skipped_frames = 0
+
+
+class InferenceWorker:
+    """
+    Runs the model in its own thread, always on the newest available frames of the sensors.
+    New frames of all sensors are processed together, in one batch per tick.
+    Frames published while the previous inference was running are skipped.
+
+    Frame slots of the sensors have to be created with `new_frame_condition` (to wake up the worker).
+    """
+
+    NEW_FRAME_WAIT_TIMEOUT = 1
+
+    def __init__(self):
+        self.new_frame_condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__)
+        self._condition = threading.Condition()
+        self._sensors = collections.OrderedDict()  # type: Dict[str, _Sensor]
+        self._all_sensors_result_listeners = []  # type: List[Callable[[InferenceResult], None]]
+        self._number_of_batches = 0
+
+    def add_sensor(self, sensor_name: str, frame_slot: LatestFrameSlot, result_cache: InferenceResultCache):
+        """ Has to be called before `start` """
+        self._sensors[sensor_name] = _Sensor(frame_slot=frame_slot, result_cache=result_cache)
+
+    def start(self):
+        self._thread.start()
+
+    def add_result_listener(self, listener: Callable[[InferenceResult], None], sensor_name: str = None):
+        """
+        Listener is called from the worker thread for every new result (of the sensor, or of all sensors
+        if `sensor_name` is None), it should return quickly
+        """
+        if sensor_name is None:
+            self._all_sensors_result_listeners.append(listener)
+        else:
+            self._sensors[sensor_name].result_listeners.append(listener)
+
+    def get_sensor_names(self) -> List[str]:
+        return list(self._sensors.keys())
+
+    def get_latest_result(self, sensor_name: str = None) -> Union[InferenceResult, None]:
+        """ `sensor_name` can be omitted if there is only one sensor """
+        return self._get_sensor(sensor_name).latest_result
+
+    def wait_for_newer_result(self, frame_sequence_number: int, timeout=None,
+                              sensor_name: str = None) -> Union[InferenceResult, None]:
+        """ Block until a result for a frame newer than `frame_sequence_number` is available. None on timeout """
+        sensor = self._get_sensor(sensor_name)
+
+        def is_newer_result_available():
+            return sensor.latest_result is not None \
+                and sensor.latest_result.frame_sequence_number > frame_sequence_number
+
+        with self._condition:
+            if not self._condition.wait_for(is_newer_result_available, timeout=timeout):
+                return None
+            return sensor.latest_result
+
+    def get_stats(self, sensor_name: str = None) -> dict:
+        """ Stats of the sensor, or summed over all sensors if `sensor_name` is None """
+        sensors = self._sensors.values() if sensor_name is None else [self._sensors[sensor_name]]
+        return {
+            'processed_frames': sum(sensor.number_of_processed_frames for sensor in sensors),
+            'skipped_frames': sum(sensor.number_of_skipped_frames for sensor in sensors),
+            'batches': self._number_of_batches,
+        }
+
+    def _get_sensor(self, sensor_name: Union[str, None]) -> _Sensor:
+        if sensor_name is None:
+            if len(self._sensors) != 1:
+                raise Exception("Sensor name is required with more than one sensor!")
+            return next(iter(self._sensors.values()))
+        return self._sensors[sensor_name]
+
+    def _wait_for_new_frames(self, sequence_numbers: Dict[str, int]) -> Dict[str, IrFrame]:
+        """ :return: latest frames of the sensors with a frame newer than in `sequence_numbers`, empty on timeout """
+        def get_new_frames():
+            return {sensor_name: sensor.frame_slot.get_latest() for sensor_name, sensor in self._sensors.items()
+                    if sensor.frame_slot.get_sequence_number() > sequence_numbers.get(sensor_name, 0)}
+
+        with self.new_frame_condition:
+            self.new_frame_condition.wait_for(get_new_frames, timeout=self.NEW_FRAME_WAIT_TIMEOUT)
+            return get_new_frames()
+
+    def _run(self):
+        logger.info(f"_run inference started, sensors: {', '.join(self._sensors.keys())}")
+        sequence_numbers = {}  # sensor_name: sequence number of the latest processed frame
+        while True:
+            try:
+                new_frames = self._wait_for_new_frames(sequence_numbers)
+                if not new_frames:
+                    continue
+                results = InferenceResultCache.get_results_batched(
+                    [(self._sensors[sensor_name].result_cache, frame) for sensor_name, frame in new_frames.items()],
+                    apply_gates=True)
+                self._number_of_batches += 1
+
+                for (sensor_name, frame), result in zip(new_frames.items(), results):
+                    sensor = self._sensors[sensor_name]
+                    if sensor_name in sequence_numbers:
+                        sensor.number_of_skipped_frames += frame.sequence_number - sequence_numbers[sensor_name] - 1
+                    sequence_numbers[sensor_name] = frame.sequence_number
+                    sensor.number_of_processed_frames += 1
+                    self._publish_result(sensor, result)
+            except:
+                logger.exception("Inference iteration error!")
+                time.sleep(0.1)  # to not spam with log if it fails all the time
+
+    def _publish_result(self, sensor: _Sensor, result: InferenceResult):
+        with self._condition:
+            sensor.latest_result = result
+            self._condition.notify_all()
+        for listener in sensor.result_listeners + self._all_sensors_result_listeners:
+            try:
+                listener(result)
+            except:
+                logger.exception("Inference result listener error!")
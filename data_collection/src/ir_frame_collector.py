@@ -1,145 +1,227 @@
-import copy
 import logging
 import time
-from typing import Union
-from dataclasses import dataclass
-import queue
-import io
-
-import cv2
-import numpy as np
+from typing import Callable, List, Union
 import threading
-from matplotlib import pyplot as plt
 
 # from devices.ir_camera import IrCamera
+from background_model import BackgroundModel
+from change_gate import TemporalChangeGate
+from frame_publication import FrameBufferPool, FrameTimestamps, IrFrame, LatestFrameSlot
+from frame_queue import QUEUE_POLICY_SPILL
+from inference_worker import InferenceResult, InferenceResultCache, InferenceWorker
+from ir_frame_recorder import DEFAULT_QUEUE_CAPACITY, IrFrameRecorder
+from ir_frame_recording import SAMPLE_FORMAT_INT16_CENTI_DEGREES
+from occupancy_history import OccupancyHistory
+from pipeline_metrics import PipelineMetrics
+from thermal_renderer import ThermalRenderer
 from trained_model.frame_processor import FrameProcessor
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-@dataclass
-class IrFrame:
-    data: np.ndarray
-    timestamp: float
+DEFAULT_SENSOR_NAME = 'ir'
 
 
 class IrFrameCollector:
-    def __init__(self, ir_camera, video_zoom: int, save_video: bool):
-        self._frames_queue = queue.Queue()
-        self._access_lock = threading.RLock()
-        self._record_frames = False
+    """
+    Acquisition, recording and inference of one IR sensor.
+    Collectors of several sensors can share one `inference_worker` (which batches frames of all the sensors and
+    which has to be started separately), otherwise the collector has its own.
+    """
+
+    def __init__(self, ir_camera, video_zoom: int, save_video: bool,
+                 recording_sample_format=SAMPLE_FORMAT_INT16_CENTI_DEGREES, frame_processor: FrameProcessor = None,
+                 name: str = DEFAULT_SENSOR_NAME, inference_worker: InferenceWorker = None,
+                 recording_queue_capacity=DEFAULT_QUEUE_CAPACITY, recording_queue_policy=QUEUE_POLICY_SPILL,
+                 recording_pre_roll_duration=0.0, background_model: BackgroundModel = None,
+                 change_gate: TemporalChangeGate = None):
+        """
+        :param recording_queue_policy: what to do when the recording can not keep up, see frame_queue.py
+        :param recording_pre_roll_duration: [s] of the frames before the start of a recording recorded with it
+        :param background_model: of this sensor, to skip the inference of empty frames (see background_model.py)
+        :param change_gate: of this sensor, to reuse the output for nearly identical frames (see change_gate.py)
+        """
         self._ir_camera = ir_camera  # type: IrCamera
-        self._reading_thread = threading.Thread(target=self._run_reading, name=self.__class__.__name__ + '_read')
-        self._writing_thread = threading.Thread(target=self._run_writing, name=self.__class__.__name__ + '_write')
-        self._colormap = plt.get_cmap('inferno')  # default for imshow is 'viridis'
-        self._latest_frame = None
-        self._zoomed_frame_size = (self._ir_camera.RESOLUTION_Y * video_zoom, self._ir_camera.RESOLUTION_X * video_zoom)
-        self._zoomed_frame_size_cv = (self._zoomed_frame_size[1], self._zoomed_frame_size[0])
+        self._name = name
+        self._own_inference_worker = inference_worker is None
+        self._inference_worker = inference_worker or InferenceWorker()
+        self._reading_thread = threading.Thread(target=self._run_reading,
+                                                name=self.__class__.__name__ + '_read_' + name)
+        self._latest_frame_slot = LatestFrameSlot(condition=self._inference_worker.new_frame_condition)
+        self._video_zoom = video_zoom
         self._save_video = save_video
-        self._csv_file = None  # type: io.TextIOWrapper
-        self._video_writer = None
-        self._number_of_frames_written_to_csv_file = 0
-        self.frame_processor = FrameProcessor()
+        self._pending_doubled_freq_hz = None  # applied by the reading thread (not during a camera read)
+        self._pipeline_metrics = PipelineMetrics(expected_fps=self._ir_camera.get_fps(), labels={'sensor': name})
+        self._frame_recorder = IrFrameRecorder(
+            resolution=self._ir_camera.RESOLUTION, fps=self._ir_camera.get_fps(),
+            video_renderer=self.create_renderer(), recording_sample_format=recording_sample_format,
+            pipeline_metrics=self._pipeline_metrics, queue_capacity=recording_queue_capacity,
+            queue_policy=recording_queue_policy, save_video=save_video,
+            pre_roll_duration=recording_pre_roll_duration)
+        # buffers held by the slot and the recorder, and the frame being read
+        self._frame_buffer_pool = FrameBufferPool(
+            shape=(self._ir_camera.RESOLUTION_Y * self._ir_camera.RESOLUTION_X,),
+            size=self._latest_frame_slot.get_ring_size() + self._frame_recorder.get_max_held_frames() + 1)
+        self._last_sequence_number = 0
+        self._frame_listeners = []  # type: List[Callable[[IrFrame], None]]
+        self.frame_processor = frame_processor or FrameProcessor()
+        self._inference_result_cache = InferenceResultCache(frame_processor=self.frame_processor,
+                                                            pipeline_metrics=self._pipeline_metrics,
+                                                            background_model=background_model,
+                                                            change_gate=change_gate)
+        self._inference_worker.add_sensor(name, frame_slot=self._latest_frame_slot,
+                                          result_cache=self._inference_result_cache)
+        self._occupancy_history = OccupancyHistory()
+        self.add_inference_result_listener(self._occupancy_history.add_inference_result)
+        self._pipeline_metrics.add_gauge('recording_queue_depth', 'Frames waiting in the recording queue',
+                                         self._frame_recorder.get_queue_size)
+        self._pipeline_metrics.add_counter(
+            'recording_dropped_frames_total', 'Frames dropped by the full recording queue',
+            lambda: {'oldest': self._frame_recorder.get_queue_stats()['dropped_oldest_frames'],
+                     'newest': self._frame_recorder.get_queue_stats()['dropped_newest_frames']},
+            label_name='end')
+        self._pipeline_metrics.add_counter('recording_spilled_frames_total',
+                                           'Frames spilled to disk by the full recording queue',
+                                           lambda: self._frame_recorder.get_queue_stats()['spilled_frames'])
+        self._pipeline_metrics.add_counter('recording_blocked_seconds_total',
+                                           'Time the frame reading was blocked by the full recording queue',
+                                           lambda: self._frame_recorder.get_queue_stats()['blocked_duration'])
+        self._pipeline_metrics.add_gauge('frame_buffers_in_use', 'Pooled frame buffers referenced by the pipeline',
+                                         lambda: self._frame_buffer_pool.get_stats()['in_use'])
+        self._pipeline_metrics.add_counter('inference_skipped_frames_total',
+                                           'Frames skipped by the inference worker (busy with a previous frame)',
+                                           lambda: self._inference_worker.get_stats(name)['skipped_frames'])
+        if background_model is not None:
+            self._pipeline_metrics.add_counter('inference_empty_frames_total',
+                                               'Frames of the empty room not processed by the model',
+                                               lambda: background_model.get_stats()['skipped_frames'])
+        if change_gate is not None:
+            self._pipeline_metrics.add_counter('inference_reused_frames_total',
+                                               'Frames given the output of the previous nearly identical frame',
+                                               lambda: change_gate.get_stats()['reused_frames'])
+            self._pipeline_metrics.add_counter('inference_forced_refreshes_total',
+                                               'Frames processed by the model only because of the reuse limit',
+                                               lambda: change_gate.get_stats()['forced_refreshes'])
 
     def start(self):
         self._reading_thread.start()
-        self._writing_thread.start()
+        self._frame_recorder.start()
+        if self._own_inference_worker:
+            self._inference_worker.start()
+
+    def get_name(self) -> str:
+        return self._name
 
     def get_latest_frame(self) -> Union[IrFrame, None]:
-        with self._access_lock:
-            return copy.deepcopy(self._latest_frame)
+        """ Latest frame, with read-only data shared with other readers (see LatestFrameSlot) """
+        return self._latest_frame_slot.get_latest()
 
-    def start_recording_frames(self, video_file_path, csv_file_path):
-        logger.info("About to start_recording_frames")
+    def wait_for_newer_frame(self, sequence_number: int, timeout=None) -> Union[IrFrame, None]:
+        """ Block until a frame newer than `sequence_number` is available. None on timeout """
+        return self._latest_frame_slot.wait_for_newer(sequence_number, timeout=timeout)
 
-        self._csv_file = open(csv_file_path, 'wt')
-        self._csv_file.write("no, timestamp, data_array\n")
+    def get_inference_worker(self) -> InferenceWorker:
+        return self._inference_worker
 
-        fourcc = cv2.VideoWriter_fourcc(*'MJPG')  # try also: MJPG and .avi
-        fps = self._ir_camera.get_fps()
-        self._video_writer = cv2.VideoWriter(video_file_path, fourcc, fps, self._zoomed_frame_size_cv)
-        self._record_frames = True
+    def add_frame_listener(self, listener: Callable[[IrFrame], None]):
+        """ Listener is called from the reading thread for every new frame, it should return quickly """
+        self._frame_listeners.append(listener)
 
-    def stop_recording_frames(self):
-        self._record_frames = False
+    def add_inference_result_listener(self, listener: Callable[[InferenceResult], None]):
+        """ Listener is called from the inference worker thread for every new result, it should return quickly """
+        self._inference_worker.add_result_listener(listener, sensor_name=self._name)
 
-        self._frames_queue.join()  # wait until queue is empty
-        logger.info('frames queue empty - stopped!')
-        self._csv_file.close()
-        self._video_writer.release()
-        self._number_of_frames_written_to_csv_file = 0
+    def get_latest_inference_result(self) -> Union[InferenceResult, None]:
+        return self._inference_worker.get_latest_result(self._name)
 
-    def _run_writing(self):
-        logger.info("_run_writing started")
-        while True:
-            frame = self._frames_queue.get()
-            # logger.debug("_run_writing - next frame!")
-            try:
-                data_str = ','.join([f"{t:.2f}" for t in frame.data])
-                self._csv_file.write(f'{self._number_of_frames_written_to_csv_file},'
-                                     f'{frame.timestamp},'
-                                     f'{data_str}\n')
-                self._number_of_frames_written_to_csv_file += 1
+    def get_inference_result(self, frame: IrFrame) -> InferenceResult:
+        """ Inference result of the frame, shared with all other consumers (see InferenceResultCache) """
+        return self._inference_result_cache.get_result(frame)
 
-                final_video_frame = self.raw_frame_to_frame_for_video(
-                    frame.data, min_temp=18, max_temp=35)
-                self._video_writer.write(final_video_frame)
+    def get_occupancy_history(self) -> OccupancyHistory:
+        return self._occupancy_history
 
-                self.frame_processor.process_frame(frame.data)
-            except:
-                logger.exception('Frame writing iteration error!')
-            self._frames_queue.task_done()
+    def get_pipeline_metrics(self) -> PipelineMetrics:
+        return self._pipeline_metrics
+
+    def get_inference_stats(self) -> dict:
+        return {
+            'worker': self._inference_worker.get_stats(self._name),
+            'result_cache': self._inference_result_cache.get_stats(),
+        }
+
+    def create_renderer(self, rotation=None, flip_code=None) -> ThermalRenderer:
+        """ Renderer of frames from this collector (with the video zoom). One per thread """
+        return ThermalRenderer(resolution=self._ir_camera.RESOLUTION, zoom=self._video_zoom,
+                               rotation=rotation, flip_code=flip_code)
+
+    def start_recording_frames(self, video_file_path, frames_file_path_prefix):
+        self._frame_recorder.start_recording_frames(
+            video_file_path=video_file_path, frames_file_path_prefix=frames_file_path_prefix)
+
+    def rotate_recording_frames(self, video_file_path, frames_file_path_prefix):
+        """ Continue the recording in new files without a gap, see IrFrameRecorder """
+        self._frame_recorder.rotate_recording_frames(
+            video_file_path=video_file_path, frames_file_path_prefix=frames_file_path_prefix)
+
+    def stop_recording_frames(self):
+        self._frame_recorder.stop_recording_frames()
+
+    def set_doubled_freq_hz(self, doubled_freq_hz: int):
+        """ Change the refresh rate of the camera (see IrCamera), before the next frame read """
+        self._pending_doubled_freq_hz = doubled_freq_hz
+
+    def set_video_zoom(self, video_zoom: int):
+        """ Zoom of the recorded video (from the next recording batch) and of new renderers """
+        self._video_zoom = video_zoom
+        self._frame_recorder.set_video_renderer(self.create_renderer())
+
+    def get_recording_queue_size(self) -> int:
+        """ Number of frames waiting to be written """
+        return self._frame_recorder.get_queue_size()
 
     def _run_reading(self):
         logger.info("_run_reading started")
         previous_frame_time = time.time()
         while True:
             try:
-                new_frame = IrFrame(
-                    data=self._ir_camera.get_frame(),
-                    timestamp=time.time(),
-                )
-
-                new_time = time.time()
-                logger.debug(f"New IR frame collected. Diff =   "
-                             f"{int((new_time-previous_frame_time)*1000)}")
-                previous_frame_time = new_time
-
-                with self._access_lock:
-                    self._latest_frame = new_frame
-
-                if not self._record_frames:
-                    continue
-                self._frames_queue.put(new_frame)
+                if self._pending_doubled_freq_hz is not None:
+                    self._apply_doubled_freq_hz()
+                buffer_index = self._frame_buffer_pool.acquire()
+                try:
+                    frame_timestamps = FrameTimestamps(read_start=time.monotonic())
+                    self._ir_camera.get_frame(out=self._frame_buffer_pool.get_buffer(buffer_index))
+                    frame_timestamps.read_end = time.monotonic()
+                    self._last_sequence_number += 1
+                    frame = IrFrame(data=self._frame_buffer_pool.get_read_only_view(buffer_index),
+                                    timestamp=time.time(), sequence_number=self._last_sequence_number,
+                                    timestamps=frame_timestamps, monotonic_timestamp=frame_timestamps.read_end,
+                                    buffer_index=buffer_index, buffer_pool=self._frame_buffer_pool)
+                    self._pipeline_metrics.record_acquired_frame(frame_timestamps)
+                    self._latest_frame_slot.publish(frame)
+
+                    new_time = time.time()
+                    logger.debug(f"New IR frame collected. Diff =   "
+                                 f"{int((new_time-previous_frame_time)*1000)}")
+                    previous_frame_time = new_time
+
+                    self._frame_recorder.add_frame(frame)
+                    for listener in self._frame_listeners:
+                        try:
+                            listener(frame)
+                        except:
+                            logger.exception("Frame listener error!")
+                finally:
+                    self._frame_buffer_pool.release(buffer_index)  # the consumers hold their own references
             except:
                 logger.exception("Failed to acquire new IR frame!")
                 time.sleep(0.1)  # to not spam with log if it fails all the time
 
-    def raw_frame_to_frame_for_video(self, raw_frame, min_temp=None, max_temp=None, as_bgr=True):
-        frame_2d = np.reshape(raw_frame, self._ir_camera.RESOLUTION)
-        frame_resized_not_clipped = cv2.resize(src=frame_2d, dsize=self._zoomed_frame_size_cv, interpolation=cv2.INTER_CUBIC)
-
-        if min_temp is None:
-            min_temp = np.min(raw_frame)
-        if max_temp is None:
-            max_temp = np.max(raw_frame)
-        # logger.debug(f"raw_frame_to_frame_for_video: min={min_temp}, max={max_temp}")
-
-        frame_resized = np.clip(frame_resized_not_clipped, min_temp, max_temp)
-
-        frame_resized_normalized = (frame_resized - min_temp) * (255 / (max_temp - min_temp))
-        frame_resized_normalized_u8 = frame_resized_normalized.astype(np.uint8)
-        heatmap_u8 = (self._colormap(frame_resized_normalized_u8) * 2**8).astype(np.uint8)[:, :, :3]
-
-        if as_bgr:
-            heatmap_u8_bgr = cv2.cvtColor(heatmap_u8, cv2.COLOR_RGB2BGR)
-            return heatmap_u8_bgr
-            # heatmap_u8_rgb = heatmap_u8_bgr[..., ::-1]
-        else:
-            return heatmap_u8
-
-        # plt.imshow(frame_resized_normalized, norm=matplotlib.colors.Normalize(vmin=0, vmax=255))
-        # plt.show()
-        # cv2.imshow('frame_resized_normalized', final_frame)
-        # cv2.waitKey(0)
+    def _apply_doubled_freq_hz(self):
+        doubled_freq_hz, self._pending_doubled_freq_hz = self._pending_doubled_freq_hz, None
+        self._ir_camera.set_doubled_freq_hz(doubled_freq_hz)
+        self._pipeline_metrics.set_expected_fps(self._ir_camera.get_fps())
+        self._frame_recorder.set_fps(self._ir_camera.get_fps())
+        logger.info(f"IR camera refresh rate of sensor '{self._name}' set to {doubled_freq_hz / 2} Hz "
+                    f"({self._ir_camera.get_fps():.2f} fps)")
@@ -0,0 +1,311 @@
+import collections
+import logging
+import math
+import queue
+import threading
+import time
+
+import cv2
+
+from frame_publication import IrFrame
+from frame_queue import QUEUE_POLICY_SPILL, BoundedFrameQueue
+from ir_frame_recording import IrFrameBinaryWriter, SAMPLE_FORMAT_INT16_CENTI_DEGREES, write_metadata
+from pipeline_metrics import (OUTPUT_RECORDED, STAGE_BATCH_CLOSE, STAGE_BATCH_OPEN, STAGE_BATCH_SWITCH,
+                              STAGE_FRAMES_WRITE, STAGE_QUEUE_WAIT, STAGE_VIDEO_WRITE, PipelineMetrics)
+from thermal_renderer import ThermalRenderer
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_QUEUE_CAPACITY = 256  # ~2 minutes at 2 fps, ~1.5 MB
+VIDEO_FOURCC = 'MJPG'  # try also: MJPG and .avi
+VIDEO_MIN_TEMP = 18  # colormap range of the video
+VIDEO_MAX_TEMP = 35
+
+
+class _RecordingBatch:
+    """ Writers of one recording (batch), with the stats for its metadata """
+
+    def __init__(self, frames_file_path_prefix: str, frames_writer: IrFrameBinaryWriter, video_writer,
+                 video_renderer: ThermalRenderer, fps: float):
+        """ :param video_writer: None if the video is not recorded """
+        self.frames_file_path_prefix = frames_file_path_prefix
+        self.frames_writer = frames_writer
+        self.video_writer = video_writer
+        self.video_renderer = video_renderer
+        self.video_frame_buffer = video_renderer.create_output_buffer() if video_writer is not None else None
+        self.fps = fps
+        self.min_sequence_number = 0  # frames with a lower sequence number belong to the previous batch
+        self.rotation_request_time = None  # time.monotonic() of `rotate_recording_frames`
+        self.first_sequence_number = None
+        self.last_sequence_number = None
+        self.start_queue_stats = {}
+        self.end_queue_stats = {}
+
+
+class IrFrameRecorder:
+    """
+    Writes IR frames to a recording (binary frames and colormapped video) in its own thread.
+    Frames are queued with `add_frame` while the recording is active, into a BoundedFrameQueue with the given
+    overload policy. Frames dropped (or spilled, blocked) during a recording are counted in its metadata
+    ('<prefix>.meta.json', see ir_frame_recording.py), together with the range of the frame sequence numbers.
+
+    `rotate_recording_frames` continues the recording in new files without a gap: the writers of the next batch
+    are opened by the caller, the writing thread switches to them at the first frame added after the call
+    (by the frame sequence number), and the previous batch is closed in the background.
+    Changes of the frame rate and of the video renderer (`set_fps`, `set_video_renderer`) take effect
+    with the next recording, as the video size and frame rate are fixed for a file.
+    Without `save_video` only the raw frames are recorded - the video can be rendered offline
+    (misc/render_batches.py), which saves the rendering and encoding on the device.
+    With `pre_roll_duration`, the frames added while not recording are kept in a ring buffer (of that duration),
+    and recorded at the start of the next recording - for the activity-triggered recording (see activity_monitor.py).
+    The recorder holds a reference to the buffers of the queued and pre-roll frames (see FrameBufferPool).
+    """
+
+    def __init__(self, resolution, fps: float, video_renderer: ThermalRenderer,
+                 recording_sample_format=SAMPLE_FORMAT_INT16_CENTI_DEGREES, pipeline_metrics: PipelineMetrics = None,
+                 queue_capacity=DEFAULT_QUEUE_CAPACITY, queue_policy=QUEUE_POLICY_SPILL, spill_dir_path=None,
+                 save_video=True, pre_roll_duration=0.0):
+        """
+        :param queue_policy: see frame_queue.py
+        :param pre_roll_duration: [s] of the frames before the start of a recording which are recorded with it
+        """
+        self._resolution = resolution
+        self._fps = fps
+        self._save_video = save_video
+        self._pre_roll_duration = pre_roll_duration
+        self._pre_roll_frames = collections.deque(maxlen=self._get_pre_roll_capacity())
+        self._adding_lock = threading.Lock()  # frames added while the recording starts go after the pre-roll
+        self._frames_queue = BoundedFrameQueue(capacity=queue_capacity, policy=queue_policy,
+                                               spill_dir_path=spill_dir_path)
+        self._record_frames = False
+        self._writing_thread = threading.Thread(target=self._run_writing, name=self.__class__.__name__ + '_write')
+        self._closing_thread = threading.Thread(target=self._run_closing, name=self.__class__.__name__ + '_close')
+        self._next_video_renderer = video_renderer
+        self._recording_sample_format = recording_sample_format
+        self._current_batch = None  # type: _RecordingBatch
+        self._next_batch = None  # type: _RecordingBatch
+        self._batch_lock = threading.Lock()  # for the switch to the next batch
+        self._batches_to_close = queue.Queue()
+        self._last_added_sequence_number = 0
+        self._pipeline_metrics = pipeline_metrics
+
+    def start(self):
+        self._writing_thread.start()
+        self._closing_thread.start()
+
+    def is_recording(self) -> bool:
+        return self._record_frames
+
+    def get_queue_size(self) -> int:
+        return self._frames_queue.qsize()
+
+    def get_queue_stats(self) -> dict:
+        """ Dropped, spilled and blocked frames since the start, see BoundedFrameQueue.get_stats """
+        return self._frames_queue.get_stats()
+
+    def get_max_held_frames(self) -> int:
+        """ Frames referenced by the recorder at most - queued in memory, in the pre-roll and being written """
+        return self._frames_queue.get_capacity() + self._get_pre_roll_capacity() + 1
+
+    def set_fps(self, fps: float):
+        self._fps = fps
+        with self._adding_lock:
+            pre_roll_capacity = self._get_pre_roll_capacity()
+            while len(self._pre_roll_frames) > pre_roll_capacity:
+                self._pre_roll_frames.popleft().release()
+            self._pre_roll_frames = collections.deque(self._pre_roll_frames, maxlen=pre_roll_capacity)
+
+    def set_video_renderer(self, video_renderer: ThermalRenderer):
+        self._next_video_renderer = video_renderer
+
+    def add_frame(self, frame: IrFrame):
+        """
+        The frame data has to stay unchanged until it is written (a reference to a pooled buffer is added).
+        Frames are added by a single thread
+        """
+        with self._adding_lock:
+            if not self._record_frames:
+                if self._pre_roll_frames.maxlen:
+                    if len(self._pre_roll_frames) == self._pre_roll_frames.maxlen:
+                        self._pre_roll_frames.popleft().release()
+                    frame.add_reference()
+                    self._pre_roll_frames.append(frame)
+                return
+            if frame.timestamps is not None:
+                frame.timestamps.enqueue = time.monotonic()
+            self._last_added_sequence_number = frame.sequence_number
+            frame.add_reference()
+            self._frames_queue.put(frame)
+
+    def start_recording_frames(self, video_file_path, frames_file_path_prefix):
+        logger.info("About to start_recording_frames")
+
+        batch = self._open_batch(video_file_path, frames_file_path_prefix)
+        batch.start_queue_stats = self._frames_queue.get_stats()
+        self._frames_queue.reset_max_size()
+        self._current_batch = batch
+        with self._adding_lock:
+            if self._pre_roll_frames:
+                logger.info(f"Recording {len(self._pre_roll_frames)} pre-roll frames")
+            for frame in self._pre_roll_frames:
+                # without the timestamps, the age of the pre-roll frames does not distort the latency metrics
+                self._last_added_sequence_number = frame.sequence_number
+                self._frames_queue.put(frame.replace(timestamps=None))  # with the reference of the pre-roll
+            self._pre_roll_frames.clear()
+            self._record_frames = True
+
+    def rotate_recording_frames(self, video_file_path, frames_file_path_prefix):
+        """ Continue the recording in new files, without a gap. Starts the recording if it is not active """
+        if not self._record_frames:
+            self.start_recording_frames(video_file_path, frames_file_path_prefix)
+            return
+
+        open_start_time = time.monotonic()
+        batch = self._open_batch(video_file_path, frames_file_path_prefix)
+        self._record_stage(STAGE_BATCH_OPEN, time.monotonic() - open_start_time)
+        with self._batch_lock:
+            if self._next_batch is not None:  # rotated again before any frame of the previous rotation was written
+                logger.warning(f"No frames recorded to '{self._next_batch.frames_file_path_prefix}'")
+                self._next_batch.start_queue_stats = self._next_batch.end_queue_stats = self._frames_queue.get_stats()
+                self._batches_to_close.put(self._next_batch)
+            batch.min_sequence_number = self._last_added_sequence_number + 1
+            batch.rotation_request_time = time.monotonic()
+            self._next_batch = batch
+        logger.info(f"Recording rotated to '{frames_file_path_prefix}' from frame {batch.min_sequence_number}")
+
+    def stop_recording_frames(self):
+        """ Returns once all queued frames are written and all batches closed """
+        with self._adding_lock:
+            self._record_frames = False
+
+        self._frames_queue.join()  # wait until queue is empty
+        logger.info('frames queue empty - stopped!')
+        with self._batch_lock:
+            batches = [batch for batch in [self._current_batch, self._next_batch] if batch is not None]
+            self._current_batch = self._next_batch = None
+        queue_stats = self._frames_queue.get_stats()
+        for batch in batches:
+            batch.start_queue_stats = batch.start_queue_stats or queue_stats
+            batch.end_queue_stats = queue_stats
+            self._batches_to_close.put(batch)
+        self._batches_to_close.join()
+
+    def _get_pre_roll_capacity(self) -> int:
+        return math.ceil(self._pre_roll_duration * self._fps)
+
+    def _open_batch(self, video_file_path, frames_file_path_prefix) -> _RecordingBatch:
+        frames_writer = IrFrameBinaryWriter(
+            file_path_prefix=frames_file_path_prefix,
+            resolution=self._resolution,
+            sample_format=self._recording_sample_format)
+        video_renderer = self._next_video_renderer
+        video_writer = None
+        if self._save_video:
+            video_writer = cv2.VideoWriter(video_file_path, cv2.VideoWriter_fourcc(*VIDEO_FOURCC), self._fps,
+                                           video_renderer.output_size_cv)
+        return _RecordingBatch(frames_file_path_prefix=frames_file_path_prefix, frames_writer=frames_writer,
+                               video_writer=video_writer, video_renderer=video_renderer, fps=self._fps)
+
+    def _close_batch(self, batch: _RecordingBatch):
+        batch.frames_writer.close()
+        logger.info(f'{batch.frames_writer.get_number_of_frames_written()} frames recorded '
+                    f'({batch.frames_writer.get_number_of_bytes_written()} bytes) '
+                    f'to \'{batch.frames_file_path_prefix}\'')
+        if batch.video_writer is not None:
+            batch.video_writer.release()
+        self._write_metadata(batch)
+
+    def _write_metadata(self, batch: _RecordingBatch):
+        recording_queue_stats = {name: value - batch.start_queue_stats[name]
+                                 for name, value in batch.end_queue_stats.items() if name != 'max_size'}
+        recording_queue_stats['max_size'] = batch.end_queue_stats['max_size']
+        metadata = {
+            'fps': batch.fps,
+            'number_of_frames': batch.frames_writer.get_number_of_frames_written(),
+            # gaps: number_of_frames < last - first + 1 (frames dropped by the recorder or not acquired)
+            'first_frame_sequence_number': batch.first_sequence_number,
+            'last_frame_sequence_number': batch.last_sequence_number,
+            'recording_queue': dict(policy=self._frames_queue.get_policy(),
+                                    capacity=self._frames_queue.get_capacity(),
+                                    **recording_queue_stats),
+        }
+        write_metadata(batch.frames_file_path_prefix, metadata)
+        number_of_dropped_frames = (recording_queue_stats['dropped_oldest_frames']
+                                    + recording_queue_stats['dropped_newest_frames'])
+        if number_of_dropped_frames or recording_queue_stats['spilled_frames'] or recording_queue_stats['blocked_puts']:
+            logger.warning(f"Recording queue overloaded: {number_of_dropped_frames} frames dropped, "
+                           f"{recording_queue_stats['spilled_frames']} spilled, "
+                           f"{recording_queue_stats['blocked_puts']} blocked "
+                           f"({recording_queue_stats['blocked_duration']:.1f} s)")
+
+    def _get_batch_for_frame(self, frame: IrFrame) -> _RecordingBatch:
+        """ Switches to the next batch at its first frame """
+        next_batch = self._next_batch
+        if next_batch is not None and frame.sequence_number >= next_batch.min_sequence_number:
+            with self._batch_lock:
+                if self._next_batch is next_batch:
+                    queue_stats = self._frames_queue.get_stats()
+                    self._current_batch.end_queue_stats = next_batch.start_queue_stats = queue_stats
+                    self._frames_queue.reset_max_size()
+                    self._batches_to_close.put(self._current_batch)
+                    self._current_batch = next_batch
+                    self._next_batch = None
+                    self._record_stage(STAGE_BATCH_SWITCH, time.monotonic() - next_batch.rotation_request_time)
+        return self._current_batch
+
+    def _run_writing(self):
+        logger.info("_run_writing started")
+        while True:
+            frame = self._frames_queue.get()
+            # logger.debug("_run_writing - next frame!")
+            try:
+                batch = self._get_batch_for_frame(frame)
+                timestamps = frame.timestamps
+                if timestamps is not None:
+                    timestamps.dequeue = time.monotonic()
+                batch.frames_writer.write_frame(timestamp=frame.timestamp, data=frame.data)
+                if batch.first_sequence_number is None:
+                    batch.first_sequence_number = frame.sequence_number
+                batch.last_sequence_number = frame.sequence_number
+                if timestamps is not None:
+                    timestamps.frames_written = time.monotonic()
+
+                if batch.video_writer is not None:
+                    batch.video_renderer.render(frame.data, min_temp=VIDEO_MIN_TEMP, max_temp=VIDEO_MAX_TEMP,
+                                                as_bgr=True, out=batch.video_frame_buffer)
+                    batch.video_writer.write(batch.video_frame_buffer)
+                if timestamps is not None:
+                    timestamps.video_written = time.monotonic()
+                    self._record_metrics(timestamps)
+            except:
+                logger.exception('Frame writing iteration error!')
+            frame.release()
+            self._frames_queue.task_done()
+
+    def _run_closing(self):
+        """ Closes the finished batches (flushes the files and writes the metadata) """
+        while True:
+            batch = self._batches_to_close.get()
+            try:
+                close_start_time = time.monotonic()
+                self._close_batch(batch)
+                self._record_stage(STAGE_BATCH_CLOSE, time.monotonic() - close_start_time)
+            except:
+                logger.exception('Batch closing error!')
+            self._batches_to_close.task_done()
+
+    def _record_stage(self, stage: str, duration: float):
+        if self._pipeline_metrics is not None:
+            self._pipeline_metrics.record_stage(stage, duration)
+
+    def _record_metrics(self, timestamps):
+        if self._pipeline_metrics is None:
+            return
+        self._pipeline_metrics.record_stage(STAGE_QUEUE_WAIT, timestamps.dequeue - timestamps.enqueue)
+        self._pipeline_metrics.record_stage(STAGE_FRAMES_WRITE, timestamps.frames_written - timestamps.dequeue)
+        if self._save_video:
+            self._pipeline_metrics.record_stage(STAGE_VIDEO_WRITE,
+                                                timestamps.video_written - timestamps.frames_written)
+        self._pipeline_metrics.record_output(OUTPUT_RECORDED, timestamps, timestamps.video_written)
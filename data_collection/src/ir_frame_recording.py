@@ -0,0 +1,262 @@
+"""
+Chunked binary recording of raw IR frames.
+
+Each chunk file starts with a fixed-size header, followed by fixed-size records:
+    no (uint32), timestamp (float64), data (768 x int16 centi-degrees or float16)
+Chunks are named '<prefix>_000.bin', '<prefix>_001.bin', ...
+A partially written record at the end of a chunk (e.g. after power loss) is ignored by the reader.
+Metadata of the recording (e.g. frames dropped by the recorder) is written at its end to '<prefix>.meta.json'.
+Chunks compressed by BatchArchiver ('<prefix>_000.bin.xz') are read transparently (decompressed to memory).
+"""
+
+import glob
+import json
+import logging
+import os
+import struct
+
+import numpy as np
+
+from batch_archive import CODEC_FILE_EXTENSIONS, get_codec, get_original_file_path, open_batch_file
+
+
+logger = logging.getLogger(__name__)
+
+
+FILE_MAGIC = b'IRFRAMES'
+FORMAT_VERSION = 1
+HEADER_SIZE = 64
+# magic, version, sample_format, rows, cols, record_size, chunk_index
+_HEADER_STRUCT = struct.Struct('<8sHBxHHII')
+
+SAMPLE_FORMAT_INT16_CENTI_DEGREES = 0
+SAMPLE_FORMAT_FLOAT16 = 1
+_SAMPLE_DTYPES = {
+    SAMPLE_FORMAT_INT16_CENTI_DEGREES: np.dtype('<i2'),
+    SAMPLE_FORMAT_FLOAT16: np.dtype('<f2'),
+}
+
+DEFAULT_FRAMES_PER_CHUNK = 4096
+CHUNK_FILE_EXTENSION = '.bin'
+METADATA_FILE_SUFFIX = '.meta.json'
+
+
+def get_record_dtype(sample_format: int, resolution) -> np.dtype:
+    number_of_pixels = resolution[0] * resolution[1]
+    return np.dtype([
+        ('no', '<u4'),
+        ('timestamp', '<f8'),
+        ('data', _SAMPLE_DTYPES[sample_format], (number_of_pixels,)),
+    ])
+
+
+def get_chunk_file_path(file_path_prefix, chunk_index) -> str:
+    return f'{file_path_prefix}_{chunk_index:03}{CHUNK_FILE_EXTENSION}'
+
+
+def get_chunk_file_paths(file_path_prefix):
+    """ Uncompressed or compressed chunks (the uncompressed one if there are both) """
+    chunk_file_paths = {}
+    for extension in [''] + list(CODEC_FILE_EXTENSIONS.values()):
+        for chunk_file_path in glob.glob(glob.escape(file_path_prefix) + '_*' + CHUNK_FILE_EXTENSION + extension):
+            chunk_file_paths.setdefault(get_original_file_path(chunk_file_path), chunk_file_path)
+    return [chunk_file_paths[original_file_path] for original_file_path in sorted(chunk_file_paths)]
+
+
+def get_metadata_file_path(file_path_prefix) -> str:
+    return file_path_prefix + METADATA_FILE_SUFFIX
+
+
+def write_metadata(file_path_prefix, metadata: dict):
+    with open(get_metadata_file_path(file_path_prefix), 'wt') as file:
+        file.write(json.dumps(metadata, indent=2))
+
+
+def read_metadata(file_path_prefix) -> dict:
+    """ Empty if the recording has no metadata (older recordings, or the recording was not finished) """
+    metadata_file_path = get_metadata_file_path(file_path_prefix)
+    if not os.path.isfile(metadata_file_path):
+        return {}
+    with open(metadata_file_path, 'rt') as file:
+        return json.loads(file.read())
+
+
+def encode_header(sample_format: int, resolution, chunk_index: int) -> bytes:
+    record_size = get_record_dtype(sample_format, resolution).itemsize
+    header = _HEADER_STRUCT.pack(FILE_MAGIC, FORMAT_VERSION, sample_format,
+                                 resolution[0], resolution[1], record_size, chunk_index)
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def decode_header(header: bytes) -> dict:
+    magic, version, sample_format, rows, cols, record_size, chunk_index = \
+        _HEADER_STRUCT.unpack_from(header)
+    if magic != FILE_MAGIC:
+        raise Exception("Not an IR frames recording file (invalid magic)!")
+    if version != FORMAT_VERSION:
+        raise Exception(f"Unsupported IR frames recording version {version}!")
+    return {
+        'sample_format': sample_format,
+        'resolution': (rows, cols),
+        'record_size': record_size,
+        'chunk_index': chunk_index,
+    }
+
+
+class IrFrameBinaryWriter:
+    """ Appends raw IR frames as fixed-size binary records into chunked files """
+
+    def __init__(self, file_path_prefix, resolution,
+                 sample_format=SAMPLE_FORMAT_INT16_CENTI_DEGREES,
+                 frames_per_chunk=DEFAULT_FRAMES_PER_CHUNK):
+        self._file_path_prefix = file_path_prefix
+        self._resolution = resolution
+        self._sample_format = sample_format
+        self._frames_per_chunk = frames_per_chunk
+        self._record = np.zeros(1, dtype=get_record_dtype(sample_format, resolution))
+        self._record_data = self._record['data'][0]
+        self._scaled_data = np.zeros(self._record_data.shape, dtype=np.float64)  # no temporary arrays per frame
+        self._file = None
+        self._chunk_index = 0
+        self._frames_in_chunk = 0
+        self._number_of_frames_written = 0
+        self._number_of_bytes_written = 0
+
+    def get_number_of_frames_written(self):
+        return self._number_of_frames_written
+
+    def get_number_of_bytes_written(self):
+        return self._number_of_bytes_written
+
+    def write_frame(self, timestamp, data):
+        if self._file is None or self._frames_in_chunk >= self._frames_per_chunk:
+            self._open_next_chunk()
+
+        self._record['no'] = self._number_of_frames_written
+        self._record['timestamp'] = timestamp
+        if self._sample_format == SAMPLE_FORMAT_INT16_CENTI_DEGREES:
+            np.copyto(self._scaled_data, np.reshape(data, self._scaled_data.shape))
+            np.multiply(self._scaled_data, 100, out=self._scaled_data)
+            np.rint(self._scaled_data, out=self._scaled_data)
+            np.clip(self._scaled_data, -32768, 32767, out=self._scaled_data)
+            np.copyto(self._record_data, self._scaled_data, casting='unsafe')
+        else:
+            self._record_data[:] = data
+
+        self._file.write(self._record.data)
+        self._frames_in_chunk += 1
+        self._number_of_frames_written += 1
+        self._number_of_bytes_written += self._record.itemsize
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open_next_chunk(self):
+        if self._file is not None:
+            self._file.close()
+            self._chunk_index += 1
+        chunk_file_path = get_chunk_file_path(self._file_path_prefix, self._chunk_index)
+        logger.debug(f"Opening IR frames chunk file '{chunk_file_path}'")
+        self._file = open(chunk_file_path, 'wb')
+        header = encode_header(self._sample_format, self._resolution, self._chunk_index)
+        self._file.write(header)
+        self._number_of_bytes_written += len(header)
+        self._frames_in_chunk = 0
+
+
+class IrFrameBinaryReader:
+    """ Memory-mapped reader of frames written by IrFrameBinaryWriter """
+
+    def __init__(self, file_path_prefix):
+        self._file_path_prefix = file_path_prefix
+        self._chunks = []
+        self.resolution = None
+
+        chunk_file_paths = get_chunk_file_paths(file_path_prefix)
+        if not chunk_file_paths:
+            raise Exception(f"No IR frames chunk files found for '{file_path_prefix}'!")
+        for chunk_file_path in chunk_file_paths:
+            self._chunks.append(self._map_chunk(chunk_file_path))
+
+        self._chunk_start_indices = np.cumsum([0] + [len(chunk) for chunk in self._chunks])
+
+    def _map_chunk(self, chunk_file_path):
+        decompressed_data = None
+        with open_batch_file(chunk_file_path) as file:
+            header = decode_header(file.read(HEADER_SIZE))
+            if get_codec(chunk_file_path) is not None:
+                decompressed_data = file.read()
+                file_size = HEADER_SIZE + len(decompressed_data)
+            else:
+                file.seek(0, 2)
+                file_size = file.tell()
+
+        if self.resolution is None:
+            self.resolution = header['resolution']
+        elif self.resolution != header['resolution']:
+            raise Exception(f"Inconsistent resolution in chunk '{chunk_file_path}'!")
+
+        record_dtype = get_record_dtype(header['sample_format'], header['resolution'])
+        self._sample_format = header['sample_format']
+        number_of_records = (file_size - HEADER_SIZE) // record_dtype.itemsize
+        if number_of_records <= 0:
+            return np.zeros(0, dtype=record_dtype)
+        if decompressed_data is not None:
+            return np.frombuffer(decompressed_data, dtype=record_dtype, count=number_of_records)
+        return np.memmap(chunk_file_path, dtype=record_dtype, mode='r',
+                         offset=HEADER_SIZE, shape=(number_of_records,))
+
+    def _get_record(self, n):
+        chunk_number = int(np.searchsorted(self._chunk_start_indices, n, side='right')) - 1
+        return self._chunks[chunk_number][n - self._chunk_start_indices[chunk_number]]
+
+    def _samples_to_temperatures(self, samples) -> np.ndarray:
+        if self._sample_format == SAMPLE_FORMAT_INT16_CENTI_DEGREES:
+            return samples.astype(np.float64) / 100
+        return samples.astype(np.float64)
+
+    def get_number_of_frames(self):
+        return int(self._chunk_start_indices[-1])
+
+    def get_metadata(self) -> dict:
+        """ See IrFrameRecorder for the content, empty if not available """
+        return read_metadata(self._file_path_prefix)
+
+    def get_frame(self, n) -> np.ndarray:
+        """ Get n-th frame as 1D array of temperatures (same layout as IrCamera.get_frame) """
+        return self._samples_to_temperatures(self._get_record(n)['data'])
+
+    def get_timestamp(self, n) -> float:
+        return float(self._get_record(n)['timestamp'])
+
+    def get_all_frames(self) -> np.ndarray:
+        """ Get all frames as array of shape (N, number_of_pixels) """
+        if not self._chunks:
+            return np.zeros((0, self.resolution[0] * self.resolution[1]))
+        return self._samples_to_temperatures(np.concatenate([chunk['data'] for chunk in self._chunks]))
+
+    def get_all_timestamps(self) -> np.ndarray:
+        return np.concatenate([chunk['timestamp'] for chunk in self._chunks])
+
+    def export_to_csv(self, csv_file_path):
+        """ Write frames in the legacy 'ir.csv' layout """
+        with open(csv_file_path, 'wt') as csv_file:
+            csv_file.write("no, timestamp, data_array\n")
+            for n in range(self.get_number_of_frames()):
+                record = self._get_record(n)
+                data_str = ','.join([f"{t:.2f}" for t in self._samples_to_temperatures(record['data'])])
+                csv_file.write(f"{record['no']},{record['timestamp']},{data_str}\n")
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) != 3:
+        print(f"Usage: python {sys.argv[0]} <ir_frames_prefix, e.g. batch_dir/ir> <output_csv_path>")
+        sys.exit(1)
+    IrFrameBinaryReader(sys.argv[1]).export_to_csv(sys.argv[2])
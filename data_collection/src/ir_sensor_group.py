@@ -0,0 +1,222 @@
+"""
+Several IR sensors (e.g. on separate I2C buses or behind a multiplexer) covering one room - each sensor has its own
+IrFrameCollector (reading thread, recording, per-sensor results), inference is batched across the sensors,
+and the people count is summed over all of them.
+"""
+
+import collections
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Union
+
+from background_model import BackgroundModel
+from change_gate import TemporalChangeGate
+from frame_publication import IrFrame
+from frame_queue import QUEUE_POLICY_SPILL
+from inference_worker import InferenceResult, InferenceWorker
+from ir_frame_collector import IrFrameCollector
+from ir_frame_recorder import DEFAULT_QUEUE_CAPACITY
+from ir_frame_recording import SAMPLE_FORMAT_INT16_CENTI_DEGREES
+from occupancy_history import OccupancyHistory
+from trained_model.frame_processor import FrameProcessor
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class MosaicFrame:
+    """ Latest frames of all sensors (None for a sensor without frames yet) """
+    frames: List[Union[IrFrame, None]]
+    sequence_number: int  # sum of the sequence numbers of the sensor frames - grows with a new frame of any sensor
+
+
+class IrSensorGroup:
+    """
+    Named sensor collectors (IrFrameCollector, or anything with its interface) served and recorded together.
+
+    The summed people count is updated once all sensors reported a result since the previous update (or when
+    a sensor reports again before the others), so a batched inference tick gives one update.
+    With a single sensor, the sum is the result of the sensor.
+    """
+
+    def __init__(self, collectors: Dict[str, IrFrameCollector], inference_worker: InferenceWorker = None):
+        """ :param inference_worker: shared by the collectors, started by `start` """
+        self._collectors = collections.OrderedDict(collectors)
+        self._inference_worker = inference_worker
+        self._lock = threading.Lock()
+        self._latest_results = {}  # sensor_name: InferenceResult
+        self._reported_sensor_names = set()
+        self._number_of_people_count_updates = 0
+        self._people_count_listeners = []  # type: List[Callable[[float, float, int], None]]
+
+        if len(self._collectors) == 1:
+            self._occupancy_history = self.get_collectors()[0].get_occupancy_history()
+        else:
+            self._occupancy_history = OccupancyHistory()
+            self.add_people_count_listener(
+                lambda timestamp, people_count, _: self._occupancy_history.add(timestamp, people_count))
+        for sensor_name, collector in self._collectors.items():
+            collector.add_inference_result_listener(
+                lambda result, sensor_name=sensor_name: self._on_inference_result(sensor_name, result))
+
+    def start(self):
+        for collector in self._collectors.values():
+            collector.start()
+        if self._inference_worker is not None:
+            self._inference_worker.start()
+
+    def get_sensor_names(self) -> List[str]:
+        return list(self._collectors.keys())
+
+    def get_collector(self, sensor_name: str) -> IrFrameCollector:
+        """ Raises KeyError for an unknown sensor """
+        return self._collectors[sensor_name]
+
+    def get_collectors(self) -> List[IrFrameCollector]:
+        return list(self._collectors.values())
+
+    def add_people_count_listener(self, listener: Callable[[float, float, int], None]):
+        """
+        :param listener: (timestamp, summed people count, sequence number) -> None, called from the inference thread
+                         (e.g. OccupancyLog.add). The sequence number is the frame sequence number with one sensor,
+                         the number of the update otherwise
+        """
+        self._people_count_listeners.append(listener)
+
+    def add_frame_listener(self, listener: Callable[[str, IrFrame], None]):
+        """ :param listener: (sensor name, frame) -> None, called from the reading thread of the sensor """
+        for sensor_name, collector in self._collectors.items():
+            collector.add_frame_listener(lambda frame, sensor_name=sensor_name: listener(sensor_name, frame))
+
+    def get_people_count(self) -> Union[float, None]:
+        """ People count summed over all sensors, None until all sensors have a result """
+        with self._lock:
+            if len(self._latest_results) < len(self._collectors):
+                return None
+            return sum(result.people_count for result in self._latest_results.values())
+
+    def get_occupancy_history(self) -> OccupancyHistory:
+        """ History of the summed people count """
+        return self._occupancy_history
+
+    def wait_for_newer_frames(self, sequence_number: int, timeout=None) -> Union[MosaicFrame, None]:
+        """
+        Block until any sensor has a new frame (MosaicFrame.sequence_number greater than `sequence_number`).
+        None on timeout. The frame slots of the collectors have to share the condition of the inference worker
+        """
+        collectors = self.get_collectors()
+
+        def get_latest_frames():
+            return [collector.get_latest_frame() for collector in collectors]
+
+        def get_sequence_number(frames):
+            return sum(frame.sequence_number for frame in frames if frame is not None)
+
+        condition = self._inference_worker.new_frame_condition
+        with condition:
+            if not condition.wait_for(lambda: get_sequence_number(get_latest_frames()) > sequence_number,
+                                      timeout=timeout):
+                return None
+            frames = get_latest_frames()
+        return MosaicFrame(frames=frames, sequence_number=get_sequence_number(frames))
+
+    def set_doubled_freq_hz(self, doubled_freq_hz: int):
+        """ Refresh rate of all cameras, see IrFrameCollector.set_doubled_freq_hz """
+        for collector in self._collectors.values():
+            collector.set_doubled_freq_hz(doubled_freq_hz)
+
+    def set_video_zoom(self, video_zoom: int):
+        for collector in self._collectors.values():
+            collector.set_video_zoom(video_zoom)
+
+    def start_recording_frames(self, video_file_path, frames_file_path_prefix):
+        """ With more than one sensor, each sensor is recorded to its own subdirectory (named after the sensor) """
+        for collector, sensor_video_file_path, sensor_frames_file_path_prefix in self._get_recording_paths(
+                video_file_path, frames_file_path_prefix):
+            collector.start_recording_frames(
+                video_file_path=sensor_video_file_path, frames_file_path_prefix=sensor_frames_file_path_prefix)
+
+    def rotate_recording_frames(self, video_file_path, frames_file_path_prefix):
+        for collector, sensor_video_file_path, sensor_frames_file_path_prefix in self._get_recording_paths(
+                video_file_path, frames_file_path_prefix):
+            collector.rotate_recording_frames(
+                video_file_path=sensor_video_file_path, frames_file_path_prefix=sensor_frames_file_path_prefix)
+
+    def stop_recording_frames(self):
+        for collector in self._collectors.values():
+            collector.stop_recording_frames()
+
+    def _get_recording_paths(self, video_file_path, frames_file_path_prefix) -> list:
+        """ :return: (collector, video file path, frames file path prefix) of the sensors, creates the directories """
+        if len(self._collectors) == 1:
+            return [(self.get_collectors()[0], video_file_path, frames_file_path_prefix)]
+
+        recording_paths = []
+        for sensor_name, collector in self._collectors.items():
+            sensor_dir_path = os.path.join(os.path.dirname(frames_file_path_prefix), sensor_name)
+            os.makedirs(sensor_dir_path, exist_ok=True)
+            recording_paths.append((collector, os.path.join(sensor_dir_path, os.path.basename(video_file_path)),
+                                    os.path.join(sensor_dir_path, os.path.basename(frames_file_path_prefix))))
+        return recording_paths
+
+    def _on_inference_result(self, sensor_name: str, result: InferenceResult):
+        updates = []
+        with self._lock:
+            if sensor_name in self._reported_sensor_names:  # the other sensors did not report since the last update
+                updates.append(self._create_people_count_update())
+            self._latest_results[sensor_name] = result
+            self._reported_sensor_names.add(sensor_name)
+            if len(self._reported_sensor_names) == len(self._collectors):
+                updates.append(self._create_people_count_update())
+        for timestamp, people_count, sequence_number in updates:
+            if people_count is None:
+                continue
+            for listener in self._people_count_listeners:
+                try:
+                    listener(timestamp, people_count, sequence_number)
+                except:
+                    logger.exception("People count listener error!")
+
+    def _create_people_count_update(self) -> tuple:
+        self._reported_sensor_names.clear()
+        self._number_of_people_count_updates += 1
+        if len(self._latest_results) < len(self._collectors):
+            return None, None, self._number_of_people_count_updates
+        results = list(self._latest_results.values())
+        sequence_number = results[0].frame_sequence_number if len(results) == 1 \
+            else self._number_of_people_count_updates
+        return (max(result.frame_timestamp for result in results),
+                sum(result.people_count for result in results),
+                sequence_number)
+
+
+def create_ir_sensor_group(ir_cameras: Dict[str, object], video_zoom: int, save_video: bool,
+                           frame_processor: FrameProcessor,
+                           recording_sample_format=SAMPLE_FORMAT_INT16_CENTI_DEGREES,
+                           recording_queue_capacity=DEFAULT_QUEUE_CAPACITY,
+                           recording_queue_policy=QUEUE_POLICY_SPILL,
+                           recording_pre_roll_duration=0.0,
+                           create_background_model: Callable[[], BackgroundModel] = None,
+                           create_change_gate: Callable[[], TemporalChangeGate] = None) -> IrSensorGroup:
+    """
+    Collectors of the cameras ({sensor name: camera}), sharing the frame processor and the inference worker
+    :param create_background_model: () -> BackgroundModel of a sensor, None - the model runs on every frame
+    :param create_change_gate: () -> TemporalChangeGate of a sensor, None - no output is reused
+    """
+    inference_worker = InferenceWorker()
+    collectors = collections.OrderedDict(
+        (sensor_name, IrFrameCollector(ir_camera=ir_camera, video_zoom=video_zoom, save_video=save_video,
+                                       recording_sample_format=recording_sample_format,
+                                       frame_processor=frame_processor, name=sensor_name,
+                                       inference_worker=inference_worker,
+                                       recording_queue_capacity=recording_queue_capacity,
+                                       recording_queue_policy=recording_queue_policy,
+                                       recording_pre_roll_duration=recording_pre_roll_duration,
+                                       background_model=create_background_model()
+                                       if create_background_model is not None else None,
+                                       change_gate=create_change_gate() if create_change_gate is not None else None))
+        for sensor_name, ir_camera in ir_cameras.items())
+    return IrSensorGroup(collectors, inference_worker=inference_worker)
@@ -1,4 +1,7 @@
+import argparse
+import collections
 import datetime
+import functools
 import logging
 import os
 import threading
@@ -7,10 +10,19 @@ import time
 # from matplotlib import pyplot as plt
 
 import server
-from data_collector import DataCollector
-from devices.ir_camera import IrCamera
-from devices.rgb_camera import RgbCamera
-from ir_frame_collector import IrFrameCollector
+from activity_monitor import ActivityMonitor
+from background_model import BackgroundModel
+from change_gate import TemporalChangeGate
+from batch_archive import BatchArchiver
+from data_collector import DATA_DIR_PATH, DataCollector
+from frame_queue import QUEUE_POLICIES
+from ir_frame_collector import DEFAULT_SENSOR_NAME
+from ir_sensor_group import create_ir_sensor_group
+from multiprocess_pipeline import PipelineConfig, PipelineSupervisor
+from occupancy_log import EXIT_FLUSH_TIMEOUT, OccupancyLog
+from rate_controller import AdaptiveRateController, RateSetting
+from trained_model import model_precision
+from trained_model.frame_processor import FrameProcessor
 import signal
 import sys
 
@@ -18,6 +30,58 @@ import sys
 logger = logging.getLogger(__name__)
 
 data_collector = None  # type: DataCollector
+occupancy_log = None  # type: OccupancyLog
+pipeline_supervisor = None  # type: PipelineSupervisor
+
+# modes other than float64 have to be approved first with evaluation/calibrate_precision.py
+INFERENCE_PRECISION = model_precision.PRECISION_FLOAT64
+# frames of the empty room skip the model (or --skip_empty_frames), see background_model.py. The skip ratio and
+# the accuracy impact of the settings are measured with evaluation/evaluate_background_gate.py
+SKIP_EMPTY_FRAMES = False
+BACKGROUND_MARGIN = 1.0  # [deg C] over the background mean (plus BACKGROUND_STD_FACTOR standard deviations)
+BACKGROUND_STD_FACTOR = 3.0
+BACKGROUND_ADAPTATION_RATE = 0.01  # per frame
+BACKGROUND_MAX_SKIPPED_FRAMES = 8  # in a row, then the model runs to confirm
+# output of the previous frame reused for nearly identical frames (or --reuse_unchanged_frames), see change_gate.py.
+# The hit ratio and the accuracy impact of the settings are measured with evaluation/evaluate_change_gate.py
+REUSE_UNCHANGED_FRAMES = False
+CHANGE_GATE_THRESHOLD = 0.5  # [deg C] difference from the frame which produced the output
+CHANGE_GATE_METRIC = 'max_abs'  # or 'l1' (mean absolute difference)
+CHANGE_GATE_MAX_REUSED_FRAMES = 8  # in a row, then the model runs (forced refresh)
+OCCUPANCY_LOG_PATH = '../data/occupancy.sqlite'
+IR_CAMERA_DOUBLED_FREQ_HZ = 4
+IR_SENSORS = {DEFAULT_SENSOR_NAME: (None, None)}  # sensor name: (I2C bus number, multiplexer channel), see IrCamera
+RGB_CAMERA_FPS = 4
+RGB_CAMERA_RESOLUTION = (1920//8, 1080//8)
+VIDEO_ZOOM = 8
+SAVE_IR_VIDEO = True  # False (or --raw_only) - record only the raw IR frames, render ir.avi offline
+STREAM_MAX_FPS = 2.5
+RGB_PREVIEW_FPS = 10
+SINGLE_BATCH_RECORDING_DURATION = 4 * 60
+RECORDING_QUEUE_CAPACITY = 256  # frames waiting for the recording, see frame_queue.py for the policies when it is full
+RECORDING_QUEUE_POLICY = 'spill'
+# completed batches are compressed in the background, the oldest are deleted above the quota, see batch_archive.py
+ARCHIVE_BATCHES = True
+ARCHIVE_MAX_TOTAL_SIZE = 16 * 1024 ** 3  # [bytes] of all recorded batches
+ARCHIVE_MIN_FREE_SPACE = 1024 ** 3  # [bytes] on the data disk
+ARCHIVE_MAX_AGE = None  # [s], None - batches are deleted only because of the quota
+# activity-triggered recording (or --activity_triggered) - batches only while there is activity, see activity_monitor.py
+ACTIVITY_TRIGGERED_RECORDING = False
+ACTIVITY_PIXEL_THRESHOLD = 1.0  # [deg C] difference from the running background of a changed pixel
+ACTIVITY_MIN_CHANGED_FRACTION = 0.01  # of the pixels of a frame
+ACTIVITY_MIN_PEOPLE_COUNT = 0.5
+ACTIVITY_PRE_ROLL_DURATION = 10  # [s] recorded before the activity was detected
+ACTIVITY_POST_ROLL_DURATION = 30  # [s] recorded after the last activity
+
+# adaptive rate control (threaded mode) - allowed values of the settings, from the cheapest one, see rate_controller.py
+IR_CAMERA_DOUBLED_FREQ_HZ_STEPS = [1, 2, 4]  # not above the rate of the recorded training data
+VIDEO_ZOOM_STEPS = [4, 6, 8]  # zoom of the recorded video changes with the next batch
+STREAM_MAX_FPS_STEPS = [0.5, 1.0, 2.5]
+RGB_PREVIEW_FPS_STEPS = [2.5, 5, 10]
+RATE_CONTROL_CHECK_INTERVAL = 5.0
+RATE_CONTROL_MAX_RECORDING_QUEUE_DEPTH = 8
+RATE_CONTROL_MAX_INFERENCE_LATENCY = 1.0  # [s]
+RATE_CONTROL_MAX_CPU_LOAD = 0.9
 
 
 def setup_logger():
@@ -38,44 +102,257 @@ def sig_int_handler(sig, frame):
             data_collector.finish_batch_recording()
         except:
             logger.exception("Failed to finish batch recording!")
+        try:
+            if not occupancy_log.flush(timeout=EXIT_FLUSH_TIMEOUT):
+                logger.error(f"Occupancy log rows were not committed: {occupancy_log.get_stats()}")
+        except:
+            logger.exception("Failed to flush occupancy log!")
         os._exit(-1)  # kill the app anyway, we don't have graceful tasks stopping
 
 
 sig_int_handler.already_called = False
 
 
-def main():
+def sig_int_handler_multiprocess(sig, frame):
+    if sig_int_handler_multiprocess.already_called:
+        print('\nCtrl+c received again. Exiting application immediately!')
+        os._exit(-1)
+    else:
+        sig_int_handler_multiprocess.already_called = True
+        print('\nCtrl+c received. Please wait for graceful stop of all processes (or click ctrl+c again to kill)...')
+        pipeline_supervisor.request_stop()
+
+
+sig_int_handler_multiprocess.already_called = False
+
+
+def create_ir_camera(replay_path=None, replay_speed=1.0, i2c_bus_number=None, multiplexer_channel=None):
+    """ Camera drivers are imported only when used, as they can be imported only on the Raspberry Pi """
+    if replay_path is not None:
+        from devices.replay_ir_camera import ReplayIrCamera
+        return ReplayIrCamera(replay_path, speed=replay_speed)
+    from devices.ir_camera import IrCamera
+    return IrCamera(doubled_freq_hz=IR_CAMERA_DOUBLED_FREQ_HZ, i2c_bus_number=i2c_bus_number,
+                    multiplexer_channel=multiplexer_channel)
+
+
+def create_ir_cameras(sensors: dict, replay_path=None, replay_speed=1.0) -> dict:
+    """
+    :param sensors: {sensor name: (I2C bus number, multiplexer channel)}
+    :return: {sensor name: camera}. When replaying, a sensor replays `<replay_path>/<sensor name>` if it exists
+    """
+    ir_cameras = collections.OrderedDict()
+    for sensor_name, (i2c_bus_number, multiplexer_channel) in sensors.items():
+        sensor_replay_path = replay_path
+        if replay_path is not None and os.path.isdir(os.path.join(replay_path, sensor_name)):
+            sensor_replay_path = os.path.join(replay_path, sensor_name)
+        ir_cameras[sensor_name] = create_ir_camera(sensor_replay_path, replay_speed, i2c_bus_number=i2c_bus_number,
+                                                   multiplexer_channel=multiplexer_channel)
+    return ir_cameras
+
+
+def parse_sensor(value: str) -> tuple:
+    """ `NAME[:BUS[:CHANNEL]]` -> (name, (I2C bus number, multiplexer channel)) """
+    parts = value.split(':')
+    if len(parts) > 3 or not parts[0]:
+        raise argparse.ArgumentTypeError(f"Invalid sensor '{value}', expected NAME[:BUS[:CHANNEL]]")
+    try:
+        numbers = [int(part) if part else None for part in parts[1:]]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid sensor '{value}', BUS and CHANNEL have to be numbers")
+    numbers += [None] * (2 - len(numbers))
+    return parts[0], tuple(numbers)
+
+
+def create_rgb_camera(replay_path=None, replay_speed=1.0):
+    if replay_path is not None:
+        from devices.replay_rgb_camera import ReplayRgbCamera
+        return ReplayRgbCamera(replay_path, fps=RGB_CAMERA_FPS, resolution=RGB_CAMERA_RESOLUTION, speed=replay_speed)
+    from devices.rgb_camera import RgbCamera
+    return RgbCamera(fps=RGB_CAMERA_FPS, resolution=RGB_CAMERA_RESOLUTION)
+
+
+def create_rate_controller(ir_sensor_group) -> AdaptiveRateController:
+    """ Settings are stepped down in this order: stream rates first, the IR camera refresh rate last """
+    settings = [
+        RateSetting('stream_max_fps', STREAM_MAX_FPS_STEPS, STREAM_MAX_FPS, server.set_stream_max_fps),
+        RateSetting('rgb_preview_fps', RGB_PREVIEW_FPS_STEPS, RGB_PREVIEW_FPS, server.set_rgb_preview_fps),
+        RateSetting('video_zoom', VIDEO_ZOOM_STEPS, VIDEO_ZOOM, ir_sensor_group.set_video_zoom),
+        RateSetting('ir_camera_doubled_freq_hz', IR_CAMERA_DOUBLED_FREQ_HZ_STEPS, IR_CAMERA_DOUBLED_FREQ_HZ,
+                    ir_sensor_group.set_doubled_freq_hz),
+    ]
+    return AdaptiveRateController(ir_sensor_group, settings,
+                                  check_interval=RATE_CONTROL_CHECK_INTERVAL,
+                                  max_recording_queue_depth=RATE_CONTROL_MAX_RECORDING_QUEUE_DEPTH,
+                                  max_inference_latency=RATE_CONTROL_MAX_INFERENCE_LATENCY,
+                                  max_cpu_load=RATE_CONTROL_MAX_CPU_LOAD)
+
+
+def create_batch_archiver(data_collector: DataCollector) -> BatchArchiver:
+    return BatchArchiver(DATA_DIR_PATH, get_active_batch_dir_path=data_collector.get_batch_subdir_path,
+                         max_total_size=ARCHIVE_MAX_TOTAL_SIZE, min_free_space=ARCHIVE_MIN_FREE_SPACE,
+                         max_age=ARCHIVE_MAX_AGE)
+
+
+def create_background_model() -> BackgroundModel:
+    return BackgroundModel(margin=BACKGROUND_MARGIN, std_factor=BACKGROUND_STD_FACTOR,
+                           adaptation_rate=BACKGROUND_ADAPTATION_RATE, max_skipped_frames=BACKGROUND_MAX_SKIPPED_FRAMES)
+
+
+def create_change_gate() -> TemporalChangeGate:
+    return TemporalChangeGate(threshold=CHANGE_GATE_THRESHOLD, metric=CHANGE_GATE_METRIC,
+                              max_reused_frames=CHANGE_GATE_MAX_REUSED_FRAMES)
+
+
+def create_activity_monitor() -> ActivityMonitor:
+    return ActivityMonitor(pixel_threshold=ACTIVITY_PIXEL_THRESHOLD, min_changed_fraction=ACTIVITY_MIN_CHANGED_FRACTION,
+                           min_people_count=ACTIVITY_MIN_PEOPLE_COUNT, post_roll_duration=ACTIVITY_POST_ROLL_DURATION)
+
+
+def run_threaded(args):
+    """ All tasks as threads of a single process """
     global data_collector
+    global occupancy_log
 
-    setup_logger()
     signal.signal(signal.SIGINT, sig_int_handler)
 
-    ir_camera = IrCamera(doubled_freq_hz=4)
-    ir_frame_collector = IrFrameCollector(ir_camera=ir_camera, video_zoom=8, save_video=True)
-    rgb_camera = RgbCamera(fps=4, resolution=(1920//8, 1080//8))
-    ir_frame_collector.start()
+    ir_cameras = create_ir_cameras(args.sensors, args.replay, args.replay_speed)
+    frame_processor = FrameProcessor(optimized=True, precision=INFERENCE_PRECISION)
+    ir_sensor_group = create_ir_sensor_group(ir_cameras, video_zoom=VIDEO_ZOOM, save_video=not args.raw_only,
+                                             frame_processor=frame_processor,
+                                             recording_queue_capacity=RECORDING_QUEUE_CAPACITY,
+                                             recording_queue_policy=args.recording_queue_policy,
+                                             recording_pre_roll_duration=ACTIVITY_PRE_ROLL_DURATION
+                                             if args.activity_triggered else 0.0,
+                                             create_background_model=create_background_model
+                                             if args.skip_empty_frames else None,
+                                             create_change_gate=create_change_gate
+                                             if args.reuse_unchanged_frames else None)
+    activity_monitor = None
+    if args.activity_triggered:
+        activity_monitor = create_activity_monitor()
+        ir_sensor_group.add_frame_listener(activity_monitor.add_frame)
+        ir_sensor_group.add_people_count_listener(activity_monitor.add_people_count)
+    rgb_camera = create_rgb_camera(args.replay, args.replay_speed)
+    os.makedirs(os.path.dirname(OCCUPANCY_LOG_PATH), exist_ok=True)
+    occupancy_log = OccupancyLog(OCCUPANCY_LOG_PATH)
+    ir_sensor_group.add_people_count_listener(occupancy_log.add)
+    occupancy_log.start()
+    ir_sensor_group.start()
+    server.set_stream_max_fps(STREAM_MAX_FPS)
+    server.set_rgb_preview_fps(RGB_PREVIEW_FPS)
+    rate_controller = None
+    if not args.fixed_rates:
+        rate_controller = create_rate_controller(ir_sensor_group)
+        rate_controller.start()
 
     data_collector = DataCollector(
-        ir_frame_collector=ir_frame_collector,
-        rgb_camera=rgb_camera)
+        ir_frame_collector=ir_sensor_group,
+        rgb_camera=rgb_camera,
+        activity_monitor=activity_monitor)
+    if ARCHIVE_BATCHES:
+        create_batch_archiver(data_collector).start()
 
     def run_server():
-        server.run_server(ir_frame_collector=ir_frame_collector, rgb_camera=rgb_camera)
+        server.run_server(ir_sensors=ir_sensor_group, rgb_camera=rgb_camera, occupancy_log=occupancy_log,
+                          rate_controller=rate_controller, data_collector=data_collector)
 
     threading.Thread(target=run_server).start()
 
-    SINGLE_BATCH_RECORDING_DURATION = 4 * 60
-
     while True:
-        logger.info("Batch iteration started...")
         try:
-            data_collector.start_batch_recording()
-            time.sleep(SINGLE_BATCH_RECORDING_DURATION)
-            data_collector.finish_batch_recording()
+            time.sleep(data_collector.update_batch_recording(SINGLE_BATCH_RECORDING_DURATION))
         except:
             logger.exception("Error during batch recording!")
             time.sleep(1)
 
 
+def run_multiprocess(args):
+    """ Acquisition, recording, inference and serving in separate processes, see multiprocess_pipeline.py """
+    global pipeline_supervisor
+
+    signal.signal(signal.SIGINT, sig_int_handler_multiprocess)
+
+    (i2c_bus_number, multiplexer_channel), = args.sensors.values()
+    if args.replay is None:
+        from devices.ir_camera import IrCamera
+        # I2C has to be opened in the acquisition process
+        create_ir_camera_function = functools.partial(create_ir_camera, i2c_bus_number=i2c_bus_number,
+                                                      multiplexer_channel=multiplexer_channel)
+        ir_camera_resolution = IrCamera.RESOLUTION
+        ir_camera_fps = IrCamera.get_expected_fps(IR_CAMERA_DOUBLED_FREQ_HZ)
+    else:
+        replay_ir_camera = create_ir_camera(args.replay, args.replay_speed)  # load the recording once, before fork
+        create_ir_camera_function = lambda: replay_ir_camera  # noqa: E731
+        ir_camera_resolution = replay_ir_camera.RESOLUTION
+        ir_camera_fps = replay_ir_camera.get_fps()
+
+    os.makedirs(os.path.dirname(OCCUPANCY_LOG_PATH), exist_ok=True)
+    config = PipelineConfig(
+        create_ir_camera=create_ir_camera_function,
+        ir_camera_resolution=ir_camera_resolution,
+        ir_camera_fps=ir_camera_fps,
+        create_rgb_camera=functools.partial(create_rgb_camera, args.replay, args.replay_speed),
+        create_batch_archiver=create_batch_archiver if ARCHIVE_BATCHES else None,
+        create_activity_monitor=create_activity_monitor if args.activity_triggered else None,
+        create_background_model=create_background_model if args.skip_empty_frames else None,
+        create_change_gate=create_change_gate if args.reuse_unchanged_frames else None,
+        video_zoom=VIDEO_ZOOM,
+        save_video=not args.raw_only,
+        inference_precision=INFERENCE_PRECISION,
+        batch_recording_duration=SINGLE_BATCH_RECORDING_DURATION,
+        occupancy_log_path=OCCUPANCY_LOG_PATH,
+        recording_queue_capacity=RECORDING_QUEUE_CAPACITY,
+        recording_queue_policy=args.recording_queue_policy,
+        recording_pre_roll_duration=ACTIVITY_PRE_ROLL_DURATION if args.activity_triggered else 0.0)
+    pipeline_supervisor = PipelineSupervisor(config)
+    pipeline_supervisor.start()
+    pipeline_supervisor.supervise()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--multiprocess', action='store_true',
+                        help='run acquisition, recording, inference and serving in separate processes')
+    parser.add_argument('--replay', default=None,
+                        help='replay recorded data instead of using the cameras: batch directory, directory with '
+                             'batches, dataset HDF file or directory with HDF files')
+    parser.add_argument('--replay_speed', type=float, default=1.0,
+                        help='1 - real time, N - N times faster than real time, 0 - as fast as possible')
+    parser.add_argument('--sensors', type=parse_sensor, nargs='+', default=None, metavar='NAME[:BUS[:CHANNEL]]',
+                        help='IR sensors (default from IR_SENSORS): name, I2C bus number and TCA9548A multiplexer '
+                             'channel. When replaying, sensor NAME replays subdirectory NAME of the replay path '
+                             'if it exists')
+    parser.add_argument('--fixed_rates', action='store_true',
+                        help='disable the adaptive rate control (frame rates, video zoom and stream rates)')
+    parser.add_argument('--raw_only', action='store_true', default=not SAVE_IR_VIDEO,
+                        help='record only the raw IR frames, without the ir.avi preview video '
+                             '(render it offline with misc/render_batches.py)')
+    parser.add_argument('--activity_triggered', action='store_true', default=ACTIVITY_TRIGGERED_RECORDING,
+                        help='record batches only while there is activity in the room (frame changes or people '
+                             'counted), with ACTIVITY_PRE_ROLL_DURATION before and ACTIVITY_POST_ROLL_DURATION after')
+    parser.add_argument('--skip_empty_frames', action='store_true', default=SKIP_EMPTY_FRAMES,
+                        help='do not run the model on frames with nothing warmer than the empty-room background '
+                             '(0 people reported)')
+    parser.add_argument('--reuse_unchanged_frames', action='store_true', default=REUSE_UNCHANGED_FRAMES,
+                        help='do not run the model on frames differing from the frame which produced the previous '
+                             'output by at most CHANGE_GATE_THRESHOLD (its output is reused)')
+    parser.add_argument('--recording_queue_policy', choices=QUEUE_POLICIES, default=RECORDING_QUEUE_POLICY,
+                        help='when the recording can not keep up: block the frame reading, drop the oldest or the '
+                             'newest queued frame, or spill the frames to a temporary file on disk')
+    args = parser.parse_args()
+    if args.sensors is not None and len({sensor_name for sensor_name, _ in args.sensors}) != len(args.sensors):
+        parser.error("sensor names have to be unique")
+    args.sensors = collections.OrderedDict(args.sensors) if args.sensors is not None else IR_SENSORS
+    if args.multiprocess and len(args.sensors) > 1:
+        parser.error("only a single sensor is supported with --multiprocess")
+
+    setup_logger()
+    if args.multiprocess:
+        run_multiprocess(args)
+    else:
+        run_threaded(args)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,597 @@
+"""
+Multi-process mode of the application - acquisition, recording, inference and serving run in separate processes,
+so they do not compete for the GIL (and a slow HTTP client cannot delay the I2C reading).
+
+IR frames are passed through a SharedRecordRing written by the acquisition process, inference results through
+a second ring written by the inference process (and RGB preview frames through a third one).
+PipelineSupervisor starts the processes, restarts the ones which died and stops all of them.
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Callable, List, Union
+
+import numpy as np
+
+from activity_monitor import ActivityMonitor
+from frame_publication import FrameTimestamps, IrFrame
+from frame_queue import QUEUE_POLICY_SPILL
+from inference_worker import InferenceResult, gate_frames
+from ir_frame_collector import DEFAULT_SENSOR_NAME
+from ir_frame_recorder import DEFAULT_QUEUE_CAPACITY, IrFrameRecorder
+from occupancy_history import OccupancyHistory
+from pipeline_metrics import OUTPUT_INFERENCE, STAGE_INFERENCE, PipelineMetrics
+from shared_ring import SharedRecordRing
+from thermal_renderer import ThermalRenderer
+from trained_model import model_precision
+from trained_model.frame_processor import DEFAULT_MODEL_PATH, FrameProcessor
+
+
+logger = logging.getLogger(__name__)
+
+
+FRAME_RING_CAPACITY = 128  # the recording process has to keep up within this number of frames
+RESULT_RING_CAPACITY = 16
+RGB_FRAME_RING_CAPACITY = 4
+RGB_FRAME_MAX_SIZE = 512 * 1024
+RGB_PREVIEW_INTERVAL = 0.1
+NEW_RECORD_WAIT_TIMEOUT = 1
+RESTART_DELAY = 1
+
+
+def get_frame_record_dtype(resolution) -> np.dtype:
+    return np.dtype([
+        ('sequence_number', '<i8'),
+        ('timestamp', '<f8'),
+        ('read_start', '<f8'),  # time.monotonic() - the same clock in all processes
+        ('read_end', '<f8'),
+        ('data', '<f4', (resolution[0] * resolution[1],)),  # as the frame buffers of the threaded pipeline
+    ])
+
+
+def get_inference_result_record_dtype(resolution) -> np.dtype:
+    return np.dtype([
+        ('sequence_number', '<i8'),
+        ('frame_sequence_number', '<i8'),
+        ('frame_timestamp', '<f8'),
+        ('people_count', '<f8'),
+        ('inference_duration', '<f8'),
+        ('latency', '<f8'),
+        ('frame_read_end', '<f8'),  # time.monotonic()
+        ('inference_end', '<f8'),
+        ('reused_frames', '<i8'),  # so far, by the change gate of the inference process
+        ('forced_refreshes', '<i8'),
+        ('density_map', '<f8', tuple(resolution)),
+    ])
+
+
+RGB_FRAME_RECORD_DTYPE = np.dtype([
+    ('sequence_number', '<i8'),
+    ('size', '<i8'),
+    ('data', 'u1', (RGB_FRAME_MAX_SIZE,)),
+])
+
+
+@dataclass
+class PipelineConfig:
+    create_ir_camera: Callable  # called in the acquisition process
+    ir_camera_resolution: tuple
+    ir_camera_fps: float
+    create_rgb_camera: Union[Callable, None] = None  # called in the recording process
+    create_batch_archiver: Union[Callable, None] = None  # (DataCollector) -> BatchArchiver, in the recording process
+    # () -> ActivityMonitor, in the recording process. None - continuous recording
+    create_activity_monitor: Union[Callable, None] = None
+    # () -> BackgroundModel, in the inference process. None - the model runs on every frame
+    create_background_model: Union[Callable, None] = None
+    # () -> TemporalChangeGate, in the inference process. None - no output is reused
+    create_change_gate: Union[Callable, None] = None
+    video_zoom: int = 8
+    save_video: bool = True  # False - only the raw frames are recorded
+    model_path: str = DEFAULT_MODEL_PATH
+    inference_precision: str = model_precision.PRECISION_FLOAT64
+    batch_recording_duration: Union[float, None] = 4 * 60  # None - do not record
+    occupancy_log_path: Union[str, None] = None
+    recording_queue_capacity: int = DEFAULT_QUEUE_CAPACITY
+    recording_queue_policy: str = QUEUE_POLICY_SPILL  # see frame_queue.py
+    recording_pre_roll_duration: float = 0.0  # [s] recorded before the start of an activity-triggered recording
+    ring_name_prefix: str = 'ir_vision'
+    # ring name: multiprocessing.Condition waking up its readers, set by PipelineSupervisor (inherited by the processes)
+    ring_conditions: Union[dict, None] = None
+
+    def get_frame_ring_name(self) -> str:
+        return self.ring_name_prefix + '_frames'
+
+    def get_result_ring_name(self) -> str:
+        return self.ring_name_prefix + '_results'
+
+    def get_rgb_frame_ring_name(self) -> str:
+        return self.ring_name_prefix + '_rgb'
+
+    def get_ring_names(self) -> List[str]:
+        return [self.get_frame_ring_name(), self.get_result_ring_name(), self.get_rgb_frame_ring_name()]
+
+    def attach_ring(self, ring_name: str, record_dtype: np.dtype) -> SharedRecordRing:
+        """ Ring created by PipelineSupervisor, with its condition """
+        return SharedRecordRing(ring_name, record_dtype, condition=(self.ring_conditions or {}).get(ring_name))
+
+
+def _record_to_frame(record: np.void) -> IrFrame:
+    data = record['data']
+    data.flags.writeable = False
+    return IrFrame(data=data, timestamp=float(record['timestamp']), sequence_number=int(record['sequence_number']),
+                   timestamps=FrameTimestamps(read_start=float(record['read_start']),
+                                              read_end=float(record['read_end'])),
+                   monotonic_timestamp=float(record['read_end']))
+
+
+def _record_to_inference_result(record: np.void) -> InferenceResult:
+    return InferenceResult(
+        density_map=record['density_map'],
+        people_count=float(record['people_count']),
+        frame_sequence_number=int(record['frame_sequence_number']),
+        frame_timestamp=float(record['frame_timestamp']),
+        inference_duration=float(record['inference_duration']),
+        latency=float(record['latency']),
+    )
+
+
+class SharedMemoryIrFrameCollector:
+    """
+    IrFrameCollector counterpart for the serving process - frames and inference results are read from the rings
+    written by the other processes. Provides the part of IrFrameCollector interface used by the server.
+    Pipeline metrics cover the acquisition, inference and serving (not the recording, in its own process).
+    Only a single sensor (named DEFAULT_SENSOR_NAME) is supported in the multi-process mode.
+    """
+
+    def __init__(self, config: PipelineConfig):
+        self._config = config
+        self._frame_ring = config.attach_ring(
+            config.get_frame_ring_name(), get_frame_record_dtype(config.ir_camera_resolution))
+        self._result_ring = config.attach_ring(
+            config.get_result_ring_name(), get_inference_result_record_dtype(config.ir_camera_resolution))
+        self._result_thread = threading.Thread(target=self._run_following_results,
+                                               name=self.__class__.__name__ + '_results')
+        self._frame_thread = threading.Thread(target=self._run_following_frames,
+                                              name=self.__class__.__name__ + '_frames')
+        self._condition = threading.Condition()
+        self._latest_result = None  # type: Union[InferenceResult, None]
+        self._result_listeners = []  # type: List[Callable[[InferenceResult], None]]
+        self._occupancy_history = OccupancyHistory()
+        self._result_listeners.append(self._occupancy_history.add_inference_result)
+        self._number_of_results = 0
+        self._number_of_lost_results = 0
+        self._number_of_skipped_frames = 0
+        self._number_of_reused_frames = 0
+        self._number_of_forced_refreshes = 0
+        self._pipeline_metrics = PipelineMetrics(expected_fps=config.ir_camera_fps,
+                                                 labels={'sensor': DEFAULT_SENSOR_NAME})
+        self._pipeline_metrics.add_counter('inference_skipped_frames_total',
+                                           'Frames skipped by the inference process (busy with a previous frame)',
+                                           lambda: self._number_of_skipped_frames)
+        if config.create_change_gate is not None:
+            self._pipeline_metrics.add_counter('inference_reused_frames_total',
+                                               'Frames given the output of the previous nearly identical frame',
+                                               lambda: self._number_of_reused_frames)
+            self._pipeline_metrics.add_counter('inference_forced_refreshes_total',
+                                               'Frames processed by the model only because of the reuse limit',
+                                               lambda: self._number_of_forced_refreshes)
+
+    def start(self):
+        self._result_thread.start()
+        self._frame_thread.start()
+
+    def get_name(self) -> str:
+        return DEFAULT_SENSOR_NAME
+
+    def add_inference_result_listener(self, listener: Callable[[InferenceResult], None]):
+        """ Listener is called from the result following thread for every new result, it should return quickly """
+        self._result_listeners.append(listener)
+
+    def get_latest_frame(self) -> Union[IrFrame, None]:
+        record = self._frame_ring.read_latest()
+        return _record_to_frame(record) if record is not None else None
+
+    def wait_for_newer_frame(self, sequence_number: int, timeout=None) -> Union[IrFrame, None]:
+        record = self._frame_ring.wait_for_newer(sequence_number, timeout=timeout)
+        return _record_to_frame(record) if record is not None else None
+
+    def get_latest_inference_result(self) -> Union[InferenceResult, None]:
+        return self._latest_result
+
+    def get_inference_result(self, frame: IrFrame, timeout=NEW_RECORD_WAIT_TIMEOUT) -> Union[InferenceResult, None]:
+        """
+        Latest inference result, for the frame or a newer one (the inference process skips frames when busy).
+        Waits for it up to `timeout`, then returns the latest result available
+        """
+        def is_result_available():
+            return self._latest_result is not None \
+                and self._latest_result.frame_sequence_number >= frame.sequence_number
+
+        with self._condition:
+            self._condition.wait_for(is_result_available, timeout=timeout)
+            return self._latest_result
+
+    def get_occupancy_history(self) -> OccupancyHistory:
+        return self._occupancy_history
+
+    def get_pipeline_metrics(self) -> PipelineMetrics:
+        return self._pipeline_metrics
+
+    def get_inference_stats(self) -> dict:
+        return {
+            'results': self._number_of_results,
+            'lost_results': self._number_of_lost_results,
+            'skipped_frames': self._number_of_skipped_frames,
+            'reused_frames': self._number_of_reused_frames,
+            'forced_refreshes': self._number_of_forced_refreshes,
+            'reused_ratio': self._number_of_reused_frames / self._number_of_results if self._number_of_results else 0.0,
+        }
+
+    def create_renderer(self, rotation=None, flip_code=None) -> ThermalRenderer:
+        return ThermalRenderer(resolution=self._config.ir_camera_resolution, zoom=self._config.video_zoom,
+                               rotation=rotation, flip_code=flip_code)
+
+    def _run_following_results(self):
+        logger.info("_run_following_results started")
+        sequence_number = self._result_ring.get_latest_sequence_number()
+        while True:
+            try:
+                if self._result_ring.wait_for_newer(sequence_number, timeout=NEW_RECORD_WAIT_TIMEOUT) is None:
+                    continue
+                latest_sequence_number = self._result_ring.get_latest_sequence_number()
+                for next_sequence_number in range(sequence_number + 1, latest_sequence_number + 1):
+                    record = self._result_ring.read(next_sequence_number)
+                    if record is None:
+                        self._number_of_lost_results += 1
+                        continue
+                    result = _record_to_inference_result(record)
+                    self._record_inference_metrics(record, previous_result=self._latest_result)
+                    self._publish_result(result)
+                sequence_number = latest_sequence_number
+            except:
+                logger.exception("Inference results following iteration error!")
+                time.sleep(0.1)  # to not spam with log if it fails all the time
+
+    def _record_inference_metrics(self, record: np.void, previous_result: Union[InferenceResult, None]):
+        if previous_result is not None:
+            self._number_of_skipped_frames += \
+                max(0, int(record['frame_sequence_number']) - previous_result.frame_sequence_number - 1)
+        self._number_of_reused_frames = int(record['reused_frames'])
+        self._number_of_forced_refreshes = int(record['forced_refreshes'])
+        if record['inference_duration'] > 0:  # 0 - the model did not run on the frame
+            self._pipeline_metrics.record_stage(STAGE_INFERENCE, float(record['inference_duration']))
+        self._pipeline_metrics.record_output(
+            OUTPUT_INFERENCE, FrameTimestamps(read_end=float(record['frame_read_end'])), float(record['inference_end']))
+
+    def _run_following_frames(self):
+        """ Acquisition metrics of every frame """
+        logger.info("_run_following_frames started")
+        sequence_number = self._frame_ring.get_latest_sequence_number()
+        while True:
+            try:
+                if self._frame_ring.wait_for_newer(sequence_number, timeout=NEW_RECORD_WAIT_TIMEOUT) is None:
+                    continue
+                latest_sequence_number = self._frame_ring.get_latest_sequence_number()
+                for next_sequence_number in range(sequence_number + 1, latest_sequence_number + 1):
+                    record = self._frame_ring.read(next_sequence_number)
+                    if record is not None:
+                        self._pipeline_metrics.record_acquired_frame(FrameTimestamps(
+                            read_start=float(record['read_start']), read_end=float(record['read_end'])))
+                sequence_number = latest_sequence_number
+            except:
+                logger.exception("Frames following iteration error!")
+                time.sleep(0.1)  # to not spam with log if it fails all the time
+
+    def _publish_result(self, result: InferenceResult):
+        with self._condition:
+            self._latest_result = result
+            self._number_of_results += 1
+            self._condition.notify_all()
+        for listener in self._result_listeners:
+            try:
+                listener(result)
+            except:
+                logger.exception("Inference result listener error!")
+
+
+class SharedMemoryRgbCamera:
+    """ RgbCamera counterpart for the serving process, with the preview frames published by the recording process """
+
+    def __init__(self, config: PipelineConfig):
+        self._rgb_frame_ring = config.attach_ring(config.get_rgb_frame_ring_name(), RGB_FRAME_RECORD_DTYPE)
+        self._sequence_number = 0
+
+    def get_frame_as_jpeg_bin(self) -> bytes:
+        record = None
+        while record is None:
+            record = self._rgb_frame_ring.wait_for_newer(self._sequence_number, timeout=NEW_RECORD_WAIT_TIMEOUT)
+        self._sequence_number = int(record['sequence_number'])
+        return record['data'][:record['size']].tobytes()
+
+
+def run_acquisition_process(config: PipelineConfig, stop_event):
+    frame_record_dtype = get_frame_record_dtype(config.ir_camera_resolution)
+    frame_ring = config.attach_ring(config.get_frame_ring_name(), frame_record_dtype)
+    ir_camera = config.create_ir_camera()
+    # reused for every frame, the ring keeps a copy
+    frame_buffer = np.zeros(frame_record_dtype['data'].shape, dtype=frame_record_dtype['data'].base)
+    logger.info("Acquisition started")
+    while not stop_event.is_set():
+        try:
+            read_start = time.monotonic()
+            frame_data = ir_camera.get_frame(out=frame_buffer)
+            frame_ring.write(timestamp=time.time(), read_start=read_start, read_end=time.monotonic(), data=frame_data)
+        except:
+            logger.exception("Failed to acquire new IR frame!")
+            time.sleep(0.1)  # to not spam with log if it fails all the time
+
+
+def run_inference_process(config: PipelineConfig, stop_event):
+    frame_ring = config.attach_ring(config.get_frame_ring_name(), get_frame_record_dtype(config.ir_camera_resolution))
+    result_ring = config.attach_ring(
+        config.get_result_ring_name(), get_inference_result_record_dtype(config.ir_camera_resolution))
+    frame_processor = FrameProcessor(optimized=True, model_path=config.model_path,
+                                     precision=config.inference_precision)
+    background_model = config.create_background_model() if config.create_background_model is not None else None
+    change_gate = config.create_change_gate() if config.create_change_gate is not None else None
+    logger.info("Inference started")
+    sequence_number = 0
+    while not stop_event.is_set():
+        try:
+            record = frame_ring.wait_for_newer(sequence_number, timeout=NEW_RECORD_WAIT_TIMEOUT)
+            if record is None:
+                continue
+            sequence_number = int(record['sequence_number'])
+            start_time = time.monotonic()
+            density_maps, people_counts, is_skipped, is_reused = gate_frames(
+                record['data'][np.newaxis], [background_model], [change_gate], frame_processor)
+            end_time = time.monotonic()
+            is_model_run = not is_skipped[0] and not is_reused[0]
+            change_gate_stats = change_gate.get_stats() if change_gate is not None else {}
+            result_ring.write(
+                frame_sequence_number=sequence_number,
+                frame_timestamp=record['timestamp'],
+                people_count=people_counts[0],
+                inference_duration=end_time - start_time if is_model_run else 0.0,  # as in InferenceResult
+                latency=time.time() - record['timestamp'],
+                frame_read_end=record['read_end'],
+                inference_end=end_time,
+                reused_frames=change_gate_stats.get('reused_frames', 0),
+                forced_refreshes=change_gate_stats.get('forced_refreshes', 0),
+                density_map=density_maps[0],
+            )
+        except:
+            logger.exception("Inference iteration error!")
+            time.sleep(0.1)  # to not spam with log if it fails all the time
+
+
+def _run_following_frames(frame_ring: SharedRecordRing, frame_recorder: IrFrameRecorder,
+                          activity_monitor: ActivityMonitor = None):
+    """ Pass every frame from the ring to the recorder (and to the activity monitor) """
+    sequence_number = frame_ring.get_latest_sequence_number()
+    while True:
+        try:
+            if frame_ring.wait_for_newer(sequence_number, timeout=NEW_RECORD_WAIT_TIMEOUT) is None:
+                continue
+            latest_sequence_number = frame_ring.get_latest_sequence_number()
+            for next_sequence_number in range(sequence_number + 1, latest_sequence_number + 1):
+                record = frame_ring.read(next_sequence_number)
+                if record is None:
+                    logger.warning(f"Frame {next_sequence_number} was overwritten before it was recorded!")
+                    continue
+                frame = _record_to_frame(record)
+                frame_recorder.add_frame(frame)
+                if activity_monitor is not None:
+                    activity_monitor.add_frame(DEFAULT_SENSOR_NAME, frame)
+            sequence_number = latest_sequence_number
+        except:
+            logger.exception("Frames following iteration error!")
+            time.sleep(0.1)  # to not spam with log if it fails all the time
+
+
+def _run_following_results(result_ring: SharedRecordRing, activity_monitor: ActivityMonitor):
+    """ Pass the people counts to the activity monitor """
+    sequence_number = result_ring.get_latest_sequence_number()
+    while True:
+        try:
+            record = result_ring.wait_for_newer(sequence_number, timeout=NEW_RECORD_WAIT_TIMEOUT)
+            if record is None:
+                continue
+            sequence_number = int(record['sequence_number'])
+            activity_monitor.add_inference_result(_record_to_inference_result(record))
+        except:
+            logger.exception("Inference results following iteration error!")
+            time.sleep(0.1)  # to not spam with log if it fails all the time
+
+
+def _run_publishing_rgb_preview(rgb_frame_ring: SharedRecordRing, rgb_camera):
+    while True:
+        try:
+            frame_bin = rgb_camera.get_frame_as_jpeg_bin()
+            if len(frame_bin) > RGB_FRAME_MAX_SIZE:
+                raise Exception(f"RGB frame too big ({len(frame_bin)} bytes)!")
+            rgb_frame_ring.write(size=len(frame_bin), data=_pad_bytes(frame_bin))
+            time.sleep(RGB_PREVIEW_INTERVAL)
+        except:
+            logger.exception("RGB preview publishing iteration error!")
+            time.sleep(0.1)  # to not spam with log if it fails all the time
+
+
+def _pad_bytes(frame_bin: bytes) -> np.ndarray:
+    padded = np.zeros(RGB_FRAME_MAX_SIZE, dtype=np.uint8)
+    padded[:len(frame_bin)] = np.frombuffer(frame_bin, dtype=np.uint8)
+    return padded
+
+
+def run_recording_process(config: PipelineConfig, stop_event):
+    from data_collector import DataCollector  # imports the RGB camera driver
+
+    frame_ring = config.attach_ring(config.get_frame_ring_name(), get_frame_record_dtype(config.ir_camera_resolution))
+    rgb_frame_ring = config.attach_ring(config.get_rgb_frame_ring_name(), RGB_FRAME_RECORD_DTYPE)
+    rgb_camera = config.create_rgb_camera() if config.create_rgb_camera is not None else None
+    if rgb_camera is not None:
+        threading.Thread(target=_run_publishing_rgb_preview, args=(rgb_frame_ring, rgb_camera),
+                         name='rgb_preview', daemon=True).start()
+
+    if config.batch_recording_duration is None:
+        stop_event.wait()
+        return
+
+    frame_recorder = IrFrameRecorder(
+        resolution=config.ir_camera_resolution, fps=config.ir_camera_fps,
+        video_renderer=ThermalRenderer(resolution=config.ir_camera_resolution, zoom=config.video_zoom),
+        queue_capacity=config.recording_queue_capacity, queue_policy=config.recording_queue_policy,
+        save_video=config.save_video, pre_roll_duration=config.recording_pre_roll_duration)
+    frame_recorder.start()
+    activity_monitor = None
+    if config.create_activity_monitor is not None:
+        activity_monitor = config.create_activity_monitor()
+        result_ring = config.attach_ring(
+            config.get_result_ring_name(), get_inference_result_record_dtype(config.ir_camera_resolution))
+        threading.Thread(target=_run_following_results, args=(result_ring, activity_monitor),
+                         name='results_following', daemon=True).start()
+    threading.Thread(target=_run_following_frames, args=(frame_ring, frame_recorder, activity_monitor),
+                     name='frames_following', daemon=True).start()
+
+    data_collector = DataCollector(ir_frame_collector=frame_recorder, rgb_camera=rgb_camera,
+                                   activity_monitor=activity_monitor)
+    if config.create_batch_archiver is not None:
+        config.create_batch_archiver(data_collector).start()
+    logger.info("Recording started")
+    while not stop_event.is_set():
+        try:
+            stop_event.wait(data_collector.update_batch_recording(config.batch_recording_duration))
+        except:
+            logger.exception("Error during batch recording!")
+            time.sleep(1)
+    data_collector.finish_batch_recording()
+
+
+def run_serving_process(config: PipelineConfig, stop_event):
+    import server  # imports the RGB camera driver
+    from occupancy_log import EXIT_FLUSH_TIMEOUT, OccupancyLog
+
+    ir_frame_collector = SharedMemoryIrFrameCollector(config)
+    rgb_camera = SharedMemoryRgbCamera(config) if config.create_rgb_camera is not None else None
+    occupancy_log = None
+    if config.occupancy_log_path is not None:
+        occupancy_log = OccupancyLog(config.occupancy_log_path)
+        ir_frame_collector.add_inference_result_listener(occupancy_log.add_inference_result)
+        occupancy_log.start()
+    ir_frame_collector.start()
+
+    def stop_serving():
+        stop_event.wait()
+        if occupancy_log is not None and not occupancy_log.flush(timeout=EXIT_FLUSH_TIMEOUT):
+            logger.error(f"Occupancy log rows were not committed: {occupancy_log.get_stats()}")
+        os._exit(0)  # the flask server cannot be stopped
+
+    threading.Thread(target=stop_serving, name='stop_serving', daemon=True).start()
+    server.run_server(ir_sensors=ir_frame_collector, rgb_camera=rgb_camera, occupancy_log=occupancy_log)
+
+
+def _run_process(process_function, config: PipelineConfig, stop_event):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor stops the processes
+    try:
+        process_function(config, stop_event)
+    except:
+        logger.exception(f"Process {multiprocessing.current_process().name} failed!")
+        raise
+    logger.info(f"Process {multiprocessing.current_process().name} stopped")
+    os._exit(0)  # worker threads are not stoppable
+
+
+class PipelineSupervisor:
+    """
+    Starts the pipeline processes and restarts those which exit unexpectedly.
+    Processes are forked - the supervisor itself should not start any threads or load the model.
+    """
+
+    PROCESS_FUNCTIONS = {
+        'acquisition': run_acquisition_process,
+        'inference': run_inference_process,
+        'recording': run_recording_process,
+        'serving': run_serving_process,
+    }
+    STOP_TIMEOUTS = {  # [s] the recording process has to finish the batch
+        'acquisition': 5,
+        'inference': 5,
+        'recording': 30,
+        'serving': 10,
+    }
+
+    def __init__(self, config: PipelineConfig, process_names: List[str] = None):
+        self._process_names = process_names or list(self.PROCESS_FUNCTIONS.keys())
+        self._context = multiprocessing.get_context('fork')
+        self._config = replace(config, ring_conditions={
+            ring_name: self._context.Condition() for ring_name in config.get_ring_names()})
+        self._stop_event = self._context.Event()
+        self._stop_requested = False
+        self._processes = {}  # type: dict  # name: Process
+        self._number_of_restarts = 0
+        self._rings = [
+            self._create_ring(config.get_frame_ring_name(), get_frame_record_dtype(config.ir_camera_resolution),
+                              FRAME_RING_CAPACITY),
+            self._create_ring(config.get_result_ring_name(),
+                              get_inference_result_record_dtype(config.ir_camera_resolution), RESULT_RING_CAPACITY),
+            self._create_ring(config.get_rgb_frame_ring_name(), RGB_FRAME_RECORD_DTYPE, RGB_FRAME_RING_CAPACITY),
+        ]
+
+    def start(self):
+        for process_name in self._process_names:
+            self._start_process(process_name)
+
+    def supervise(self):
+        """ Restart the processes which died, until `request_stop` is called. Then stop all processes """
+        while not self._stop_requested:
+            time.sleep(RESTART_DELAY)
+            for process_name, process in list(self._processes.items()):
+                if not process.is_alive() and not self._stop_requested:
+                    logger.error(f"Process '{process_name}' exited with code {process.exitcode} - restarting it")
+                    self._number_of_restarts += 1
+                    self._start_process(process_name)
+        self.stop()
+
+    def request_stop(self):
+        """ Make `supervise` stop the processes. Can be called from a signal handler """
+        self._stop_requested = True
+
+    def stop(self):
+        """ Stop the processes and release the shared memory """
+        logger.info("Stopping pipeline processes...")
+        self._stop_event.set()
+        for process_name, process in self._processes.items():
+            process.join(self.STOP_TIMEOUTS[process_name])
+            if process.is_alive():
+                logger.warning(f"Process '{process_name}' did not stop - terminating it")
+                process.terminate()
+                process.join()
+        for ring in self._rings:
+            ring.close()
+            ring.unlink()
+
+    def get_number_of_restarts(self) -> int:
+        return self._number_of_restarts
+
+    @staticmethod
+    def _create_ring(name: str, record_dtype: np.dtype, capacity: int) -> SharedRecordRing:
+        try:
+            return SharedRecordRing(name, record_dtype, capacity=capacity, create=True)
+        except FileExistsError:
+            logger.warning(f"Shared memory '{name}' left by a previous run - recreating it")
+            stale_ring = SharedRecordRing(name, record_dtype)
+            stale_ring.close()
+            stale_ring.unlink()
+            return SharedRecordRing(name, record_dtype, capacity=capacity, create=True)
+
+    def _start_process(self, process_name: str):
+        process = self._context.Process(
+            target=_run_process, args=(self.PROCESS_FUNCTIONS[process_name], self._config, self._stop_event),
+            name=process_name)
+        process.start()
+        self._processes[process_name] = process
@@ -0,0 +1,117 @@
+"""
+In-memory history of the people count, at several time resolutions.
+"""
+
+import logging
+import threading
+
+import numpy as np
+
+from inference_worker import InferenceResult
+
+
+logger = logging.getLogger(__name__)
+
+
+RESOLUTION_RAW = 'raw'
+HISTORY_RECORD_DTYPE = np.dtype([('timestamp', '<f8'), ('min', '<f4'), ('mean', '<f4'), ('max', '<f4')])
+
+# resolution name: (interval [s], capacity). 0 interval - every inference result
+DEFAULT_RESOLUTIONS = {
+    RESOLUTION_RAW: (0, 4096),
+    '10s': (10, 8640),  # 24 hours
+    '1m': (60, 10080),  # 7 days
+    '15m': (15 * 60, 2880),  # 30 days
+}
+
+
+class _HistoryRing:
+    """ Fixed-size ring buffer of HISTORY_RECORD_DTYPE records, with the aggregation of the current interval """
+
+    def __init__(self, interval: float, capacity: int):
+        self.interval = interval
+        self._records = np.zeros(capacity, dtype=HISTORY_RECORD_DTYPE)
+        self._number_of_records = 0  # total, the ring keeps the last `capacity`
+        self._bucket_start = None
+        self._bucket_min = 0.0
+        self._bucket_max = 0.0
+        self._bucket_sum = 0.0
+        self._bucket_count = 0
+
+    def add(self, timestamp: float, people_count: float):
+        if self.interval == 0:
+            self._append(timestamp, people_count, people_count, people_count)
+            return
+
+        bucket_start = timestamp - timestamp % self.interval
+        if bucket_start != self._bucket_start:
+            self._close_bucket()
+            self._bucket_start = bucket_start
+            self._bucket_min = self._bucket_max = people_count
+            self._bucket_sum = 0.0
+            self._bucket_count = 0
+        self._bucket_min = min(self._bucket_min, people_count)
+        self._bucket_max = max(self._bucket_max, people_count)
+        self._bucket_sum += people_count
+        self._bucket_count += 1
+
+    def get_records(self, since: float = None) -> np.ndarray:
+        """ Copy of the records (with the current, not finished interval as the last one), oldest first """
+        capacity = self._records.shape[0]
+        start_index = self._number_of_records % capacity
+        if self._number_of_records < capacity:
+            records = self._records[:self._number_of_records].copy()
+        else:
+            records = np.concatenate((self._records[start_index:], self._records[:start_index]))
+
+        if self._bucket_count:
+            current_bucket = np.array([(self._bucket_start, self._bucket_min,
+                                        self._bucket_sum / self._bucket_count, self._bucket_max)],
+                                      dtype=HISTORY_RECORD_DTYPE)
+            records = np.concatenate((records, current_bucket))
+
+        if since is not None:
+            records = records[np.searchsorted(records['timestamp'], since, side='left'):]
+        return records
+
+    def _close_bucket(self):
+        if self._bucket_count:
+            self._append(self._bucket_start, self._bucket_min, self._bucket_sum / self._bucket_count, self._bucket_max)
+
+    def _append(self, timestamp, min_value, mean_value, max_value):
+        self._records[self._number_of_records % self._records.shape[0]] = (timestamp, min_value, mean_value, max_value)
+        self._number_of_records += 1
+
+
+class OccupancyHistory:
+    """
+    People count history, aggregated to min/mean/max at several resolutions (see DEFAULT_RESOLUTIONS).
+    Each new count is added in O(1), memory is fixed.
+    """
+
+    def __init__(self, resolutions: dict = None):
+        resolutions = resolutions or DEFAULT_RESOLUTIONS
+        self._rings = {name: _HistoryRing(interval, capacity) for name, (interval, capacity) in resolutions.items()}
+        self._lock = threading.Lock()
+
+    def get_resolutions(self) -> list:
+        return list(self._rings.keys())
+
+    def get_interval(self, resolution: str) -> float:
+        return self._rings[resolution].interval
+
+    def add(self, timestamp: float, people_count: float):
+        with self._lock:
+            for ring in self._rings.values():
+                ring.add(timestamp, people_count)
+
+    def add_inference_result(self, inference_result: InferenceResult):
+        """ To be registered as InferenceWorker result listener """
+        self.add(inference_result.frame_timestamp, inference_result.people_count)
+
+    def get_history(self, resolution: str, since: float = None) -> np.ndarray:
+        """ :return: HISTORY_RECORD_DTYPE array, oldest first. Timestamps of aggregated records are interval starts """
+        if resolution not in self._rings:
+            raise ValueError(f"Unknown history resolution '{resolution}' (available: {self.get_resolutions()})")
+        with self._lock:
+            return self._rings[resolution].get_records(since)
@@ -0,0 +1,163 @@
+"""
+Persistent log of the people count (SQLite database in WAL mode).
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from inference_worker import InferenceResult
+
+
+logger = logging.getLogger(__name__)
+
+
+_CREATE_TABLE_QUERY = '''
+    CREATE TABLE IF NOT EXISTS occupancy (
+        timestamp REAL NOT NULL,
+        people_count REAL NOT NULL,
+        frame_sequence_number INTEGER NOT NULL
+    )'''
+_CREATE_INDEX_QUERY = 'CREATE INDEX IF NOT EXISTS occupancy_timestamp ON occupancy (timestamp)'
+_INSERT_QUERY = 'INSERT INTO occupancy (timestamp, people_count, frame_sequence_number) VALUES (?, ?, ?)'
+_SELECT_RANGE_QUERY = 'SELECT timestamp, people_count FROM occupancy WHERE timestamp >= ? AND timestamp < ? ' \
+                      'ORDER BY timestamp'
+
+
+MIN_RETRY_DELAY = 1.0  # [s] after the first failed commit, doubled with every next one
+MAX_RETRY_DELAY = 60.0  # [s]
+EXIT_FLUSH_TIMEOUT = 10.0  # [s] to wait for the pending rows at the application exit
+
+
+class OccupancyLog:
+    """
+    People count of every inference result, stored in a SQLite database.
+
+    `add` only puts the row in a queue - rows are written by a background thread, in one transaction
+    per `commit_every_n_rows` rows or `commit_interval` seconds, whichever comes first.
+    Rows of a failed commit (database locked, disk full, I/O error) are kept and committed with the next rows,
+    retried with an increasing delay. While the commits fail, at most `max_pending_rows` rows are kept (the oldest
+    ones are dropped).
+    """
+
+    def __init__(self, database_path: str, commit_every_n_rows=256, commit_interval=5.0, max_pending_rows=100000):
+        """ :param max_pending_rows: 100000 rows are ~3.5 hours of results at 8 Hz """
+        self._database_path = database_path
+        self._commit_every_n_rows = commit_every_n_rows
+        self._commit_interval = commit_interval
+        self._max_pending_rows = max_pending_rows
+        self._rows_queue = queue.SimpleQueue()
+        self._writing_thread = threading.Thread(target=self._run_writing, name=self.__class__.__name__ + '_write')
+        self._condition = threading.Condition()  # for the row counters, notified when rows are committed or dropped
+        self._number_of_rows_added = 0
+        self._number_of_rows_written = 0
+        self._number_of_rows_dropped = 0
+        self._number_of_rows_dropped_at_flush = 0
+        self._number_of_commits = 0
+        self._number_of_failed_commits = 0
+
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(_CREATE_TABLE_QUERY)
+            connection.execute(_CREATE_INDEX_QUERY)
+
+    def start(self):
+        self._writing_thread.start()
+
+    def add(self, timestamp: float, people_count: float, frame_sequence_number: int = 0):
+        with self._condition:
+            self._number_of_rows_added += 1
+        self._rows_queue.put((timestamp, people_count, frame_sequence_number))
+
+    def add_inference_result(self, inference_result: InferenceResult):
+        """ To be registered as InferenceWorker result listener """
+        self.add(inference_result.frame_timestamp, inference_result.people_count,
+                 inference_result.frame_sequence_number)
+
+    def flush(self, timeout=None) -> bool:
+        """
+        Block until all rows added so far are committed (or dropped), at most `timeout` seconds
+        :return: True if all of them were committed - False on timeout or if rows were dropped since the previous flush
+        """
+        with self._condition:
+            number_of_rows_added = self._number_of_rows_added
+            is_finished = self._condition.wait_for(
+                lambda: self._number_of_rows_written + self._number_of_rows_dropped >= number_of_rows_added,
+                timeout=timeout)
+            is_any_row_dropped = self._number_of_rows_dropped > self._number_of_rows_dropped_at_flush
+            self._number_of_rows_dropped_at_flush = self._number_of_rows_dropped
+            return is_finished and not is_any_row_dropped
+
+    def query(self, start_time: float, end_time: float) -> list:
+        """ :return: list of (timestamp, people_count) with start_time <= timestamp < end_time, oldest first """
+        connection = self._connect()
+        try:
+            return connection.execute(_SELECT_RANGE_QUERY, (start_time, end_time)).fetchall()
+        finally:
+            connection.close()
+
+    def get_stats(self) -> dict:
+        with self._condition:
+            return {
+                'rows_written': self._number_of_rows_written,
+                'commits': self._number_of_commits,
+                # queued, or kept after a failed commit
+                'rows_pending':
+                    self._number_of_rows_added - self._number_of_rows_written - self._number_of_rows_dropped,
+                'failed_commits': self._number_of_failed_commits,
+                'rows_dropped': self._number_of_rows_dropped,
+            }
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._database_path, timeout=30)
+        connection.execute('PRAGMA synchronous=NORMAL')  # in WAL mode still safe against corruption
+        return connection
+
+    def _run_writing(self):
+        logger.info("_run_writing started")
+        connection = self._connect()
+        rows = []  # taken from the queue, not committed yet (kept after a failed commit)
+        retry_delay = 0.0  # [s] 0 after a successful commit
+        while True:
+            try:
+                if not rows:
+                    rows.append(self._rows_queue.get())
+                # after a failed commit, rows are collected until the retry
+                commit_deadline = time.monotonic() + (retry_delay or self._commit_interval)
+                while retry_delay or len(rows) < self._commit_every_n_rows:
+                    remaining_time = commit_deadline - time.monotonic()
+                    if remaining_time <= 0:
+                        break
+                    try:
+                        rows.append(self._rows_queue.get(timeout=remaining_time))
+                    except queue.Empty:
+                        break
+                if retry_delay and len(rows) > self._max_pending_rows:
+                    number_of_dropped_rows = len(rows) - self._max_pending_rows
+                    del rows[:number_of_dropped_rows]
+                    logger.error(f"Occupancy log: {number_of_dropped_rows} oldest rows dropped, "
+                                 f"{len(rows)} rows kept until the database is writable again")
+                    with self._condition:
+                        self._number_of_rows_dropped += number_of_dropped_rows
+                        self._condition.notify_all()
+
+                try:
+                    with connection:
+                        connection.executemany(_INSERT_QUERY, rows)
+                except sqlite3.Error:
+                    retry_delay = min(max(2 * retry_delay, MIN_RETRY_DELAY), MAX_RETRY_DELAY)
+                    with self._condition:
+                        self._number_of_failed_commits += 1
+                    logger.exception(f"Failed to commit {len(rows)} occupancy log rows, retrying in {retry_delay} s")
+                    continue
+                retry_delay = 0.0
+                with self._condition:
+                    self._number_of_rows_written += len(rows)
+                    self._number_of_commits += 1
+                    self._condition.notify_all()
+                rows = []
+            except:
+                logger.exception("Occupancy log writing iteration error!")
+                time.sleep(0.1)  # to not spam with log if it fails all the time
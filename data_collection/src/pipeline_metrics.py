@@ -0,0 +1,281 @@
+"""
+Latency and throughput metrics of the frame pipeline, exposed in the Prometheus text format (`/metrics`).
+
+Each frame carries FrameTimestamps of its pipeline stages (see frame_publication.py). The stages record their
+durations, and the consumers the frame age (time since the end of the I2C read) when the frame left
+the pipeline, into LatencyHistograms.
+"""
+
+import bisect
+import collections
+import itertools
+import logging
+import math
+import threading
+from typing import Callable, Dict, List, Union
+
+from frame_publication import FrameTimestamps
+
+
+logger = logging.getLogger(__name__)
+
+
+STAGE_I2C_READ = 'i2c_read'
+STAGE_QUEUE_WAIT = 'queue_wait'  # recording queue, from enqueue to dequeue
+STAGE_FRAMES_WRITE = 'frames_write'
+STAGE_VIDEO_WRITE = 'video_write'  # render and write
+STAGE_INFERENCE = 'inference'
+STAGE_HTTP_ENCODE = 'http_encode'  # render and encode
+STAGE_HTTP_SEND = 'http_send'
+STAGE_BATCH_OPEN = 'batch_open'  # per recording batch - opening the files of the next batch
+STAGE_BATCH_SWITCH = 'batch_switch'  # from the rotation request until the first frame written to the next batch
+STAGE_BATCH_CLOSE = 'batch_close'  # flushing and closing the previous batch (in the background)
+STAGES = [STAGE_I2C_READ, STAGE_QUEUE_WAIT, STAGE_FRAMES_WRITE, STAGE_VIDEO_WRITE, STAGE_INFERENCE,
+          STAGE_HTTP_ENCODE, STAGE_HTTP_SEND, STAGE_BATCH_OPEN, STAGE_BATCH_SWITCH, STAGE_BATCH_CLOSE]
+
+OUTPUT_ACQUIRED = 'acquired'
+OUTPUT_RECORDED = 'recorded'
+OUTPUT_INFERENCE = 'inference'
+OUTPUT_HTTP_SENT = 'http_sent'
+OUTPUTS = [OUTPUT_RECORDED, OUTPUT_INFERENCE, OUTPUT_HTTP_SENT]  # with the frame age
+
+NAMESPACE = 'ir_pipeline'
+QUANTILES = [0.5, 0.9, 0.99, 0.999]
+DROPPED_FRAME_INTERVAL_RATIO = 1.5  # frame interval above this times the expected one means dropped frames
+
+
+def _format_value(value) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return f'{value:.9g}'
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of durations, in the style of HDR Histogram: every power of 2 (from 1 us) is split into
+    SUB_BUCKETS linear buckets, so the relative error of the quantiles is below 1 / SUB_BUCKETS at any scale,
+    with a fixed size and constant recording time. Values since the start are kept.
+    """
+
+    LOWEST_VALUE = 1e-6  # [s]
+    SUB_BUCKETS = 16
+    NUMBER_OF_OCTAVES = 28  # up to ~268 s, longer values are counted in the overflow bucket
+
+    def __init__(self):
+        self._overflow_index = self.NUMBER_OF_OCTAVES * self.SUB_BUCKETS
+        self._counts = [0] * (self._overflow_index + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, value: float):
+        """ :param value: duration [s] """
+        mantissa, exponent = math.frexp(value / self.LOWEST_VALUE)  # value = mantissa * 2 ** exponent, 0.5 <= m < 1
+        if exponent <= 0:
+            index = 0  # below LOWEST_VALUE (or negative, with a clock adjustment)
+        else:
+            index = min((exponent - 1) * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS),
+                        self._overflow_index)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def get_count(self) -> int:
+        return self._count
+
+    def get_sum(self) -> float:
+        return self._sum
+
+    def get_max(self) -> float:
+        return self._max
+
+    def get_quantiles(self, quantiles) -> list:
+        """ Upper bounds of the buckets with the quantiles (at most the maximum value). NaN if empty """
+        with self._lock:
+            counts = list(self._counts)
+            count = self._count
+            max_value = self._max
+        if count == 0:
+            return [float('nan')] * len(quantiles)
+
+        cumulative_counts = list(itertools.accumulate(counts))
+        return [min(self._get_bucket_upper_bound(bisect.bisect_left(cumulative_counts, max(1, quantile * count))),
+                    max_value)
+                for quantile in quantiles]
+
+    def _get_bucket_upper_bound(self, index: int) -> float:
+        if index >= self._overflow_index:
+            return float('inf')
+        octave, sub_bucket = divmod(index, self.SUB_BUCKETS)
+        return self.LOWEST_VALUE * 2 ** octave * (1 + (sub_bucket + 1) / self.SUB_BUCKETS)
+
+
+class FrameRateMeter:
+    """ Frame rate over the last `window_size` frames """
+
+    def __init__(self, window_size=16):
+        self._frame_times = collections.deque(maxlen=window_size)
+
+    def tick(self, frame_time: float):
+        self._frame_times.append(frame_time)
+
+    def get_fps(self) -> float:
+        frame_times = list(self._frame_times)
+        if len(frame_times) < 2 or frame_times[-1] <= frame_times[0]:
+            return 0.0
+        return (len(frame_times) - 1) / (frame_times[-1] - frame_times[0])
+
+
+class MetricRegistry:
+    """
+    Counters and gauges of components, read when the metrics are exported (see `format_prometheus_text`).
+    `labels` (e.g. the sensor name) are added to all samples of the registry.
+    """
+
+    def __init__(self, labels: Dict[str, str] = None):
+        self.labels = dict(labels or {})
+        self._metric_functions = []  # (name, type, help, get_value_function, label_name)
+
+    def add_counter(self, name: str, help_text: str, get_value: Callable[[], Union[float, Dict[str, float]]],
+                    label_name: str = None):
+        """ `get_value` returns the value, or {label value: value} if `label_name` is given """
+        self._metric_functions.append((name, 'counter', help_text, get_value, label_name))
+
+    def add_gauge(self, name: str, help_text: str, get_value: Callable[[], Union[float, Dict[str, float]]],
+                  label_name: str = None):
+        self._metric_functions.append((name, 'gauge', help_text, get_value, label_name))
+
+    def collect(self) -> list:
+        """ :return: metric families - list of (name, type, help, samples), samples: (name suffix, labels, value) """
+        families = []
+        for name, metric_type, help_text, get_value, label_name in self._metric_functions:
+            try:
+                families.append(_create_family(name, metric_type, help_text, label_name, get_value()))
+            except:
+                logger.exception(f"Failed to get metric '{name}'!")
+        return families
+
+    def get_prometheus_text(self) -> str:
+        return format_prometheus_text([self])
+
+
+class PipelineMetrics(MetricRegistry):
+    """
+    Per-stage duration and per-output frame age histograms, frame rates and dropped frames of the acquisition
+    of one sensor. Counters and gauges of other components (queue depths, frames skipped by consumers) are added
+    with `add_counter` / `add_gauge`.
+    """
+
+    def __init__(self, expected_fps: float, labels: Dict[str, str] = None):
+        super().__init__(labels=labels)
+        self._expected_fps = expected_fps
+        self._stage_durations = {stage: LatencyHistogram() for stage in STAGES}
+        self._frame_ages = {output: LatencyHistogram() for output in OUTPUTS}
+        self._frame_rate_meters = {output: FrameRateMeter() for output in [OUTPUT_ACQUIRED] + OUTPUTS}
+        self._number_of_acquired_frames = 0
+        self._number_of_dropped_frames = 0
+        self._previous_read_end = None
+
+    def set_expected_fps(self, expected_fps: float):
+        """ After a change of the acquisition frame rate """
+        self._expected_fps = expected_fps
+
+    def record_acquired_frame(self, timestamps: FrameTimestamps):
+        """ Called by the acquisition for every frame, after the I2C read """
+        self._stage_durations[STAGE_I2C_READ].record(timestamps.read_end - timestamps.read_start)
+        self._frame_rate_meters[OUTPUT_ACQUIRED].tick(timestamps.read_end)
+        self._number_of_acquired_frames += 1
+        if self._previous_read_end is not None:
+            interval_ratio = (timestamps.read_end - self._previous_read_end) * self._expected_fps
+            if interval_ratio > DROPPED_FRAME_INTERVAL_RATIO:
+                self._number_of_dropped_frames += round(interval_ratio) - 1
+        self._previous_read_end = timestamps.read_end
+
+    def record_stage(self, stage: str, duration: float):
+        self._stage_durations[stage].record(duration)
+
+    def record_output(self, output: str, timestamps: FrameTimestamps, end_time: float):
+        """ The frame left the pipeline through `output` at `end_time` (time.monotonic()) """
+        self._frame_ages[output].record(end_time - timestamps.read_end)
+        self._frame_rate_meters[output].tick(end_time)
+
+    def get_stage_histogram(self, stage: str) -> LatencyHistogram:
+        return self._stage_durations[stage]
+
+    def get_frame_age_histogram(self, output: str) -> LatencyHistogram:
+        return self._frame_ages[output]
+
+    def collect(self) -> list:
+        families = []
+        families += _create_summary_families('stage_duration_seconds', 'Duration of the frame pipeline stages',
+                                             'stage', self._stage_durations)
+        families += _create_summary_families('frame_age_seconds', 'Time from the end of the I2C read until '
+                                                                  'the frame left the pipeline',
+                                             'output', self._frame_ages)
+        families.append(_create_family(
+            'frame_rate', 'gauge', 'Frame rate over the last frames', 'output',
+            {output: meter.get_fps() for output, meter in self._frame_rate_meters.items()}))
+        frame_counts = {output: histogram.get_count() for output, histogram in self._frame_ages.items()}
+        frame_counts[OUTPUT_ACQUIRED] = self._number_of_acquired_frames
+        families.append(_create_family('frames_total', 'counter', 'Number of frames', 'output', frame_counts))
+        families.append(_create_family('acquisition_dropped_frames_total', 'counter',
+                                       'Frames missed by the acquisition (gaps in the frame timing)',
+                                       None, self._number_of_dropped_frames))
+        return families + super().collect()
+
+
+def _create_family(name, metric_type, help_text, label_name, value) -> tuple:
+    if label_name is None:
+        samples = [('', {}, value)]
+    else:
+        samples = [('', {label_name: label_value}, single_value) for label_value, single_value in value.items()]
+    return name, metric_type, help_text, samples
+
+
+def _create_summary_families(name, help_text, label_name, histograms: Dict[str, LatencyHistogram]) -> list:
+    samples = []
+    for label_value, histogram in histograms.items():
+        for quantile, value in zip(QUANTILES, histogram.get_quantiles(QUANTILES)):
+            samples.append(('', {label_name: label_value, 'quantile': str(quantile)}, value))
+        samples.append(('_sum', {label_name: label_value}, histogram.get_sum()))
+        samples.append(('_count', {label_name: label_value}, histogram.get_count()))
+    max_values = {label_value: histogram.get_max() for label_value, histogram in histograms.items()}
+    return [(name, 'summary', help_text, samples),
+            _create_family(name.replace('_seconds', '_max_seconds'), 'gauge', help_text + ' (maximum)',
+                           label_name, max_values)]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    label_texts = []
+    for label_name, label_value in labels.items():
+        label_value = str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        label_texts.append(f'{label_name}="{label_value}"')
+    return '{' + ','.join(label_texts) + '}'
+
+
+def format_prometheus_text(registries: List[MetricRegistry]) -> str:
+    """ Metrics of all registries in the Prometheus text format, samples of the same metric grouped together """
+    families = collections.OrderedDict()  # full name: (type, help, sample lines)
+    for registry in registries:
+        for name, metric_type, help_text, samples in registry.collect():
+            full_name = f'{NAMESPACE}_{name}'
+            _, _, lines = families.setdefault(full_name, (metric_type, help_text, []))
+            for suffix, labels, value in samples:
+                lines.append(f'{full_name}{suffix}{_format_labels({**registry.labels, **labels})} '
+                             f'{_format_value(value)}')
+
+    text_lines = []
+    for full_name, (metric_type, help_text, lines) in families.items():
+        text_lines.append(f'# HELP {full_name} {help_text}')
+        text_lines.append(f'# TYPE {full_name} {metric_type}')
+        text_lines += lines
+    return '\n'.join(text_lines) + '\n'
@@ -0,0 +1,227 @@
+"""
+Adaptive frame-rate control - trades the frame rates and the render size for CPU headroom at runtime,
+so the device keeps up instead of building a backlog in the recording queue.
+
+AdaptiveRateController periodically checks the recording queue depth, the inference latency and the CPU load.
+When any of them is over its limit, it steps one RateSetting down (the first one in the list which is not at its
+minimum yet), when all of them have headroom for a while, it steps one setting back up (in the reverse order).
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, List, Union
+
+from ir_sensor_group import IrSensorGroup
+from pipeline_metrics import MetricRegistry
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RateChange:
+    timestamp: float
+    setting_name: str
+    old_value: float
+    new_value: float
+    reason: str
+
+
+@dataclass(frozen=True)
+class RateSignals:
+    recording_queue_depth: int  # the maximum over the sensors
+    inference_latency: Union[float, None]  # [s] from acquisition to the result, the maximum over the sensors
+    cpu_load: Union[float, None]  # 0-1, busy fraction of all cores
+
+
+class RateSetting:
+    """ One controlled setting, with allowed values from the cheapest to the most expensive one """
+
+    def __init__(self, name: str, values: list, initial_value, apply_function: Callable):
+        """ :param apply_function: (value) -> None, called from the controller thread """
+        if initial_value not in values:
+            raise Exception(f"Initial value {initial_value} of '{name}' is not one of {values}!")
+        self.name = name
+        self.values = list(values)
+        self._index = self.values.index(initial_value)
+        self._apply_function = apply_function
+
+    def get_value(self):
+        return self.values[self._index]
+
+    def can_step(self, direction: int) -> bool:
+        return 0 <= self._index + direction < len(self.values)
+
+    def step(self, direction: int):
+        """ :param direction: -1 - cheaper, 1 - more expensive """
+        self._index += direction
+        self._apply_function(self.values[self._index])
+
+
+class CpuLoadMeter:
+    """ CPU load since the previous call - from /proc/stat, or of this process only where it is not available """
+
+    def __init__(self):
+        self._previous_times = self._read_times()
+
+    def get_load(self) -> Union[float, None]:
+        times = self._read_times()
+        busy_time = times[0] - self._previous_times[0]
+        total_time = times[1] - self._previous_times[1]
+        self._previous_times = times
+        return busy_time / total_time if total_time > 0 else None
+
+    @staticmethod
+    def _read_times() -> tuple:
+        """ :return: busy time and total time of all cores (in any unit) """
+        try:
+            with open('/proc/stat') as file:
+                values = [int(value) for value in file.readline().split()[1:9]]
+            idle_time = values[3] + values[4]  # idle and iowait
+            return sum(values) - idle_time, sum(values)
+        except (OSError, ValueError, IndexError):
+            return time.process_time(), time.monotonic() * (os.cpu_count() or 1)
+
+
+class AdaptiveRateController:
+    """
+    Steps the RateSettings of the threaded mode based on the load of the pipeline, see the module docstring.
+    Every change is logged, recent changes and the current values are available in `get_stats`.
+    """
+
+    MAX_NUMBER_OF_CHANGES_KEPT = 32
+
+    def __init__(self, ir_sensor_group: IrSensorGroup, settings: List[RateSetting], check_interval=5.0,
+                 max_recording_queue_depth=8, max_inference_latency=1.0, max_cpu_load=0.9,
+                 headroom_cpu_load=0.6, headroom_checks=6, cooldown_checks=2):
+        """
+        :param settings: in the order in which they are stepped down (the least important first)
+        :param headroom_cpu_load: settings are stepped up only below this load, a quarter of the queue depth limit
+                                  and a half of the latency limit...
+        :param headroom_checks: ...in this number of consecutive checks
+        :param cooldown_checks: number of checks without a change after each change (for the change to take effect)
+        """
+        self._ir_sensor_group = ir_sensor_group
+        self._settings = settings
+        self._check_interval = check_interval
+        self._max_recording_queue_depth = max_recording_queue_depth
+        self._max_inference_latency = max_inference_latency
+        self._max_cpu_load = max_cpu_load
+        self._headroom_cpu_load = headroom_cpu_load
+        self._headroom_checks = headroom_checks
+        self._cooldown_checks = cooldown_checks
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__)
+        self._cpu_load_meter = CpuLoadMeter()
+        self._latest_signals = None  # type: Union[RateSignals, None]
+        self._changes = collections.deque(maxlen=self.MAX_NUMBER_OF_CHANGES_KEPT)
+        self._number_of_changes = 0
+        self._number_of_headroom_checks = 0
+        self._remaining_cooldown_checks = 0
+        self._is_saturation_reported = False
+
+    def start(self):
+        self._thread.start()
+
+    def get_setting_values(self) -> dict:
+        return {setting.name: setting.get_value() for setting in self._settings}
+
+    def get_stats(self) -> dict:
+        return {
+            'settings': self.get_setting_values(),
+            'bounds': {setting.name: [setting.values[0], setting.values[-1]] for setting in self._settings},
+            'signals': asdict(self._latest_signals) if self._latest_signals is not None else None,
+            'limits': {
+                'recording_queue_depth': self._max_recording_queue_depth,
+                'inference_latency': self._max_inference_latency,
+                'cpu_load': self._max_cpu_load,
+            },
+            'number_of_changes': self._number_of_changes,
+            'recent_changes': [asdict(change) for change in self._changes],
+        }
+
+    def add_metrics(self, metric_registry: MetricRegistry):
+        metric_registry.add_gauge('rate_control_setting', 'Current values of the adaptive rate control settings',
+                                  self.get_setting_values, label_name='setting')
+        metric_registry.add_counter('rate_control_changes_total', 'Setting changes of the adaptive rate control',
+                                    lambda: self._number_of_changes)
+        metric_registry.add_gauge('cpu_load', 'CPU load (0-1) measured by the adaptive rate control',
+                                  lambda: self._latest_signals.cpu_load if self._latest_signals is not None
+                                  and self._latest_signals.cpu_load is not None else float('nan'))
+
+    def check(self):
+        """ One control step, called periodically by the controller thread """
+        signals = self._measure_signals()
+        self._latest_signals = signals
+        if self._remaining_cooldown_checks > 0:
+            self._remaining_cooldown_checks -= 1
+            return
+
+        overload_reasons = self._get_overload_reasons(signals)
+        if overload_reasons:
+            self._number_of_headroom_checks = 0
+            self._step(-1, ', '.join(overload_reasons))
+            return
+        self._is_saturation_reported = False
+        if self._has_headroom(signals):
+            self._number_of_headroom_checks += 1
+            if self._number_of_headroom_checks >= self._headroom_checks:
+                self._number_of_headroom_checks = 0
+                self._step(1, f'headroom for {self._headroom_checks} checks')
+        else:
+            self._number_of_headroom_checks = 0
+
+    def _measure_signals(self) -> RateSignals:
+        collectors = self._ir_sensor_group.get_collectors()
+        inference_latencies = [result.latency for result in
+                               (collector.get_latest_inference_result() for collector in collectors)
+                               if result is not None]
+        return RateSignals(
+            recording_queue_depth=max(collector.get_recording_queue_size() for collector in collectors),
+            inference_latency=max(inference_latencies) if inference_latencies else None,
+            cpu_load=self._cpu_load_meter.get_load())
+
+    def _get_overload_reasons(self, signals: RateSignals) -> List[str]:
+        reasons = []
+        if signals.recording_queue_depth > self._max_recording_queue_depth:
+            reasons.append(f'recording queue depth {signals.recording_queue_depth} > {self._max_recording_queue_depth}')
+        if signals.inference_latency is not None and signals.inference_latency > self._max_inference_latency:
+            reasons.append(f'inference latency {signals.inference_latency:.3f} s > {self._max_inference_latency} s')
+        if signals.cpu_load is not None and signals.cpu_load > self._max_cpu_load:
+            reasons.append(f'CPU load {signals.cpu_load:.2f} > {self._max_cpu_load}')
+        return reasons
+
+    def _has_headroom(self, signals: RateSignals) -> bool:
+        return (signals.recording_queue_depth <= self._max_recording_queue_depth / 4
+                and (signals.inference_latency is None or signals.inference_latency < self._max_inference_latency / 2)
+                and (signals.cpu_load is None or signals.cpu_load < self._headroom_cpu_load))
+
+    def _step(self, direction: int, reason: str):
+        settings = self._settings if direction < 0 else reversed(self._settings)
+        for setting in settings:
+            if not setting.can_step(direction):
+                continue
+            old_value = setting.get_value()
+            setting.step(direction)
+            change = RateChange(timestamp=time.time(), setting_name=setting.name, old_value=old_value,
+                                new_value=setting.get_value(), reason=reason)
+            self._changes.append(change)
+            self._number_of_changes += 1
+            self._remaining_cooldown_checks = self._cooldown_checks
+            logger.info(f"Rate control: {setting.name} {old_value} -> {change.new_value} ({reason})")
+            return
+        if direction < 0 and not self._is_saturation_reported:
+            self._is_saturation_reported = True
+            logger.warning(f"Rate control: all settings at their minimum, still overloaded ({reason})")
+
+    def _run(self):
+        logger.info(f"_run rate control started, settings: {self.get_setting_values()}")
+        while True:
+            time.sleep(self._check_interval)
+            try:
+                self.check()
+            except:
+                logger.exception("Rate control iteration error!")
@@ -1,14 +1,25 @@
+import functools
 import logging
 import time
-from io import BytesIO
+from typing import TYPE_CHECKING, Dict, List, Union
 
 import cv2
-import png
-from flask import Flask, Response, send_from_directory, redirect, request
+import numpy as np
+from flask import Flask, Response, send_from_directory, redirect, request, jsonify
 
-from trained_model.frame_processor import FrameProcessor
-from devices.rgb_camera import RgbCamera
-from ir_frame_collector import IrFrameCollector
+from data_collector import DataCollector
+from ir_frame_collector import DEFAULT_SENSOR_NAME, IrFrameCollector
+from ir_sensor_group import IrSensorGroup, MosaicFrame
+from occupancy_history import OccupancyHistory
+from occupancy_log import OccupancyLog
+from pipeline_metrics import (OUTPUT_HTTP_SENT, STAGE_HTTP_ENCODE, STAGE_HTTP_SEND, MetricRegistry,
+                              format_prometheus_text)
+from rate_controller import AdaptiveRateController
+from stream_encoders import DEFAULT_FORMAT, StreamFrameEncoder
+from stream_hub import StreamBroadcastHub, TooManySubscribersError
+
+if TYPE_CHECKING:
+    from devices.rgb_camera import RgbCamera  # the driver can be imported only on the Raspberry Pi
 
 
 logger = logging.getLogger(__name__)
@@ -27,74 +38,173 @@ def get_status():
     return "hello"
 
 
-_ir_frame_collector = None  # type: IrFrameCollector
+_ir_sensor_group = None  # type: IrSensorGroup
 _rgb_camera = None  # type: RgbCamera
-_frame_processor = FrameProcessor()
-
-
-def _get_ir_frame(ir_frame_collector: IrFrameCollector, min_temp, max_temp):
+_occupancy_log = None  # type: OccupancyLog
+_rate_controller = None  # type: AdaptiveRateController
+_data_collector = None  # type: DataCollector
+_stream_hub = StreamBroadcastHub()
+_rgb_preview_interval = 0.1
+_stream_collectors = {}  # type: Dict[str, List[IrFrameCollector]]  # stream_name: collectors of the streamed frames
+_server_metrics = MetricRegistry()
+
+
+def _create_stream_renderer(ir_frame_collector: IrFrameCollector):
+    return ir_frame_collector.create_renderer(rotation=cv2.ROTATE_90_CLOCKWISE, flip_code=0)
+
+
+def _get_stream_part(frame_encoder: StreamFrameEncoder, video_frame_bgr) -> bytes:
+    frame_bin = frame_encoder.encode(video_frame_bgr)
+    return (b'--frame\r\n'
+            b'Content-Type: ' + frame_encoder.content_type.encode() + b'\r\n\r\n' + frame_bin + b'\r\n')
+
+
+def _record_frame_encoded(ir_frame_collector: IrFrameCollector, frame, encode_start_time, encode_end_time):
+    ir_frame_collector.get_pipeline_metrics().record_stage(STAGE_HTTP_ENCODE, encode_end_time - encode_start_time)
+    if frame.timestamps is not None and not frame.timestamps.encode_start:
+        frame.timestamps.encode_start = encode_start_time
+        frame.timestamps.encode_end = encode_end_time
+
+
+def _record_frame_sent(stream_name, item, send_start_time, send_end_time):
+    collectors = _stream_collectors.get(stream_name)
+    if collectors is None:
+        return
+    frames = item.frames if isinstance(item, MosaicFrame) else [item]
+    for ir_frame_collector, frame in zip(collectors, frames):
+        if frame is None:
+            continue
+        pipeline_metrics = ir_frame_collector.get_pipeline_metrics()
+        pipeline_metrics.record_stage(STAGE_HTTP_SEND, send_end_time - send_start_time)
+        if frame.timestamps is not None:
+            if not frame.timestamps.sent:
+                frame.timestamps.sent = send_end_time
+            pipeline_metrics.record_output(OUTPUT_HTTP_SENT, frame.timestamps, send_end_time)
+
+
+def _create_ir_frame_encoder(ir_frame_collector: IrFrameCollector, parameters):
+    min_temp, max_temp, format_name, quality = parameters
+    frame_encoder = StreamFrameEncoder(format_name, quality)
+    renderer = _create_stream_renderer(ir_frame_collector)
+    video_frame_bgr = renderer.create_output_buffer()
+
+    def encode(frame):
+        encode_start_time = time.monotonic()
+        renderer.render(frame.data, as_bgr=True, min_temp=min_temp, max_temp=max_temp, out=video_frame_bgr)
+        stream_part = _get_stream_part(frame_encoder, video_frame_bgr)
+        _record_frame_encoded(ir_frame_collector, frame, encode_start_time, time.monotonic())
+        return stream_part
+    return encode
+
+
+def _create_processed_ir_frame_encoder(ir_frame_collector: IrFrameCollector, parameters):
+    min_val, max_val, format_name, quality = parameters
+    frame_encoder = StreamFrameEncoder(format_name, quality)
+    renderer = _create_stream_renderer(ir_frame_collector)
+    video_frame_bgr = renderer.create_output_buffer()
+
+    def encode(frame):
+        inference_result = ir_frame_collector.get_inference_result(frame)
+        encode_start_time = time.monotonic()
+        renderer.render(inference_result.density_map, as_bgr=True, min_temp=min_val, max_temp=max_val,
+                        out=video_frame_bgr)
+        stream_part = _get_stream_part(frame_encoder, video_frame_bgr)
+        _record_frame_encoded(ir_frame_collector, frame, encode_start_time, time.monotonic())
+        return stream_part
+    return encode
+
+
+def _create_mosaic_encoder(processed: bool, parameters):
+    """ Sensor frames (or density maps) side by side, in the order of the sensors. Black tile for missing frames """
+    min_val, max_val, format_name, quality = parameters
+    frame_encoder = StreamFrameEncoder(format_name, quality)
+    collectors = _ir_sensor_group.get_collectors()
+    renderers = [_create_stream_renderer(ir_frame_collector) for ir_frame_collector in collectors]
+    tiles = [renderer.create_output_buffer() for renderer in renderers]
+    video_frame_bgr = np.zeros((max(tile.shape[0] for tile in tiles), sum(tile.shape[1] for tile in tiles), 3),
+                               dtype=np.uint8)
+
+    def encode(mosaic_frame: MosaicFrame):
+        images = [None] * len(collectors)  # type: List[Union[np.ndarray, None]]
+        for i, (ir_frame_collector, frame) in enumerate(zip(collectors, mosaic_frame.frames)):
+            if frame is not None:
+                images[i] = ir_frame_collector.get_inference_result(frame).density_map if processed else frame.data
+        encode_start_time = time.monotonic()
+        x = 0
+        for renderer, tile, image in zip(renderers, tiles, images):
+            if image is None:
+                tile[:] = 0
+            else:
+                renderer.render(image, as_bgr=True, min_temp=min_val, max_temp=max_val, out=tile)
+            video_frame_bgr[:tile.shape[0], x:x + tile.shape[1]] = tile
+            x += tile.shape[1]
+        stream_part = _get_stream_part(frame_encoder, video_frame_bgr)
+        encode_end_time = time.monotonic()
+        for ir_frame_collector, frame in zip(collectors, mosaic_frame.frames):
+            if frame is not None:
+                _record_frame_encoded(ir_frame_collector, frame, encode_start_time, encode_end_time)
+        return stream_part
+    return encode
+
+
+def _get_stream_response(stream_name, min_val, max_val):
+    """ Common stream arguments: `fps`, `format` (jpeg/png/webp), `q` (quality, compression level for png) """
+    max_fps = request.args.get('fps', default=None, type=float)
+    format_name = request.args.get('format', default=DEFAULT_FORMAT, type=str).lower()
+    quality = request.args.get('q', default=None, type=int)
+    try:
+        StreamFrameEncoder(format_name, quality)  # validate the arguments before starting the stream
+    except ValueError as e:
+        return Response(str(e), status=400)
+
+    try:
+        frames = _stream_hub.subscribe(stream_name, (min_val, max_val, format_name, quality), max_fps=max_fps)
+    except TooManySubscribersError as e:
+        return Response(str(e), status=503)
+    except ValueError as e:  # fps
+        return Response(str(e), status=400)
+    return Response(frames, mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+def set_stream_max_fps(max_fps: float):
+    """ Frame rate limit of the IR streams (of all clients) """
+    _stream_hub.set_max_fps(max_fps)
+
+
+def set_rgb_preview_fps(fps: float):
+    global _rgb_preview_interval
+    _rgb_preview_interval = 1 / fps
+
+
+def _get_rgb_frame(rgb_camera: 'RgbCamera'):
     while True:
-        raw_frame = ir_frame_collector.get_latest_frame().data
-        # logger.info(f"Get frame with min/max={min_temp}/{max_temp}")
-        video_frame_3d = ir_frame_collector.raw_frame_to_frame_for_video(
-            raw_frame, as_bgr=False, min_temp=min_temp, max_temp=max_temp)
-        video_frame_3d = cv2.rotate(video_frame_3d, cv2.ROTATE_90_CLOCKWISE)
-        video_frame_3d = cv2.flip(video_frame_3d, 0)
-
-        video_frame = video_frame_3d.reshape(video_frame_3d.shape[0], -1)
-        frame_png = png.from_array(video_frame, 'RGB')
-        output = BytesIO()
-        frame_png.write(output)
-        frame_bin = output.getvalue()
-
-        time.sleep(0.4)
+        frame_bin = rgb_camera.get_frame_as_jpeg_bin()
+        time.sleep(_rgb_preview_interval)
         yield (b'--frame\r\n'
-               b'Content-Type: image/png\r\n\r\n' + frame_bin + b'\r\n')
-
-
-def _get_processed_ir_frame(ir_frame_collector, frame_processor, min_val, max_val):
-    while True:
-        raw_frame = ir_frame_collector.get_latest_frame().data
-        processed_frame = frame_processor.process_frame(raw_frame)
-
-        video_frame_3d = ir_frame_collector.raw_frame_to_frame_for_video(
-            processed_frame, as_bgr=False, min_temp=min_val, max_temp=max_val)
-        video_frame_3d = cv2.rotate(video_frame_3d, cv2.ROTATE_90_CLOCKWISE)
-        video_frame_3d = cv2.flip(video_frame_3d, 0)
+               b'Content-Type: image/jpeg\r\n\r\n' + frame_bin + b'\r\n')
 
-        video_frame = video_frame_3d.reshape(video_frame_3d.shape[0], -1)
-        frame_png = png.from_array(video_frame, 'RGB')
-        output = BytesIO()
-        frame_png.write(output)
-        frame_bin = output.getvalue()
 
-        time.sleep(0.4)
-        yield (b'--frame\r\n'
-               b'Content-Type: image/png\r\n\r\n' + frame_bin + b'\r\n')
+def _get_range_stream_response(stream_name):
+    min_val = request.args.get('min', default=None, type=float)
+    max_val = request.args.get('max', default=None, type=float)
+    return _get_stream_response(stream_name, min_val, max_val)
 
 
-def _get_rgb_frame(rgb_camera: RgbCamera):
-    while True:
-        frame_bin = rgb_camera.get_frame_as_jpeg_bin()
-        time.sleep(0.1)
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bin + b'\r\n')
+def _get_unknown_sensor_response(sensor_name):
+    return Response(f"Unknown sensor '{sensor_name}'", status=404)
 
 
 @app.route('/ir_video')
 def get_ir_video():
-    min_temp = request.args.get('min', default=None, type=float)
-    max_temp = request.args.get('max', default=None, type=float)
-
-    global _ir_frame_collector
-    return Response(
-        _get_ir_frame(_ir_frame_collector, min_temp=min_temp, max_temp=max_temp),
-        mimetype='multipart/x-mixed-replace; boundary=frame')
+    """ Frames of all sensors side by side """
+    return _get_range_stream_response('ir_video')
 
 
 @app.route('/rgb_video')
 def get_rgb_video():
     global _rgb_camera
+    if _rgb_camera is None:
+        return Response("RGB camera is not available", status=404)
     return Response(
         _get_rgb_frame(_rgb_camera),
         mimetype='multipart/x-mixed-replace; boundary=frame')
@@ -102,29 +212,214 @@ def get_rgb_video():
 
 @app.route('/processed_ir_video')
 def get_processed_ir_video():
-    min_val = request.args.get('min', default=None, type=float)
-    max_val = request.args.get('max', default=None, type=float)
-
-    global _ir_frame_collector
-    global _frame_processor
-    return Response(
-        _get_processed_ir_frame(_ir_frame_collector, _frame_processor, min_val=min_val, max_val=max_val),
-        mimetype='multipart/x-mixed-replace; boundary=frame')
-
-
-def run_server(ir_frame_collector, rgb_camera):
+    """ Density maps of all sensors side by side """
+    return _get_range_stream_response('processed_ir_video')
+
+
+@app.route('/sensors/<sensor_name>/ir_video')
+def get_sensor_ir_video(sensor_name):
+    if sensor_name not in _ir_sensor_group.get_sensor_names():
+        return _get_unknown_sensor_response(sensor_name)
+    return _get_range_stream_response(f'{sensor_name}/ir_video')
+
+
+@app.route('/sensors/<sensor_name>/processed_ir_video')
+def get_sensor_processed_ir_video(sensor_name):
+    if sensor_name not in _ir_sensor_group.get_sensor_names():
+        return _get_unknown_sensor_response(sensor_name)
+    return _get_range_stream_response(f'{sensor_name}/processed_ir_video')
+
+
+@app.route('/streams/stats')
+def get_streams_stats():
+    return jsonify(_stream_hub.get_stats())
+
+
+@app.route('/inference/stats')
+def get_inference_stats():
+    """ Stats of the sensor, or {sensor_name: stats} with more than one sensor """
+    collectors = _ir_sensor_group.get_collectors()
+    if len(collectors) == 1:
+        return jsonify(collectors[0].get_inference_stats())
+    return jsonify({sensor_name: _ir_sensor_group.get_collector(sensor_name).get_inference_stats()
+                    for sensor_name in _ir_sensor_group.get_sensor_names()})
+
+
+@app.route('/rate_control')
+def get_rate_control_stats():
+    """ Current settings, signals and recent changes of the adaptive rate control """
+    if _rate_controller is None:
+        return Response("Adaptive rate control is not enabled", status=404)
+    return jsonify(_rate_controller.get_stats())
+
+
+@app.route('/recording')
+def get_recording_stats():
+    """ Recorded time and bytes, with the activity of the activity-triggered recording """
+    if _data_collector is None:
+        return Response("Recording is not served in this mode", status=404)
+    return jsonify(_data_collector.get_recording_stats())
+
+
+@app.route('/metrics')
+def get_metrics():
+    """ Pipeline latencies, frame rates and counters (labeled with the sensor name) in the Prometheus text format """
+    registries = [collector.get_pipeline_metrics() for collector in _ir_sensor_group.get_collectors()]
+    return Response(format_prometheus_text(registries + [_server_metrics]), mimetype='text/plain; version=0.0.4')
+
+
+def _add_stream_metrics(metric_registry: MetricRegistry):
+    metric_registry.add_gauge('stream_subscribers', 'Connected stream clients',
+                              lambda: _stream_hub.get_stats()['subscribers'])
+    metric_registry.add_counter('stream_skipped_frames_total', 'Frames skipped by slow stream clients',
+                                lambda: _stream_hub.get_stats()['skipped_frames'])
+    metric_registry.add_counter('stream_encoded_frames_total', 'Frames encoded for the streams',
+                                lambda: _stream_hub.get_stats()['encoded_frames'])
+
+
+def _register_streams(ir_sensor_group: IrSensorGroup):
+    """
+    Streams `<sensor_name>/ir_video` and `<sensor_name>/processed_ir_video` of every sensor, and aggregated
+    `ir_video` and `processed_ir_video` (the sensor streams with a single sensor, a mosaic of all sensors otherwise)
+    """
+    for sensor_name, collector in zip(ir_sensor_group.get_sensor_names(), ir_sensor_group.get_collectors()):
+        for stream_name, create_encoder in [('ir_video', _create_ir_frame_encoder),
+                                            ('processed_ir_video', _create_processed_ir_frame_encoder)]:
+            sensor_stream_name = f'{sensor_name}/{stream_name}'
+            _stream_hub.register_stream(sensor_stream_name, collector.wait_for_newer_frame,
+                                        functools.partial(create_encoder, collector))
+            _stream_collectors[sensor_stream_name] = [collector]
+            if len(ir_sensor_group.get_collectors()) == 1:
+                _stream_hub.register_stream(stream_name, collector.wait_for_newer_frame,
+                                            functools.partial(create_encoder, collector))
+                _stream_collectors[stream_name] = [collector]
+
+    if len(ir_sensor_group.get_collectors()) > 1:
+        for stream_name, processed in [('ir_video', False), ('processed_ir_video', True)]:
+            _stream_hub.register_stream(stream_name, ir_sensor_group.wait_for_newer_frames,
+                                        functools.partial(_create_mosaic_encoder, processed))
+            _stream_collectors[stream_name] = ir_sensor_group.get_collectors()
+
+
+def run_server(ir_sensors: Union[IrSensorGroup, IrFrameCollector], rgb_camera, occupancy_log=None,
+               rate_controller: AdaptiveRateController = None, data_collector: DataCollector = None):
+    """ :param ir_sensors: sensor group, or a single collector (served as sensor `DEFAULT_SENSOR_NAME`) """
     logger.info("Starting server...")
-    global _ir_frame_collector
+    global _ir_sensor_group
     global _rgb_camera
-    _ir_frame_collector = ir_frame_collector
+    global _occupancy_log
+    global _rate_controller
+    global _data_collector
+    if ir_sensors is not None and not isinstance(ir_sensors, IrSensorGroup):
+        ir_sensors = IrSensorGroup({DEFAULT_SENSOR_NAME: ir_sensors})
+    _ir_sensor_group = ir_sensors
     _rgb_camera = rgb_camera
+    _occupancy_log = occupancy_log
+    _rate_controller = rate_controller
+    if rate_controller is not None:
+        rate_controller.add_metrics(_server_metrics)
+    _data_collector = data_collector
+    if data_collector is not None:
+        data_collector.add_metrics(_server_metrics)
+    if ir_sensors is not None:
+        _register_streams(ir_sensors)
+        _stream_hub.add_sent_listener(_record_frame_sent)
+        _add_stream_metrics(_server_metrics)
     app.run(host='0.0.0.0', port=8888, debug=False)
 
 
+@app.route('/sensors')
+def get_sensors():
+    """ Names of the sensors with their latest people counts (None before the first result) """
+    sensors = []
+    for sensor_name in _ir_sensor_group.get_sensor_names():
+        inference_result = _ir_sensor_group.get_collector(sensor_name).get_latest_inference_result()
+        sensors.append({
+            'name': sensor_name,
+            'people_count': None if inference_result is None else float(inference_result.people_count),
+        })
+    return jsonify(sensors)
+
+
 @app.route('/people')
 def get_number_of_people():
-    global _frame_processor
-    return str(_frame_processor.get_people_count_on_latest_frame())
+    """ People count summed over all sensors """
+    people_count = _ir_sensor_group.get_people_count()
+    if people_count is None:
+        return str(-1)
+    return str(people_count)
+
+
+@app.route('/sensors/<sensor_name>/people')
+def get_sensor_number_of_people(sensor_name):
+    if sensor_name not in _ir_sensor_group.get_sensor_names():
+        return _get_unknown_sensor_response(sensor_name)
+    inference_result = _ir_sensor_group.get_collector(sensor_name).get_latest_inference_result()
+    if inference_result is None:
+        return str(-1)
+    return str(inference_result.people_count)
+
+
+def _get_history_response(occupancy_history: OccupancyHistory):
+    resolution = request.args.get('resolution', default='1m', type=str)
+    since = request.args.get('since', default=None, type=float)
+    output_format = request.args.get('format', default='json', type=str)
+
+    try:
+        records = occupancy_history.get_history(resolution, since=since)
+    except ValueError as e:
+        return Response(str(e), status=400)
+
+    if output_format == 'binary':
+        return Response(records.tobytes(), mimetype='application/octet-stream')
+    if output_format != 'json':
+        return Response(f"Unknown format '{output_format}'", status=400)
+    return jsonify({
+        'resolution': resolution,
+        'interval': occupancy_history.get_interval(resolution),
+        'timestamp': np.round(records['timestamp'], 3).tolist(),
+        'min': np.round(records['min'].astype(np.float64), 2).tolist(),
+        'mean': np.round(records['mean'].astype(np.float64), 2).tolist(),
+        'max': np.round(records['max'].astype(np.float64), 2).tolist(),
+    })
+
+
+@app.route('/people/history')
+def get_people_history():
+    """
+    History of the people count summed over all sensors, arguments:
+     - `resolution` - raw (every inference), 10s, 1m (default) or 15m
+     - `since` - unix timestamp of the oldest record
+     - `format` - `json` (default) or `binary` (little-endian records: f8 timestamp, f4 min, f4 mean, f4 max)
+    """
+    return _get_history_response(_ir_sensor_group.get_occupancy_history())
+
+
+@app.route('/sensors/<sensor_name>/people/history')
+def get_sensor_people_history(sensor_name):
+    """ People count history of one sensor, arguments as for `/people/history` """
+    if sensor_name not in _ir_sensor_group.get_sensor_names():
+        return _get_unknown_sensor_response(sensor_name)
+    return _get_history_response(_ir_sensor_group.get_collector(sensor_name).get_occupancy_history())
+
+
+@app.route('/people/log')
+def get_people_log():
+    """ Persistent people count log, arguments `start` and `end` (unix timestamps, end defaults to now) """
+    if _occupancy_log is None:
+        return Response("Occupancy log is not enabled", status=404)
+    start_time = request.args.get('start', default=None, type=float)
+    end_time = request.args.get('end', default=None, type=float)
+    if start_time is None:
+        return Response("Argument 'start' is required", status=400)
+    if end_time is None:
+        end_time = time.time()
+
+    rows = _occupancy_log.query(start_time, end_time)
+    return jsonify({
+        'timestamp': [round(timestamp, 3) for timestamp, _ in rows],
+        'people_count': [round(people_count, 2) for _, people_count in rows],
+    })
 
 
 @app.route('/index.html')
@@ -0,0 +1,126 @@
+import logging
+import time
+from multiprocessing import shared_memory
+from typing import Union
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+_HEADER_DTYPE = np.dtype([('latest_sequence_number', '<i8')])
+_WRITE_IN_PROGRESS = -1
+
+
+class SharedRecordRing:
+    """
+    Ring buffer of fixed-size numpy records in `multiprocessing.shared_memory`, for one writer process
+    and any number of reader processes. No locks - readers detect records overwritten during the copy.
+
+    `record_dtype` is a structured dtype which must have an int64 `sequence_number` field.
+    Sequence numbers are assigned by `write`, starting from 1.
+
+    With a `condition` (multiprocessing.Condition shared by the writer and the readers, e.g. inherited by forked
+    processes) `write` wakes up the readers in `wait_for_newer`. Without it, or if the condition cannot be acquired
+    in time (e.g. a process was killed while holding its lock), the readers poll the ring.
+    """
+
+    POLLING_INTERVAL = 0.002  # [s] without the condition
+    NOTIFICATION_TIMEOUT = 0.1  # [s] with the condition - to acquire it, and a polling fallback for a missed wake up
+
+    def __init__(self, name: str, record_dtype: np.dtype, capacity: int = None, create=False, condition=None):
+        """
+        Create a new ring (`create=True`, `capacity` required), or attach to an existing one with the same dtype.
+        The creator is responsible for `unlink`
+        """
+        self._condition = condition
+        self._record_dtype = np.dtype(record_dtype)
+        if create:
+            size = _HEADER_DTYPE.itemsize + self._record_dtype.itemsize * capacity
+            self._shared_memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._capacity = capacity
+        else:
+            self._shared_memory = shared_memory.SharedMemory(name=name)
+            self._capacity = (self._shared_memory.size - _HEADER_DTYPE.itemsize) // self._record_dtype.itemsize
+
+        self._header = np.ndarray((1,), dtype=_HEADER_DTYPE, buffer=self._shared_memory.buf)
+        self._records = np.ndarray((self._capacity,), dtype=self._record_dtype, buffer=self._shared_memory.buf,
+                                   offset=_HEADER_DTYPE.itemsize)
+        if create:
+            self._header['latest_sequence_number'] = 0
+            self._records['sequence_number'] = 0
+
+    @property
+    def name(self) -> str:
+        return self._shared_memory.name
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def get_latest_sequence_number(self) -> int:
+        return int(self._header['latest_sequence_number'][0])
+
+    def write(self, **fields) -> int:
+        """ Write a new record (only from the writer process), missing fields are zeroed. Returns its number """
+        sequence_number = self.get_latest_sequence_number() + 1
+        record = self._records[sequence_number % self._capacity]
+        record['sequence_number'] = _WRITE_IN_PROGRESS
+        for field_name in self._record_dtype.names:
+            if field_name != 'sequence_number':
+                record[field_name] = fields.get(field_name, 0)
+        record['sequence_number'] = sequence_number
+        self._header['latest_sequence_number'] = sequence_number
+        if self._condition is not None and self._condition.acquire(timeout=self.NOTIFICATION_TIMEOUT):
+            try:
+                self._condition.notify_all()
+            finally:
+                self._condition.release()
+        return sequence_number
+
+    def read(self, sequence_number: int) -> Union[np.void, None]:
+        """ Copy of the record, or None if it was not written yet or was already overwritten """
+        if sequence_number <= 0 or sequence_number > self.get_latest_sequence_number():
+            return None
+        record = self._records[sequence_number % self._capacity]
+        record_copy = record.copy()
+        # the record could have been overwritten by the writer while we were copying it
+        if record_copy['sequence_number'] != sequence_number or record['sequence_number'] != sequence_number:
+            return None
+        return record_copy
+
+    def read_latest(self) -> Union[np.void, None]:
+        while True:
+            sequence_number = self.get_latest_sequence_number()
+            if sequence_number == 0:
+                return None
+            record = self.read(sequence_number)
+            if record is not None:
+                return record
+
+    def wait_for_newer(self, sequence_number: int, timeout=None) -> Union[np.void, None]:
+        """ Block until a record newer than `sequence_number` is written. Returns the latest one, or None on timeout """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self.get_latest_sequence_number() <= sequence_number:
+            remaining_time = deadline - time.monotonic() if deadline is not None else self.NOTIFICATION_TIMEOUT
+            if remaining_time <= 0:
+                return None
+            if self._condition is None:
+                time.sleep(self.POLLING_INTERVAL)
+            elif self._condition.acquire(timeout=min(remaining_time, self.NOTIFICATION_TIMEOUT)):
+                try:
+                    # checked again with the condition acquired, the writer notifies only after the header update
+                    if self.get_latest_sequence_number() <= sequence_number:
+                        self._condition.wait(timeout=min(remaining_time, self.NOTIFICATION_TIMEOUT))
+                finally:
+                    self._condition.release()
+        return self.read_latest()
+
+    def close(self):
+        del self._header
+        del self._records
+        self._shared_memory.close()
+
+    def unlink(self):
+        self._shared_memory.unlink()
@@ -0,0 +1,67 @@
+"""
+Image encoders for the HTTP video streams, backed by the native OpenCV codecs.
+"""
+
+import logging
+
+import cv2
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMAT_JPEG = 'jpeg'
+FORMAT_PNG = 'png'
+FORMAT_WEBP = 'webp'
+DEFAULT_FORMAT = FORMAT_PNG
+
+
+class _FormatSpecification:
+    def __init__(self, extension, content_type, quality_flag, min_quality, max_quality, default_quality):
+        self.extension = extension
+        self.content_type = content_type
+        self.quality_flag = quality_flag
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.default_quality = default_quality
+
+
+# for PNG the 'quality' is the zlib compression level (higher = smaller and slower, always lossless)
+_FORMAT_SPECIFICATIONS = {
+    FORMAT_JPEG: _FormatSpecification('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY, 0, 100, 80),
+    FORMAT_PNG: _FormatSpecification('.png', 'image/png', cv2.IMWRITE_PNG_COMPRESSION, 0, 9, 1),
+    FORMAT_WEBP: _FormatSpecification('.webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY, 1, 100, 80),
+}
+
+
+def get_supported_formats() -> list:
+    """ Formats supported by the installed OpenCV build (WebP is optional in OpenCV) """
+    return [format_name for format_name, specification in _FORMAT_SPECIFICATIONS.items()
+            if cv2.haveImageWriter(specification.extension)]
+
+
+class StreamFrameEncoder:
+    """ Encodes BGR uint8 frames to one image format, with fixed quality """
+
+    def __init__(self, format_name: str = DEFAULT_FORMAT, quality: int = None):
+        if format_name not in get_supported_formats():
+            raise ValueError(f"Unsupported stream format '{format_name}' (supported: {get_supported_formats()})")
+        specification = _FORMAT_SPECIFICATIONS[format_name]
+        if quality is None:
+            quality = specification.default_quality
+        if not specification.min_quality <= quality <= specification.max_quality:
+            raise ValueError(f"Quality of '{format_name}' has to be in range "
+                             f"[{specification.min_quality}, {specification.max_quality}], got {quality}")
+
+        self.format_name = format_name
+        self.quality = quality
+        self.content_type = specification.content_type
+        self._extension = specification.extension
+        self._encoding_parameters = [specification.quality_flag, quality]
+
+    def encode(self, frame_bgr: np.ndarray) -> bytes:
+        success, encoded_frame = cv2.imencode(self._extension, frame_bgr, self._encoding_parameters)
+        if not success:
+            raise Exception(f"Failed to encode frame as '{self.format_name}'!")
+        return encoded_frame.tobytes()
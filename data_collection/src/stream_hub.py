@@ -0,0 +1,207 @@
+import collections
+import logging
+import math
+import threading
+import time
+from typing import Callable, Hashable, Iterator, List
+
+
+logger = logging.getLogger(__name__)
+
+
+class TooManySubscribersError(Exception):
+    pass
+
+
+class _StreamEncoder:
+    """ Encoder of one (stream, parameters) combination. Encodes at most one frame at a time """
+
+    def __init__(self, encode_function):
+        self.lock = threading.Lock()
+        self.encode_function = encode_function
+
+
+class _Subscription:
+    """
+    Encoded frames of one subscriber. The subscriber is released once - when the frames end or fail, when closed
+    or garbage collected, also before the first frame (the `finally` of a generator which was not started would not run)
+    """
+
+    def __init__(self, frames: Iterator[bytes], release_function: Callable[[], None]):
+        self._frames = frames
+        self._release_function = release_function
+        self._lock = threading.Lock()
+        self._is_released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            return next(self._frames)
+        except BaseException:
+            self._release()
+            raise
+
+    def close(self):
+        try:
+            self._frames.close()
+        finally:
+            self._release()
+
+    def __del__(self):
+        self.close()
+
+    def _release(self):
+        with self._lock:
+            if self._is_released:
+                return
+            self._is_released = True
+        self._release_function()
+
+
+class StreamBroadcastHub:
+    """
+    Shares rendered and encoded stream frames between all clients.
+
+    Each new frame is encoded once per distinct (stream, parameters) combination, the encoded payloads
+    are kept in an LRU cache keyed by the frame sequence number. Subscribers are woken up on new frames
+    and always get the newest one - a slow client skips frames instead of queueing them.
+    """
+
+    DEFAULT_MAX_FPS = 2.5
+    NEW_FRAME_WAIT_TIMEOUT = 5
+
+    def __init__(self, max_subscribers=16, max_fps=DEFAULT_MAX_FPS, payload_cache_size=32, max_encoders=16):
+        self._max_subscribers = max_subscribers
+        self._max_fps = max_fps
+        self._payload_cache_size = payload_cache_size
+        self._max_encoders = max_encoders
+        self._lock = threading.Lock()
+        self._streams = {}  # stream_name: (wait_for_newer_function, create_encode_function)
+        self._encoders = collections.OrderedDict()  # (stream_name, parameters): _StreamEncoder
+        self._payloads = collections.OrderedDict()  # (stream_name, parameters, sequence_number): bytes
+        self._number_of_subscribers = 0
+        self._number_of_encoded_frames = 0
+        self._number_of_payload_cache_hits = 0
+        self._number_of_skipped_frames = 0
+        self._number_of_rejected_subscriptions = 0
+        self._sent_listeners = []  # type: List[Callable]
+
+    def register_stream(self, stream_name: str, wait_for_newer_function: Callable, create_encode_function: Callable):
+        """
+        :param wait_for_newer_function: (sequence_number, timeout) -> item with `sequence_number` or None on timeout
+        :param create_encode_function: (parameters) -> function encoding an item to bytes.
+                                       Called once per parameters combination, the returned function is never
+                                       called concurrently, so it can keep its own buffers
+        """
+        self._streams[stream_name] = (wait_for_newer_function, create_encode_function)
+
+    def set_max_fps(self, max_fps: float):
+        """ Frame rate limit of all clients, applied from the next frame """
+        self._max_fps = max_fps
+
+    def add_sent_listener(self, listener: Callable):
+        """
+        :param listener: (stream_name, item, send_start_time, send_end_time) -> None, called from the client thread
+                         after a frame was passed to the client connection (time.monotonic() times)
+        """
+        self._sent_listeners.append(listener)
+
+    def subscribe(self, stream_name: str, parameters: Hashable = (), max_fps: float = None):
+        """
+        Iterator of encoded frames for one client. Raises TooManySubscribersError if the limit is reached,
+        ValueError if `max_fps` is not a positive number.
+        `max_fps` of the client is capped by the hub `max_fps`.
+        The subscription is released when the iterator is closed (or garbage collected).
+        """
+        if stream_name not in self._streams:
+            raise Exception(f"Unknown stream '{stream_name}'!")
+        if max_fps is not None and not (math.isfinite(max_fps) and max_fps > 0):
+            raise ValueError(f"Invalid frame rate {max_fps}, expected a positive number")
+        with self._lock:
+            if self._number_of_subscribers >= self._max_subscribers:
+                self._number_of_rejected_subscriptions += 1
+                raise TooManySubscribersError(f"Maximum number of stream subscribers ({self._max_subscribers}) reached")
+            self._number_of_subscribers += 1
+        return _Subscription(self._run_subscription(stream_name, parameters, max_fps), self._release_subscriber)
+
+    def get_stats(self) -> dict:
+        return {
+            'subscribers': self._number_of_subscribers,
+            'max_subscribers': self._max_subscribers,
+            'max_fps': self._max_fps,
+            'rejected_subscriptions': self._number_of_rejected_subscriptions,
+            'encoded_frames': self._number_of_encoded_frames,
+            'payload_cache_hits': self._number_of_payload_cache_hits,
+            'skipped_frames': self._number_of_skipped_frames,
+        }
+
+    def _release_subscriber(self):
+        with self._lock:
+            self._number_of_subscribers -= 1
+
+    def _run_subscription(self, stream_name, parameters, max_fps):
+        wait_for_newer_function, _ = self._streams[stream_name]
+        sequence_number = 0
+        while True:
+            item = wait_for_newer_function(sequence_number, timeout=self.NEW_FRAME_WAIT_TIMEOUT)
+            if item is None:
+                continue
+            if sequence_number:
+                self._number_of_skipped_frames += item.sequence_number - sequence_number - 1
+            sequence_number = item.sequence_number
+
+            frame_start_time = time.monotonic()
+            payload = self._get_payload(stream_name, parameters, item)
+            send_start_time = time.monotonic()
+            yield payload  # resumed by the server after the payload was written to the connection
+            self._notify_sent(stream_name, item, send_start_time, time.monotonic())
+
+            fps = min(max_fps, self._max_fps) if max_fps is not None else self._max_fps
+            remaining_interval = 1 / fps - (time.monotonic() - frame_start_time)
+            if remaining_interval > 0:
+                time.sleep(remaining_interval)
+
+    def _notify_sent(self, stream_name, item, send_start_time, send_end_time):
+        for listener in self._sent_listeners:
+            try:
+                listener(stream_name, item, send_start_time, send_end_time)
+            except:
+                logger.exception("Stream sent listener error!")
+
+    def _get_payload(self, stream_name, parameters, item) -> bytes:
+        payload_key = (stream_name, parameters, item.sequence_number)
+        encoder = self._get_encoder(stream_name, parameters)
+        with encoder.lock:  # other subscribers of the same parameters wait for the payload instead of encoding it
+            with self._lock:
+                payload = self._payloads.get(payload_key)
+                if payload is not None:
+                    self._payloads.move_to_end(payload_key)
+                    self._number_of_payload_cache_hits += 1
+                    return payload
+
+            payload = encoder.encode_function(item)
+
+            with self._lock:
+                self._number_of_encoded_frames += 1
+                self._payloads[payload_key] = payload
+                while len(self._payloads) > self._payload_cache_size:
+                    self._payloads.popitem(last=False)
+        return payload
+
+    def _get_encoder(self, stream_name, parameters) -> _StreamEncoder:
+        encoder_key = (stream_name, parameters)
+        with self._lock:
+            encoder = self._encoders.get(encoder_key)
+            if encoder is not None:
+                self._encoders.move_to_end(encoder_key)
+                return encoder
+
+        _, create_encode_function = self._streams[stream_name]
+        encoder = _StreamEncoder(create_encode_function(parameters))
+        with self._lock:
+            encoder = self._encoders.setdefault(encoder_key, encoder)
+            while len(self._encoders) > self._max_encoders:
+                self._encoders.popitem(last=False)
+        return encoder
@@ -0,0 +1,93 @@
+import functools
+
+import cv2
+import numpy as np
+from matplotlib import pyplot as plt
+
+
+@functools.lru_cache(maxsize=None)
+def get_colormap_lut(colormap_name: str, as_bgr: bool) -> np.ndarray:
+    """ 256 x 3 uint8 lookup table for the matplotlib colormap """
+    colormap = plt.get_cmap(colormap_name)
+    lut_rgb = np.round(colormap(np.arange(256))[:, :3] * 255).astype(np.uint8)
+    lut = lut_rgb[:, ::-1] if as_bgr else lut_rgb
+    lut = np.ascontiguousarray(lut)
+    lut.flags.writeable = False
+    return lut
+
+
+def _get_geometry_indices(resolution, rotation, flip_code) -> np.ndarray:
+    """ Flat indices of the raw frame pixels for the rotated and flipped frame """
+    indices = np.arange(resolution[0] * resolution[1], dtype=np.intp).reshape(resolution)
+    if rotation is not None:
+        indices = cv2.rotate(indices.astype(np.int32), rotation).astype(np.intp)
+    if flip_code is not None:
+        indices = cv2.flip(indices.astype(np.int32), flip_code).astype(np.intp)
+    return np.ascontiguousarray(indices)
+
+
+class ThermalRenderer:
+    """
+    Renders raw IR frames (temperatures or model output) into zoomed, colormapped images.
+
+    Colormap lookup tables and the rotate/flip geometry are precomputed,
+    so rendering a frame is a gather on the raw frame, one resize and one table lookup.
+    The renderer keeps scratch buffers - use one instance per thread.
+    """
+
+    def __init__(self, resolution, zoom: int, colormap_name='inferno',  # default for imshow is 'viridis'
+                 rotation=None, flip_code=None, interpolation=cv2.INTER_CUBIC):
+        """
+        :param resolution: (rows, cols) of the raw frame
+        :param rotation: None or cv2.ROTATE_* code, applied before flip
+        :param flip_code: None or cv2.flip code
+        """
+        self._geometry_indices = _get_geometry_indices(resolution, rotation, flip_code)
+        self._interpolation = interpolation
+        # 256 x 1 x 3 for cv2.LUT on the grayscale image expanded to 3 channels (no temporary arrays, unlike np.take)
+        self._lut_rgb = get_colormap_lut(colormap_name, as_bgr=False).reshape((256, 1, 3))
+        self._lut_bgr = get_colormap_lut(colormap_name, as_bgr=True).reshape((256, 1, 3))
+
+        oriented_shape = self._geometry_indices.shape
+        self.output_shape = (oriented_shape[0] * zoom, oriented_shape[1] * zoom, 3)
+        self.output_size_cv = (self.output_shape[1], self.output_shape[0])
+        self._oriented_frame = np.zeros(oriented_shape, dtype=np.float64)
+        self._oriented_frame_float32 = np.zeros(oriented_shape, dtype=np.float32)  # for pooled frame buffers
+        self._normalized_frame_u8 = np.zeros(oriented_shape, dtype=np.uint8)
+        self._zoomed_frame_u8 = np.zeros(self.output_shape[:2], dtype=np.uint8)
+        self._zoomed_frame_u8_3 = np.zeros(self.output_shape, dtype=np.uint8)
+
+    def create_output_buffer(self) -> np.ndarray:
+        return np.zeros(self.output_shape, dtype=np.uint8)
+
+    def render(self, raw_frame, min_temp=None, max_temp=None, as_bgr=True, out=None) -> np.ndarray:
+        """
+        :param raw_frame: frame data, flat or 2D
+        :param min_temp: value mapped to the first colormap color, None for frame minimum
+        :param max_temp: value mapped to the last colormap color, None for frame maximum
+        :param out: buffer from create_output_buffer() to render into. If None, a new array is allocated
+        """
+        raw_frame = np.reshape(raw_frame, -1)
+        oriented_frame = self._oriented_frame_float32 if raw_frame.dtype == np.float32 else self._oriented_frame
+        np.take(raw_frame, self._geometry_indices, out=oriented_frame, mode='clip')  # 'raise' buffers the output
+
+        if min_temp is None:
+            min_temp = oriented_frame.min()
+        if max_temp is None:
+            max_temp = oriented_frame.max()
+        scale = 255 / (max_temp - min_temp) if max_temp > min_temp else 0
+
+        np.subtract(oriented_frame, min_temp, out=oriented_frame)
+        np.multiply(oriented_frame, scale, out=oriented_frame)
+        np.clip(oriented_frame, 0, 255, out=oriented_frame)
+        np.copyto(self._normalized_frame_u8, oriented_frame, casting='unsafe')
+
+        cv2.resize(src=self._normalized_frame_u8, dsize=self.output_size_cv,
+                   dst=self._zoomed_frame_u8, interpolation=self._interpolation)
+
+        if out is None:
+            out = self.create_output_buffer()
+        lut = self._lut_bgr if as_bgr else self._lut_rgb
+        cv2.cvtColor(self._zoomed_frame_u8, cv2.COLOR_GRAY2BGR, dst=self._zoomed_frame_u8_3)
+        cv2.LUT(self._zoomed_frame_u8_3, lut, dst=out)
+        return out
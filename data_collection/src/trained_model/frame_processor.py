@@ -1,10 +1,14 @@
 import os
+import threading
 
 import numpy as np
 import torch.nn.functional as F
 from torch import nn
 import torch
 
+from trained_model import model_precision
+from trained_model.model_optimization import load_or_build_optimized_model, optimize_model
+
 
 # from config import IR_CAMERA_RESOLUTION, TEMPERATURE_NORMALIZATION__MIN, TEMPERATURE_NORMALIZATION__MAX
 IR_CAMERA_RESOLUTION_X = 32
@@ -16,6 +20,8 @@ IR_CAMERA_RESOLUTION = (IR_CAMERA_RESOLUTION_Y, IR_CAMERA_RESOLUTION_X)
 TEMPERATURE_NORMALIZATION__MIN = 20
 TEMPERATURE_NORMALIZATION__MAX = 35
 
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'unet_v2small_cpu2')
+
 
 from typing import Tuple
 import torch
@@ -104,33 +110,100 @@ class DoubleConv(nn.Sequential):
 
 
 class FrameProcessor:
-    def __init__(self):
+    DEFAULT_BATCH_SIZE = 16
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, optimized=False, model_path=DEFAULT_MODEL_PATH,
+                 precision=model_precision.PRECISION_FLOAT64, check_precision_approval=True):
+        """
+        :param optimized: use the model with folded BatchNorm and input normalization, frozen with TorchScript
+                          (see model_optimization.py), cached next to the checkpoint
+        :param precision: one of model_precision.PRECISIONS. Modes other than float64 have to be approved
+                          with evaluation/calibrate_precision.py (see model_precision.py)
+        """
         self.latest_output_frame = None
         self.sum_of_values_for_one_person = 52
         #self.model = UNET(1, 1).double()
         self.model = AutoEncoder(1, 1).double()
 
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        model_path = os.path.join(current_dir, 'unet_v2small_cpu2')
         self.model.load_state_dict(torch.load(model_path))
         self.model.eval()
         self.model.train(False)
 
+        self.precision = precision
+        precision_validation = {}
+        if check_precision_approval:
+            precision_validation = model_precision.check_precision_approved(model_path, precision, optimized)
+        self._input_dtype = model_precision.get_torch_dtype(precision)
+
+        self._normalize_input = True
+        if precision == model_precision.PRECISION_INT8:
+            # calibrated and quantized by evaluation/calibrate_precision.py, BatchNorm already fused
+            self.model = model_precision.load_int8_model(
+                model_path, quantization_engine=precision_validation.get(
+                    'quantization_engine', model_precision.get_default_quantization_engine()))
+        elif optimized:
+            float_model = self.model.to(self._input_dtype)
+            self.model = load_or_build_optimized_model(
+                checkpoint_path=model_path, variant=precision,
+                build_function=lambda: optimize_model(
+                    float_model,
+                    example_input=torch.zeros((1, 1, *IR_CAMERA_RESOLUTION), dtype=self._input_dtype),
+                    normalization_min=TEMPERATURE_NORMALIZATION__MIN,
+                    normalization_max=TEMPERATURE_NORMALIZATION__MAX))
+            self._normalize_input = False  # folded into the model
+        else:
+            self.model.to(self._input_dtype)
+
+        self._batch_size = batch_size
+        self._input_tensor = torch.zeros((batch_size, 1, *IR_CAMERA_RESOLUTION), dtype=self._input_dtype)
+        self._inference_lock = threading.Lock()  # for the preallocated input tensor
+
     def process_frame(self, raw_frame):
-        frame_2d = np.reshape(raw_frame, IR_CAMERA_RESOLUTION)
-
-        frame_normalized = (frame_2d - TEMPERATURE_NORMALIZATION__MIN) * \
-                           (1 / (TEMPERATURE_NORMALIZATION__MAX - TEMPERATURE_NORMALIZATION__MIN))
-        frame_for_model = torch.tensor(frame_normalized)[np.newaxis, :, :][np.newaxis, :, :, :]
-        with torch.no_grad():
-            model_out_frame = self.model(frame_for_model)[0]
-        self.latest_output_frame = model_out_frame.numpy()
+        output_frames, _ = self.process_frames(np.reshape(raw_frame, (1, *IR_CAMERA_RESOLUTION)))
+        self.latest_output_frame = output_frames[0]
         return self.latest_output_frame
 
+    def process_frames(self, raw_frames, batch_size=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Run the model on many frames, in batches of up to `batch_size` frames
+        :param raw_frames: array of shape (N, 24, 32) or (N, 768)
+        :return: tuple with output frames (N, 24, 32) and people count for each frame (N,)
+        """
+        raw_frames = np.reshape(raw_frames, (-1, *IR_CAMERA_RESOLUTION))
+        batch_size = batch_size or self._batch_size
+        number_of_frames = raw_frames.shape[0]
+        output_frames = np.zeros(raw_frames.shape, dtype=np.float64)
+
+        with self._inference_lock:
+            if self._input_tensor.shape[0] < batch_size:
+                self._input_tensor = torch.zeros((batch_size, 1, *IR_CAMERA_RESOLUTION), dtype=self._input_dtype)
+            input_array = self._input_tensor.numpy()  # shares memory with the tensor
+
+            for batch_start in range(0, number_of_frames, batch_size):
+                batch_end = min(batch_start + batch_size, number_of_frames)
+                batch_length = batch_end - batch_start
+                frames_for_model = input_array[:batch_length, 0]
+                if self._normalize_input:
+                    np.subtract(raw_frames[batch_start:batch_end], TEMPERATURE_NORMALIZATION__MIN,
+                                out=frames_for_model)
+                    np.multiply(frames_for_model,
+                                1 / (TEMPERATURE_NORMALIZATION__MAX - TEMPERATURE_NORMALIZATION__MIN),
+                                out=frames_for_model)
+                else:
+                    frames_for_model[:] = raw_frames[batch_start:batch_end]
+                with torch.no_grad():
+                    output_frames[batch_start:batch_end] = self.model(self._input_tensor[:batch_length]).numpy()
+
+        people_counts = np.sum(output_frames, axis=(1, 2)) / self.sum_of_values_for_one_person
+        return output_frames, people_counts
+
+    def get_people_count(self, output_frame):
+        return np.sum(output_frame) / self.sum_of_values_for_one_person
+
     def get_people_count_on_latest_frame(self):
         if self.latest_output_frame is None:
             return -1
-        return np.sum(self.latest_output_frame) / self.sum_of_values_for_one_person
+        return self.get_people_count(self.latest_output_frame)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,134 @@
+"""
+Inference graph optimization of the AutoEncoder:
+ - BatchNorm layers are folded into the preceding convolutions,
+ - temperature normalization is folded into the first convolution (model takes raw temperatures),
+ - the model is traced and frozen with TorchScript.
+The optimized model is cached next to the checkpoint, for fast startup.
+"""
+
+import copy
+import logging
+import os
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+
+logger = logging.getLogger(__name__)
+
+
+OPTIMIZED_MODEL_FILE_SUFFIX = '.optimized.pt'
+_CACHE_KEY_FILE_NAME = 'cache_key'
+
+
+class NormalizedInputConv2d(nn.Module):
+    """
+    Convolution with the input normalization `(x - offset) * scale` folded into its weights.
+    Padding is done explicitly with `offset`, which is the raw value of normalized zero.
+    """
+
+    def __init__(self, conv: nn.Conv2d, offset: float, scale: float):
+        super().__init__()
+        if conv.padding_mode != 'zeros' or isinstance(conv.padding, str):
+            raise Exception("Only explicit zero padding is supported!")
+        self.offset = offset
+        self.padding = (conv.padding[1], conv.padding[1], conv.padding[0], conv.padding[0])
+        self.conv = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                              padding=0, dilation=conv.dilation, groups=conv.groups, bias=True)
+        self.conv.to(conv.weight.dtype)
+
+        with torch.no_grad():
+            weight = conv.weight * scale
+            bias = conv.bias if conv.bias is not None else torch.zeros(conv.out_channels, dtype=weight.dtype)
+            self.conv.weight.copy_(weight)
+            self.conv.bias.copy_(bias - offset * torch.sum(weight, dim=(1, 2, 3)))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        x = F.pad(x, self.padding, mode='constant', value=self.offset)
+        return self.conv(x)
+
+
+def fold_batch_norm_into_conv(conv: nn.Conv2d, bn: nn.BatchNorm2d) -> nn.Conv2d:
+    fused_conv = copy.deepcopy(conv)
+    with torch.no_grad():
+        bn_scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        fused_conv.weight.copy_(conv.weight * bn_scale.reshape(-1, 1, 1, 1))
+        conv_bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+        if fused_conv.bias is None:
+            fused_conv.bias = nn.Parameter(torch.zeros_like(bn.running_mean))
+        fused_conv.bias.copy_((conv_bias - bn.running_mean) * bn_scale + bn.bias)
+    return fused_conv
+
+
+def fold_batch_norms(model: nn.Module) -> nn.Module:
+    """
+    Fold every BatchNorm2d into the Conv2d registered directly before it (in place).
+    Relies on the children registration order matching the forward order,
+    which holds for DoubleConv and ExpandBlock.
+    """
+    for module in model.modules():
+        children = list(module.named_children())
+        for (conv_name, conv), (bn_name, bn) in zip(children, children[1:]):
+            if type(conv) is nn.Conv2d and isinstance(bn, nn.BatchNorm2d):
+                setattr(module, conv_name, fold_batch_norm_into_conv(conv, bn))
+                setattr(module, bn_name, nn.Identity())
+    return model
+
+
+def fuse_input_normalization(model: nn.Module, normalization_min: float, normalization_max: float) -> nn.Module:
+    """ Fold `(x - min) / (max - min)` into the first convolution of the AutoEncoder (in place) """
+    first_block = model.encoder.conv1.conv
+    first_block[0] = NormalizedInputConv2d(
+        first_block[0], offset=normalization_min, scale=1 / (normalization_max - normalization_min))
+    return model
+
+
+def optimize_model(model: nn.Module, example_input: torch.Tensor,
+                   normalization_min: float, normalization_max: float) -> torch.jit.ScriptModule:
+    """
+    :param model: AutoEncoder in eval mode, taking normalized frames
+    :return: frozen TorchScript model, taking raw temperatures
+    """
+    optimized_model = copy.deepcopy(model).eval()
+    fold_batch_norms(optimized_model)
+    fuse_input_normalization(optimized_model, normalization_min, normalization_max)
+    with torch.no_grad():
+        traced_model = torch.jit.trace(optimized_model, example_input)
+    return torch.jit.freeze(traced_model.eval())
+
+
+def get_optimized_model_cache_key(checkpoint_path: str, variant: str) -> str:
+    checkpoint_stat = os.stat(checkpoint_path)
+    return f'{variant};{checkpoint_stat.st_size};{checkpoint_stat.st_mtime_ns};torch={torch.__version__}'
+
+
+def load_or_build_optimized_model(checkpoint_path: str, variant: str, build_function) -> torch.jit.ScriptModule:
+    """
+    Load the optimized model cached next to the checkpoint, or build it with `build_function` and cache it.
+    The cache is rebuilt when the checkpoint, the variant or the torch version changes.
+    """
+    cache_file_path = f'{checkpoint_path}.{variant}{OPTIMIZED_MODEL_FILE_SUFFIX}'
+    cache_key = get_optimized_model_cache_key(checkpoint_path, variant)
+
+    if os.path.isfile(cache_file_path):
+        try:
+            extra_files = {_CACHE_KEY_FILE_NAME: ''}
+            cached_model = torch.jit.load(cache_file_path, _extra_files=extra_files)
+            cached_model_key = extra_files[_CACHE_KEY_FILE_NAME]
+            if isinstance(cached_model_key, bytes):
+                cached_model_key = cached_model_key.decode()
+            if cached_model_key == cache_key:
+                logger.info(f"Loaded optimized model from '{cache_file_path}'")
+                return cached_model
+            logger.info(f"Optimized model cache '{cache_file_path}' is outdated")
+        except:
+            logger.exception(f"Failed to load optimized model from '{cache_file_path}'!")
+
+    optimized_model = build_function()
+    try:
+        torch.jit.save(optimized_model, cache_file_path, _extra_files={_CACHE_KEY_FILE_NAME: cache_key})
+        logger.info(f"Optimized model saved to '{cache_file_path}'")
+    except:
+        logger.exception(f"Failed to save optimized model to '{cache_file_path}'!")
+    return optimized_model
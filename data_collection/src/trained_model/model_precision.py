@@ -0,0 +1,130 @@
+"""
+Inference precision modes of the AutoEncoder.
+
+float64 is the reference mode. Other modes have to be validated first with
+evaluation/calibrate_precision.py, which stores the validation results (and the calibrated int8 model)
+next to the checkpoint. FrameProcessor refuses to use a mode which was not approved for the checkpoint.
+
+Only static int8 quantization is provided - dynamic quantization in PyTorch covers only Linear/RNN layers,
+so it would leave this fully convolutional model in floating point.
+"""
+
+import copy
+import json
+import logging
+import os
+import platform
+
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+
+PRECISION_FLOAT64 = 'float64'
+PRECISION_FLOAT32 = 'float32'
+PRECISION_INT8 = 'int8'
+PRECISIONS = [PRECISION_FLOAT64, PRECISION_FLOAT32, PRECISION_INT8]
+REFERENCE_PRECISION = PRECISION_FLOAT64
+
+PRECISION_REPORT_FILE_SUFFIX = '.precision.json'
+INT8_MODEL_FILE_SUFFIX = '.int8.pt'
+
+
+def get_default_quantization_engine() -> str:
+    if platform.machine().lower().startswith(('arm', 'aarch64')):
+        return 'qnnpack'
+    return 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'fbgemm'
+
+
+def get_torch_dtype(precision: str) -> torch.dtype:
+    return torch.float64 if precision == PRECISION_FLOAT64 else torch.float32
+
+
+def get_precision_report_path(model_path: str) -> str:
+    return model_path + PRECISION_REPORT_FILE_SUFFIX
+
+
+def get_int8_model_path(model_path: str) -> str:
+    return model_path + INT8_MODEL_FILE_SUFFIX
+
+
+def _get_checkpoint_id(model_path: str) -> str:
+    checkpoint_stat = os.stat(model_path)
+    return f'{checkpoint_stat.st_size};{checkpoint_stat.st_mtime_ns}'
+
+
+def load_precision_report(model_path: str) -> dict:
+    report_path = get_precision_report_path(model_path)
+    if not os.path.isfile(report_path):
+        return {}
+    with open(report_path, 'r') as file:
+        report = json.loads(file.read())
+    if report.get('checkpoint_id') != _get_checkpoint_id(model_path):
+        logger.warning(f"Precision report '{report_path}' is for a different checkpoint - ignoring it")
+        return {}
+    return report
+
+
+def save_precision_validation(model_path: str, precision: str, validation: dict):
+    report = load_precision_report(model_path)
+    report['checkpoint_id'] = _get_checkpoint_id(model_path)
+    report.setdefault('modes', {})[precision] = validation
+    with open(get_precision_report_path(model_path), 'w') as file:
+        file.write(json.dumps(report, indent=2))
+
+
+def check_precision_approved(model_path: str, precision: str, optimized=False) -> dict:
+    """
+    :param optimized: the optimized model (see model_optimization.py) is loaded, instead of the eager one.
+                      The validation has to be of the same variant (except int8, which has a single model)
+    :return: validation entry of the mode. Raises if the mode was not validated or failed the validation
+    """
+    if precision == REFERENCE_PRECISION:
+        return {}
+    if precision not in PRECISIONS:
+        raise Exception(f"Unknown inference precision '{precision}'!")
+    validation = load_precision_report(model_path).get('modes', {}).get(precision)
+    if validation is None:
+        raise Exception(f"Inference precision '{precision}' was not validated for model '{model_path}'! "
+                        f"Run evaluation/calibrate_precision.py first")
+    if precision != PRECISION_INT8 and validation.get('optimized', False) != optimized:
+        raise Exception(f"Inference precision '{precision}' was validated for the "
+                        f"{_get_variant_name(validation.get('optimized', False))} model '{model_path}', "
+                        f"not for the {_get_variant_name(optimized)} one! Run evaluation/calibrate_precision.py "
+                        f"{'' if optimized else '--eager '}first")
+    if not validation['approved']:
+        raise Exception(f"Inference precision '{precision}' failed the validation for model '{model_path}' "
+                        f"(count MAE {validation['count_mae']:.4f} vs reference {validation['reference_count_mae']:.4f})!")
+    return validation
+
+
+def _get_variant_name(optimized: bool) -> str:
+    return 'optimized' if optimized else 'eager'
+
+
+def build_int8_model(model: torch.nn.Module, calibration_frames_normalized: torch.Tensor,
+                     quantization_engine: str, batch_size=64) -> torch.jit.ScriptModule:
+    """
+    Static post-training quantization (FX graph mode), with Conv-BN-ReLU fusion.
+    :param model: float AutoEncoder in eval mode
+    :param calibration_frames_normalized: tensor (N, 1, 24, 32) of normalized frames
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = quantization_engine
+    float_model = copy.deepcopy(model).float().eval()
+    example_input = calibration_frames_normalized[:1].float()
+    prepared_model = prepare_fx(float_model, get_default_qconfig_mapping(quantization_engine), (example_input,))
+    with torch.no_grad():
+        for batch_start in range(0, calibration_frames_normalized.shape[0], batch_size):
+            prepared_model(calibration_frames_normalized[batch_start:batch_start + batch_size].float())
+        quantized_model = convert_fx(prepared_model)
+        traced_model = torch.jit.trace(quantized_model, example_input)
+    return torch.jit.freeze(traced_model.eval())
+
+
+def load_int8_model(model_path: str, quantization_engine: str) -> torch.jit.ScriptModule:
+    torch.backends.quantized.engine = quantization_engine
+    return torch.jit.load(get_int8_model_path(model_path))
@@ -0,0 +1,63 @@
+"""
+Opening files of recorded batches which may be compressed in the background on the device
+(as written by data_collection/src/batch_archive.py): 'ir_000.bin.xz', 'ir.csv.xz', 'rgb.mjpeg.gz', ...
+"""
+
+import contextlib
+import glob
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+
+
+CODEC_FILE_EXTENSIONS = {'lzma': '.xz', 'zlib': '.gz'}
+
+
+def find_batch_file(file_path):
+    """ Path of the file or of its compressed version, None if there is neither """
+    for candidate_file_path in [file_path] + [file_path + extension for extension in CODEC_FILE_EXTENSIONS.values()]:
+        if os.path.isfile(candidate_file_path):
+            return candidate_file_path
+    return None
+
+
+def is_compressed(file_path) -> bool:
+    return file_path.endswith(tuple(CODEC_FILE_EXTENSIONS.values()))
+
+
+def open_batch_file(file_path, mode='rb'):
+    """ Open the file, or its compressed version, for reading. `mode` - 'rb' or 'rt' """
+    found_file_path = find_batch_file(file_path)
+    if found_file_path is None:
+        raise FileNotFoundError(f"No file '{file_path}' (or compressed) found!")
+    if found_file_path.endswith(CODEC_FILE_EXTENSIONS['lzma']):
+        return lzma.open(found_file_path, mode)
+    if found_file_path.endswith(CODEC_FILE_EXTENSIONS['zlib']):
+        return gzip.open(found_file_path, mode)
+    return open(found_file_path, mode)
+
+
+def glob_batch_files(pattern):
+    """ Files matching the pattern, compressed or not (the uncompressed one if there are both), sorted """
+    file_paths = {}
+    for extension in [''] + list(CODEC_FILE_EXTENSIONS.values()):
+        for file_path in glob.glob(pattern + extension):
+            file_paths.setdefault(file_path[:len(file_path) - len(extension)], file_path)
+    return [file_paths[original_file_path] for original_file_path in sorted(file_paths)]
+
+
+@contextlib.contextmanager
+def local_batch_file(file_path):
+    """ Path of the uncompressed file - decompressed to a temporary file if needed (e.g. for cv2.VideoCapture) """
+    found_file_path = find_batch_file(file_path)
+    if found_file_path is None or not is_compressed(found_file_path):
+        yield file_path
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir_path:
+        temp_file_path = os.path.join(temp_dir_path, os.path.basename(file_path))
+        with open_batch_file(file_path) as source_file, open(temp_file_path, 'wb') as temp_file:
+            shutil.copyfileobj(source_file, temp_file)
+        yield temp_file_path
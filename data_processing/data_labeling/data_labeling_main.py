@@ -5,19 +5,18 @@ import pymsgbox
 
 from data_labeling.annotation_collector import AnnotationCollector
 from data_labeling import labeling_config
-from data_labeling.ir_data_scv_reader import IrDataCsvReader
+from data_labeling.ir_data_bin_reader import create_ir_data_reader
 from data_labeling.rgb_video_reader import RgbVideoReader
 from data_labeling.single_frame_annotator import DrawingMode, KeyAction, SingleFrameAnnotator
 
 
 def run_labeling_for_data_batch(data_batch_dir_path, output_file_path):
-    ir_csv_path = os.path.join(data_batch_dir_path, 'ir.csv')
     rgb_video_path = os.path.join(data_batch_dir_path, 'rgb.mjpeg')
 
-    ir_data_csv_reader = IrDataCsvReader(ir_csv_path)
+    ir_data_reader = create_ir_data_reader(data_batch_dir_path)
     rgv_video_reader = RgbVideoReader(rgb_video_path)
 
-    number_of_ir_frames = ir_data_csv_reader.get_number_of_frames()
+    number_of_ir_frames = ir_data_reader.get_number_of_frames()
     number_of_rgb_frames = rgv_video_reader.get_number_of_frames()
     logging.info(f'Number of IR frames: {number_of_ir_frames}. '
                  f'Number of RGB frames: {number_of_rgb_frames}')
@@ -32,7 +31,7 @@ def run_labeling_for_data_batch(data_batch_dir_path, output_file_path):
     quit_application = False
     while ir_frame_index < number_of_ir_frames:
         rgb_frame_index = int(ir_frame_index * rgb_to_ir_frames_ratio)
-        ir_frame = ir_data_csv_reader.get_frame(ir_frame_index)
+        ir_frame = ir_data_reader.get_frame(ir_frame_index)
         rgb_frame = rgv_video_reader.get_frame(rgb_frame_index)
 
         help_msg = f'\nAnnotating frame {ir_frame_index} / {number_of_ir_frames}. ' \
@@ -50,7 +49,7 @@ def run_labeling_for_data_batch(data_batch_dir_path, output_file_path):
         automove_to_next_frame_after_mouse_released = frame_annotator.automove_to_next_frame_after_mouse_released
 
         # maybe add raw_data in the file with labels?
-        # new_annotiation.raw_frame_data = ir_data_csv_reader.get_raw_frame_data(ir_frame_index)
+        # new_annotiation.raw_frame_data = ir_data_reader.get_raw_frame_data(ir_frame_index)
 
         annotation_collector.set_annotation(ir_frame_index, new_annotation)
 
@@ -0,0 +1,129 @@
+import glob
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+import config
+from data_labeling.batch_files import find_batch_file, glob_batch_files, is_compressed, open_batch_file
+from data_labeling.ir_data_scv_reader import IrDataCsvReader
+
+
+# Binary recording format, as written by data_collection/src/ir_frame_recording.py
+FILE_MAGIC = b'IRFRAMES'
+FORMAT_VERSION = 1
+HEADER_SIZE = 64
+METADATA_FILE_SUFFIX = '.meta.json'
+_HEADER_STRUCT = struct.Struct('<8sHBxHHII')
+SAMPLE_FORMAT_INT16_CENTI_DEGREES = 0
+SAMPLE_FORMAT_FLOAT16 = 1
+_SAMPLE_DTYPES = {
+    SAMPLE_FORMAT_INT16_CENTI_DEGREES: np.dtype('<i2'),
+    SAMPLE_FORMAT_FLOAT16: np.dtype('<f2'),
+}
+
+
+class IrDataBinReader:
+    """
+    Memory-mapped reader of chunked binary IR recordings ('ir_000.bin', 'ir_001.bin', ...).
+    Has the same interface as IrDataCsvReader, but frames are decoded lazily.
+    Compressed chunks ('ir_000.bin.xz') are decompressed to memory.
+    """
+    def __init__(self, file_path_prefix):
+        self._file_path_prefix = file_path_prefix
+        self._chunks = []
+        self._sample_format = None
+        chunk_file_paths = glob_batch_files(glob.escape(file_path_prefix) + '_*.bin')
+        if not chunk_file_paths:
+            raise Exception(f"No IR frames chunk files found for '{file_path_prefix}'!")
+        for chunk_file_path in chunk_file_paths:
+            self._chunks.append(self._map_chunk(chunk_file_path))
+        self._chunk_start_indices = np.cumsum([0] + [len(chunk) for chunk in self._chunks])
+
+    def _map_chunk(self, chunk_file_path):
+        decompressed_data = None
+        with open_batch_file(chunk_file_path) as file:
+            magic, version, sample_format, rows, cols, _, _ = _HEADER_STRUCT.unpack_from(file.read(HEADER_SIZE))
+            if is_compressed(chunk_file_path):
+                decompressed_data = file.read()
+                file_size = HEADER_SIZE + len(decompressed_data)
+            else:
+                file.seek(0, 2)
+                file_size = file.tell()
+        if magic != FILE_MAGIC or version != FORMAT_VERSION:
+            raise Exception(f"File '{chunk_file_path}' is not a supported IR frames recording!")
+        if (rows, cols) != config.IR_CAMERA_RESOLUTION:
+            raise Exception(f"Unexpected frame resolution {(rows, cols)} in '{chunk_file_path}'!")
+
+        self._sample_format = sample_format
+        record_dtype = np.dtype([
+            ('no', '<u4'),
+            ('timestamp', '<f8'),
+            ('data', _SAMPLE_DTYPES[sample_format], (rows * cols,)),
+        ])
+        number_of_records = (file_size - HEADER_SIZE) // record_dtype.itemsize
+        if number_of_records <= 0:
+            return np.zeros(0, dtype=record_dtype)
+        if decompressed_data is not None:
+            return np.frombuffer(decompressed_data, dtype=record_dtype, count=number_of_records)
+        return np.memmap(chunk_file_path, dtype=record_dtype, mode='r',
+                         offset=HEADER_SIZE, shape=(number_of_records,))
+
+    def _get_record(self, n):
+        chunk_number = int(np.searchsorted(self._chunk_start_indices, n, side='right')) - 1
+        return self._chunks[chunk_number][n - self._chunk_start_indices[chunk_number]]
+
+    def _get_frame_data_1d(self, record):
+        if self._sample_format == SAMPLE_FORMAT_INT16_CENTI_DEGREES:
+            return record['data'].astype(np.float64) / 100
+        return record['data'].astype(np.float64)
+
+    def get_number_of_frames(self):
+        return int(self._chunk_start_indices[-1])
+
+    def get_metadata(self) -> dict:
+        """ Recording metadata (e.g. frames dropped by the recorder), empty for older recordings """
+        metadata_file_path = self._file_path_prefix + METADATA_FILE_SUFFIX
+        if not os.path.isfile(metadata_file_path):
+            return {}
+        with open(metadata_file_path, 'rt') as file:
+            return json.loads(file.read())
+
+    def get_frame(self, n):
+        return np.reshape(self._get_frame_data_1d(self._get_record(n)), config.IR_CAMERA_RESOLUTION)
+
+    def get_raw_frame_data(self, n) -> str:
+        """ Frame as a line in the legacy 'ir.csv' format """
+        record = self._get_record(n)
+        data_str = ','.join([f"{t:.2f}" for t in self._get_frame_data_1d(record)])
+        return f"{record['no']},{record['timestamp']},{data_str}"
+
+    def export_to_csv(self, csv_file_path):
+        with open(csv_file_path, 'wt') as csv_file:
+            csv_file.write("no, timestamp, data_array\n")
+            for n in range(self.get_number_of_frames()):
+                csv_file.write(self.get_raw_frame_data(n) + '\n')
+
+
+def create_ir_data_reader(data_batch_dir_path):
+    """
+    Reader for the IR data in the batch directory - binary recording if available, 'ir.csv' otherwise
+    (compressed or not)
+    """
+    bin_file_path_prefix = os.path.join(data_batch_dir_path, 'ir')
+    if find_batch_file(bin_file_path_prefix + '_000.bin'):
+        return IrDataBinReader(bin_file_path_prefix)
+    return IrDataCsvReader(os.path.join(data_batch_dir_path, 'ir.csv'))
+
+
+if __name__ == '__main__':
+    # offline conversion of binary recording into csv, e.g.:
+    # export PYTHONPATH=$PYTHONPATH:`pwd` && python3 data_labeling/ir_data_bin_reader.py <data_batch_dir>
+    if len(sys.argv) != 2:
+        print(f"Usage: python {sys.argv[0]} <data_batch_dir>")
+        sys.exit(1)
+    data_batch_dir_path = sys.argv[1]
+    IrDataBinReader(os.path.join(data_batch_dir_path, 'ir')).export_to_csv(
+        os.path.join(data_batch_dir_path, 'ir.csv'))
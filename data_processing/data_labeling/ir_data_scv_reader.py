@@ -1,6 +1,7 @@
 import numpy as np
 
 import config
+from data_labeling.batch_files import open_batch_file
 
 
 class IrDataCsvReader:
@@ -12,7 +13,7 @@ class IrDataCsvReader:
     def get_frames_from_file(file_path):
         frames = []
         raw_frame_data = []
-        with open(file_path, 'r') as file:
+        with open_batch_file(file_path, 'rt') as file:
             raw_lines = file.readlines()
         lines = [x.strip() for x in raw_lines]
         frame_lines = lines[1:]
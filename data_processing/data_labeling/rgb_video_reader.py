@@ -2,6 +2,8 @@ import logging
 
 import cv2
 
+from data_labeling.batch_files import local_batch_file
+
 
 class RgbVideoReader:
     def __init__(self, file_path):
@@ -11,21 +13,23 @@ class RgbVideoReader:
 
     @staticmethod
     def get_frames_from_file(file_path):
-        video_cap = cv2.VideoCapture(file_path)
-        if not video_cap.isOpened():
-            raise Exception("Video open failed!")
-
-        frames = []
-        while True:
-            flag, frame = video_cap.read()
-            if flag:
-                frames.append(frame)
-                if len(frames) % 50 == 0:
-                    logging.debug(f"Reading RGB frame no {len(frames)}")
-            else:
-                break
-
-        video_cap.release()
+        """ The file can be compressed ('rgb.mjpeg.gz') """
+        with local_batch_file(file_path) as local_file_path:
+            video_cap = cv2.VideoCapture(local_file_path)
+            if not video_cap.isOpened():
+                raise Exception("Video open failed!")
+
+            frames = []
+            while True:
+                flag, frame = video_cap.read()
+                if flag:
+                    frames.append(frame)
+                    if len(frames) % 50 == 0:
+                        logging.debug(f"Reading RGB frame no {len(frames)}")
+                else:
+                    break
+
+            video_cap.release()
         return frames
 
     def get_number_of_frames(self):
@@ -7,7 +7,7 @@ import numpy as np
 import config
 from config import TEMPERATURE_NORMALIZATION__MIN, TEMPERATURE_NORMALIZATION__MAX
 from data_labeling.annotation_collector import AnnotationCollector
-from data_labeling.ir_data_scv_reader import IrDataCsvReader
+from data_labeling.ir_data_bin_reader import create_ir_data_reader
 from data_labeling.labeling_config import ROOT_DATA_DIR_PATH, OUTPUT_LABELS_DIR
 from data_labeling import labeling_config
 
@@ -116,17 +116,16 @@ def load_data_for_labeled_batches(labeled_batch_dirs) -> BatchTrainingData:
     training_data = BatchTrainingData()
     for batch_subdir in labeled_batch_dirs:
         data_batch_dir_path = os.path.join(ROOT_DATA_DIR_PATH, batch_subdir)
-        raw_ir_data_csv_file_path = os.path.join(data_batch_dir_path, 'ir.csv')
         output_file_with_labels_name = batch_subdir.replace('/', '--') + '.csv'
         annotation_data_file_path = os.path.join(OUTPUT_LABELS_DIR, output_file_with_labels_name)
 
-        raw_ir_data_csv_reader = IrDataCsvReader(file_path=raw_ir_data_csv_file_path)
+        raw_ir_data_reader = create_ir_data_reader(data_batch_dir_path)
         annotations_collector = AnnotationCollector.load_from_file(
 
             file_path=annotation_data_file_path, do_not_scale_and_reverse=True)
 
-        for frame_index in range(raw_ir_data_csv_reader.get_number_of_frames()):
-            raw_frame_data = raw_ir_data_csv_reader.get_frame(frame_index)
+        for frame_index in range(raw_ir_data_reader.get_number_of_frames()):
+            raw_frame_data = raw_ir_data_reader.get_frame(frame_index)
             frame_annotations = annotations_collector.get_annotation(frame_index)
             if not frame_annotations.accepted:
                 print(f"Frame index {frame_index} from batch '{batch_subdir}' not annotated!")
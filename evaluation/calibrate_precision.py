@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+
+import click
+import numpy as np
+import torch
+
+from evaluate import SINGLE_BLOB_MEAN_VALUE, compute_metrics, load_test_data
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_collection', 'src'))
+from trained_model import model_precision  # noqa: E402
+from trained_model.frame_processor import (  # noqa: E402
+    DEFAULT_MODEL_PATH, FrameProcessor, TEMPERATURE_NORMALIZATION__MAX, TEMPERATURE_NORMALIZATION__MIN)
+
+
+# validation sequences of the dataset, used only for int8 calibration (metrics are computed on the test sequences)
+CALIBRATION_DIRS = ["004__13_10_20", "014__13_50_21", "005__14_35_20", "006__14_39_20", "007__14_43_20", "008__14_47_20"]
+
+
+def evaluate_frame_processor(frame_processor: FrameProcessor, test_input_arr, test_output_arr) -> dict:
+    start_time = time.time()
+    output_masks, _ = frame_processor.process_frames(test_input_arr[..., 0])
+    inference_time = time.time() - start_time
+
+    output_count = np.sum(output_masks, axis=(1, 2)) / SINGLE_BLOB_MEAN_VALUE
+    metrics = {name: float(value) for name, value in compute_metrics(test_output_arr, output_masks, output_count).items()}
+    metrics['average_inference_time_ms'] = inference_time * 1000 / test_input_arr.shape[0]
+    return metrics
+
+
+@click.command()
+@click.option('--precision', help='Precision mode to validate', required=True,
+              type=click.Choice([p for p in model_precision.PRECISIONS if p != model_precision.REFERENCE_PRECISION]))
+@click.option('--model_path', help='Path to the PyTorch checkpoint', type=str, default=DEFAULT_MODEL_PATH)
+@click.option('--data_path', help='Path to HDF files', type=str, default='../dataset/hdfs')
+@click.option('--max_count_mae_regression', help='Maximum allowed increase of count MAE vs float64',
+              type=float, default=0.05)
+@click.option('--eager', is_flag=True, help='Validate the eager model instead of the optimized one, which the data '
+              'collection runs (FrameProcessor(optimized=True)). Does not apply to int8')
+def main(precision, model_path, data_path, max_count_mae_regression, eager):
+    test_input_arr, test_output_arr = load_test_data(data_path)
+    print(f'Test array shape: {test_input_arr.shape}')
+
+    reference_metrics = evaluate_frame_processor(
+        FrameProcessor(model_path=model_path), test_input_arr, test_output_arr)
+    print(f'Reference ({model_precision.REFERENCE_PRECISION}) metrics: {reference_metrics}')
+
+    quantization_engine = None
+    if precision == model_precision.PRECISION_INT8:
+        quantization_engine = model_precision.get_default_quantization_engine()
+        calibration_input_arr, _ = load_test_data(data_path, dirs=CALIBRATION_DIRS)
+        calibration_frames_normalized = torch.tensor(
+            (calibration_input_arr[..., 0] - TEMPERATURE_NORMALIZATION__MIN)
+            / (TEMPERATURE_NORMALIZATION__MAX - TEMPERATURE_NORMALIZATION__MIN))[:, np.newaxis]
+        print(f'Calibrating int8 model ({quantization_engine}) on {calibration_frames_normalized.shape[0]} frames')
+        int8_model = model_precision.build_int8_model(
+            FrameProcessor(model_path=model_path).model, calibration_frames_normalized, quantization_engine)
+        torch.jit.save(int8_model, model_precision.get_int8_model_path(model_path))
+
+    optimized = not eager and precision != model_precision.PRECISION_INT8
+    metrics = evaluate_frame_processor(
+        FrameProcessor(model_path=model_path, optimized=optimized, precision=precision,
+                       check_precision_approval=False),
+        test_input_arr, test_output_arr)
+    print(f'{precision} ({"optimized" if optimized else "eager"} model) metrics: {metrics}')
+
+    count_mae_regression = metrics['count_mae'] - reference_metrics['count_mae']
+    approved = bool(count_mae_regression <= max_count_mae_regression)
+    model_precision.save_precision_validation(model_path, precision, {
+        'approved': approved,
+        'count_mae': metrics['count_mae'],
+        'reference_count_mae': reference_metrics['count_mae'],
+        'max_count_mae_regression': max_count_mae_regression,
+        'metrics': metrics,
+        'reference_metrics': reference_metrics,
+        'quantization_engine': quantization_engine,
+        'optimized': optimized,
+    })
+
+    if not approved:
+        if precision == model_precision.PRECISION_INT8:
+            os.remove(model_precision.get_int8_model_path(model_path))
+        print(f'REFUSED: count MAE regression {count_mae_regression:.4f} > {max_count_mae_regression}. '
+              f'Precision mode {precision} stays disabled.')
+        sys.exit(1)
+    print(f'APPROVED: count MAE regression {count_mae_regression:.4f} <= {max_count_mae_regression}. '
+          f'Precision mode {precision} can be enabled (INFERENCE_PRECISION in data_collection/src/main.py).')
+
+
+if __name__ == '__main__':
+    main()
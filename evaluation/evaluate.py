@@ -27,11 +27,11 @@ def generate_mask(keypoints: List[Tuple[int, int]], sigma: Tuple[int, int] = (3,
     return np.array([label])
 
 
-def load_test_data(data_path: str) -> Tuple[np.ndarray, np.ndarray]:
+def load_test_data(data_path: str, dirs: List[str] = TEST_DIRS) -> Tuple[np.ndarray, np.ndarray]:
     test_input_data = []
     test_output_data = []
 
-    for filename in TEST_DIRS:
+    for filename in dirs:
         df = pd.read_hdf(f'{data_path}/{filename}.h5')
         data = df['data'].to_numpy()
         points = df['points'].to_numpy()
@@ -87,6 +87,36 @@ def myriad_inference(input_data, interpreter, input_blob):
     return output_data, inference_time
 
 
+def compute_metrics(test_output_arr: np.ndarray, output_masks: np.ndarray, output_count) -> dict:
+    """
+    :param test_output_arr: ground truth masks (N, 24, 32, 1)
+    :param output_masks: model output masks, reshapeable to (N, 24, 32, 1)
+    :param output_count: people count predicted for each frame (N,)
+    """
+    output_masks = np.reshape(output_masks, test_output_arr.shape)
+    number_of_frames = test_output_arr.shape[0]
+    input_size = test_output_arr.shape[1] * test_output_arr.shape[2] * test_output_arr.shape[3]
+    MSE = np.sum(np.power(test_output_arr - output_masks, 2)) / input_size / number_of_frames
+    MAE = np.sum(np.abs(test_output_arr - output_masks)) / input_size / number_of_frames
+
+    count_diff = np.sum(test_output_arr, axis=(1,2,3)) / SINGLE_BLOB_MEAN_VALUE - output_count
+    count_MSE = np.sum(np.power(count_diff, 2)) / number_of_frames
+    count_MAE = np.sum(np.abs(count_diff)) / number_of_frames
+
+    count_rounded_diff = np.round(np.sum(test_output_arr, axis=(1,2,3)) / SINGLE_BLOB_MEAN_VALUE) - np.round(output_count)
+    count_rounded_MSE = np.sum(np.power(count_rounded_diff, 2)) / number_of_frames
+    count_rounded_MAE = np.sum(np.abs(count_rounded_diff)) / number_of_frames
+
+    return {
+        'mse': MSE,
+        'mae': MAE,
+        'count_mse': count_MSE,
+        'count_mae': count_MAE,
+        'count_rounded_mse': count_rounded_MSE,
+        'count_rounded_mae': count_rounded_MAE,
+    }
+
+
 @click.command()
 @click.option('--inference_type', help='Inference framework (device)', type=click.Choice(['tflite', 'edgetpu', 'myriad'], case_sensitive=True))
 @click.option('--model_path', help='Path to model', type=str)
@@ -137,26 +167,16 @@ def main(inference_type, model_path, data_path):
     output_masks = np.vstack(output_masks)
     np.save(f'rpi_{inference_type}_output.npy', output_masks)
 
-    input_size = test_output_arr.shape[1] * test_output_arr.shape[2] * test_output_arr.shape[3]
-    MSE = np.sum(np.power(test_output_arr - output_masks, 2)) / input_size / test_input_arr.shape[0]
-    MAE = np.sum(np.abs(test_output_arr - output_masks)) / input_size / test_input_arr.shape[0]
-
-    count_diff = np.sum(test_output_arr, axis=(1,2,3)) / SINGLE_BLOB_MEAN_VALUE - output_count
-    count_MSE = np.sum(np.power(count_diff, 2)) / test_input_arr.shape[0]
-    count_MAE = np.sum(np.abs(count_diff)) / test_input_arr.shape[0]
-
-    count_rounded_diff = np.round(np.sum(test_output_arr, axis=(1,2,3)) / SINGLE_BLOB_MEAN_VALUE) - np.round(output_count)
-    count_rounded_MSE = np.sum(np.power(count_rounded_diff, 2)) / test_input_arr.shape[0]
-    count_rounded_MAE = np.sum(np.abs(count_rounded_diff)) / test_input_arr.shape[0]
+    metrics = compute_metrics(test_output_arr, output_masks, output_count)
 
     average_infer_time = inference_full_time / test_input_arr.shape[0]
     
-    print(f'Mean square error: {MSE}')
-    print(f'Mean absolute error: {MAE}')
-    print(f'Count mean square error: {count_MSE}')
-    print(f'Count mean absolute error: {count_MAE}')
-    print(f'Rounded count mean square error: {count_rounded_MSE}')
-    print(f'Rounded count mean absolute error: {count_rounded_MAE}')
+    print(f'Mean square error: {metrics["mse"]}')
+    print(f'Mean absolute error: {metrics["mae"]}')
+    print(f'Count mean square error: {metrics["count_mse"]}')
+    print(f'Count mean absolute error: {metrics["count_mae"]}')
+    print(f'Rounded count mean square error: {metrics["count_rounded_mse"]}')
+    print(f'Rounded count mean absolute error: {metrics["count_rounded_mae"]}')
     print(f'Average inference time: {average_infer_time} ms')
 
 
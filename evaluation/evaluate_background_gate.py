@@ -0,0 +1,113 @@
+import glob
+import os
+import sys
+import time
+
+import click
+import numpy as np
+
+from evaluate import SINGLE_BLOB_MEAN_VALUE, compute_metrics, load_test_data
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_collection', 'src'))
+from background_model import BackgroundModel  # noqa: E402
+from trained_model.frame_processor import DEFAULT_MODEL_PATH, FrameProcessor  # noqa: E402
+
+
+def simulate_background_gate(frame_processor: FrameProcessor, input_frames, output_masks,
+                             background_model: BackgroundModel):
+    """
+    Replay one sequence through the background model, as InferenceResultCache does at runtime - the model outputs
+    of the processed frames are taken from `output_masks` (of all frames, computed in advance)
+    :return: output masks with the skipped frames zeroed, skipped frames mask (N,), gate time per frame [s]
+    """
+    gated_masks = output_masks.copy()
+    is_skipped = np.zeros(input_frames.shape[0], dtype=bool)
+    start_time = time.time()
+    for i, frame in enumerate(input_frames):
+        if background_model.should_skip_inference(frame):
+            is_skipped[i] = True
+            gated_masks[i] = 0
+            background_model.add_frame(frame)
+        else:
+            background_model.add_frame(frame, density_map=output_masks[i],
+                                       people_count=frame_processor.get_people_count(output_masks[i]))
+    return gated_masks, is_skipped, (time.time() - start_time) / input_frames.shape[0]
+
+
+def format_metrics(metrics: dict) -> str:
+    return ', '.join(f'{name} {value:.4f}' for name, value in metrics.items())
+
+
+@click.command()
+@click.option('--model_path', help='Path to the PyTorch checkpoint', type=str, default=DEFAULT_MODEL_PATH)
+@click.option('--data_path', help='Path to HDF files', type=str, default='../dataset/hdfs')
+@click.option('--sequence', 'sequences', help='Sequence (HDF file name without .h5) to evaluate, all by default',
+              type=str, multiple=True)
+@click.option('--margin', help='[deg C] over the background of a non-empty pixel', type=float, default=1.0)
+@click.option('--std_factor', help='Standard deviations of the background added to the margin', type=float,
+              default=3.0)
+@click.option('--adaptation_rate', help='Weight of a new frame in the background (per frame)', type=float,
+              default=0.01)
+@click.option('--max_skipped_frames', help='Skipped frames in a row before the model runs to confirm', type=int,
+              default=8)
+def main(model_path, data_path, sequences, margin, std_factor, adaptation_rate, max_skipped_frames):
+    """
+    Skip ratio and accuracy impact of skipping the inference of empty frames (see background_model.py).
+    Every sequence is replayed in order with its own background model, the metrics of evaluate.py are computed
+    for the model on all frames and with the skipped frames reported as empty.
+    """
+    sequences = sequences or sorted(os.path.splitext(os.path.basename(file_path))[0]
+                                    for file_path in glob.glob(os.path.join(data_path, '*.h5')))
+    frame_processor = FrameProcessor(model_path=model_path)
+
+    all_ground_truth, all_masks, all_gated_masks, all_skipped = [], [], [], []
+    inference_time = gate_time = 0.0
+    for sequence in sequences:
+        input_arr, ground_truth = load_test_data(data_path, dirs=[sequence])
+        input_frames = input_arr[..., 0]
+        start_time = time.time()
+        output_masks, _ = frame_processor.process_frames(input_frames)
+        inference_time += time.time() - start_time
+        background_model = BackgroundModel(margin=margin, std_factor=std_factor, adaptation_rate=adaptation_rate,
+                                           max_skipped_frames=max_skipped_frames)
+        gated_masks, is_skipped, sequence_gate_time = simulate_background_gate(
+            frame_processor, input_frames, output_masks, background_model)
+        gate_time += sequence_gate_time * input_frames.shape[0]
+
+        ground_truth_counts = np.round(np.sum(ground_truth, axis=(1, 2, 3)) / SINGLE_BLOB_MEAN_VALUE)
+        print(f'{sequence}: {input_frames.shape[0]} frames, {np.mean(ground_truth_counts == 0):.1%} empty, '
+              f'{np.mean(is_skipped):.1%} skipped, {np.sum(is_skipped & (ground_truth_counts > 0))} skipped '
+              f'with people')
+        all_ground_truth.append(ground_truth)
+        all_masks.append(output_masks)
+        all_gated_masks.append(gated_masks)
+        all_skipped.append(is_skipped)
+
+    ground_truth = np.vstack(all_ground_truth)
+    output_masks, gated_masks = np.vstack(all_masks), np.vstack(all_gated_masks)
+    is_skipped = np.concatenate(all_skipped)
+    number_of_frames = ground_truth.shape[0]
+    reference_metrics = compute_metrics(ground_truth, output_masks,
+                                        np.sum(output_masks, axis=(1, 2)) / SINGLE_BLOB_MEAN_VALUE)
+    gated_metrics = compute_metrics(ground_truth, gated_masks,
+                                    np.sum(gated_masks, axis=(1, 2)) / SINGLE_BLOB_MEAN_VALUE)
+    ground_truth_counts = np.round(np.sum(ground_truth, axis=(1, 2, 3)) / SINGLE_BLOB_MEAN_VALUE)
+
+    print(f'Total: {number_of_frames} frames of {len(sequences)} sequences, '
+          f'{np.mean(ground_truth_counts == 0):.1%} empty (ground truth)')
+    print(f'Skipped: {np.sum(is_skipped)} frames ({np.mean(is_skipped):.1%}), '
+          f'{np.sum(is_skipped & (ground_truth_counts > 0))} of them with people (ground truth), '
+          f'{np.sum(is_skipped & (np.round(np.sum(output_masks, axis=(1, 2)) / SINGLE_BLOB_MEAN_VALUE) > 0))} '
+          f'with people counted by the model')
+    print(f'Model on all frames: {format_metrics(reference_metrics)}')
+    print(f'With skipped frames: {format_metrics(gated_metrics)}')
+    print(f'Count MAE change: {gated_metrics["count_mae"] - reference_metrics["count_mae"]:+.4f}')
+    average_inference_time = inference_time / number_of_frames  # batched, a single frame at runtime is slower
+    average_gate_time = gate_time / number_of_frames
+    print(f'Inference {average_inference_time * 1000:.3f} ms/frame (batched), background model '
+          f'{average_gate_time * 1000:.3f} ms/frame - expected inference time with skipping: '
+          f'{(1 - np.mean(is_skipped)) * average_inference_time * 1000 + average_gate_time * 1000:.3f} ms/frame')
+
+
+if __name__ == '__main__':
+    main()
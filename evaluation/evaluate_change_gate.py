@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+
+import click
+import numpy as np
+
+from evaluate import SINGLE_BLOB_MEAN_VALUE, TEST_DIRS, compute_metrics, load_test_data
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_collection', 'src'))
+from change_gate import METRICS, TemporalChangeGate  # noqa: E402
+from trained_model.frame_processor import DEFAULT_MODEL_PATH, FrameProcessor  # noqa: E402
+
+
+def simulate_change_gate(frame_processor: FrameProcessor, input_frames, output_masks, change_gate: TemporalChangeGate):
+    """
+    Replay one sequence through the change gate, as InferenceResultCache does at runtime - the model outputs
+    of the processed frames are taken from `output_masks` (of all frames, computed in advance)
+    :return: output masks with the reused outputs, reused frames mask (N,), gate time per frame [s]
+    """
+    gated_masks = output_masks.copy()
+    is_reused = np.zeros(input_frames.shape[0], dtype=bool)
+    start_time = time.time()
+    for i, frame in enumerate(input_frames):
+        cached_output = change_gate.get_cached_output(frame)
+        if cached_output is not None:
+            is_reused[i] = True
+            gated_masks[i] = cached_output[0]
+        else:
+            change_gate.set_output(frame, density_map=output_masks[i],
+                                   people_count=frame_processor.get_people_count(output_masks[i]))
+    return gated_masks, is_reused, (time.time() - start_time) / input_frames.shape[0]
+
+
+def get_counts(masks: np.ndarray) -> np.ndarray:
+    return np.sum(masks, axis=(1, 2)) / SINGLE_BLOB_MEAN_VALUE
+
+
+@click.command()
+@click.option('--model_path', help='Path to the PyTorch checkpoint', type=str, default=DEFAULT_MODEL_PATH)
+@click.option('--data_path', help='Path to HDF files', type=str, default='../dataset/hdfs')
+@click.option('--sequence', 'sequences', help='Sequence (HDF file name without .h5) to evaluate, the test sequences '
+              'of evaluate.py by default', type=str, multiple=True)
+@click.option('--threshold', 'thresholds', help='[deg C] difference up to which the output is reused, can be given '
+              'more times', type=float, multiple=True, default=[0.25, 0.5, 1.0])
+@click.option('--metric', help='Difference of the frames', type=click.Choice(METRICS), default=METRICS[0])
+@click.option('--max_reused_frames', help='Reused outputs in a row before a forced refresh', type=int, default=8)
+def main(model_path, data_path, sequences, thresholds, metric, max_reused_frames):
+    """
+    Hit ratio and accuracy impact of reusing the output of the previous frame for nearly identical frames
+    (see change_gate.py). Every sequence is replayed in order with its own gate for every threshold,
+    the count MAE (and the other metrics of evaluate.py) of the gated outputs is compared with the model on all frames.
+    """
+    sequences = sequences or TEST_DIRS
+    frame_processor = FrameProcessor(model_path=model_path)
+
+    all_input_frames, all_ground_truth, all_masks = [], [], []
+    inference_time = 0.0
+    for sequence in sequences:
+        input_arr, ground_truth = load_test_data(data_path, dirs=[sequence])
+        start_time = time.time()
+        output_masks, _ = frame_processor.process_frames(input_arr[..., 0])
+        inference_time += time.time() - start_time
+        all_input_frames.append(input_arr[..., 0])
+        all_ground_truth.append(ground_truth)
+        all_masks.append(output_masks)
+
+    ground_truth = np.vstack(all_ground_truth)
+    output_masks = np.vstack(all_masks)
+    number_of_frames = ground_truth.shape[0]
+    average_inference_time = inference_time / number_of_frames  # batched, a single frame at runtime is slower
+    reference_metrics = compute_metrics(ground_truth, output_masks, get_counts(output_masks))
+    print(f'{number_of_frames} frames of {len(sequences)} sequences, metric {metric}, '
+          f'at most {max_reused_frames} reused outputs in a row')
+    print(f'Model on all frames: count MAE {reference_metrics["count_mae"]:.4f}, '
+          f'{average_inference_time * 1000:.3f} ms/frame (batched)')
+
+    for threshold in thresholds:
+        gated_masks, is_reused, gate_time = [], [], 0.0
+        for sequence, input_frames, sequence_masks in zip(sequences, all_input_frames, all_masks):
+            change_gate = TemporalChangeGate(threshold=threshold, metric=metric, max_reused_frames=max_reused_frames)
+            sequence_gated_masks, sequence_is_reused, sequence_gate_time = simulate_change_gate(
+                frame_processor, input_frames, sequence_masks, change_gate)
+            gated_masks.append(sequence_gated_masks)
+            is_reused.append(sequence_is_reused)
+            gate_time += sequence_gate_time * input_frames.shape[0]
+            print(f'  threshold {threshold}: {sequence}: {np.mean(sequence_is_reused):.1%} reused, '
+                  f'{change_gate.get_stats()["forced_refreshes"]} forced refreshes')
+        gated_masks, is_reused = np.vstack(gated_masks), np.concatenate(is_reused)
+        gated_metrics = compute_metrics(ground_truth, gated_masks, get_counts(gated_masks))
+        count_difference = np.abs(get_counts(gated_masks) - get_counts(output_masks))
+        average_gate_time = gate_time / number_of_frames
+        print(f'Threshold {threshold}: {np.mean(is_reused):.1%} reused, count MAE {gated_metrics["count_mae"]:.4f} '
+              f'({gated_metrics["count_mae"] - reference_metrics["count_mae"]:+.4f}), count differs from the model '
+              f'by {np.mean(count_difference):.4f} on average (max {np.max(count_difference):.3f}), '
+              f'{np.sum(np.round(get_counts(gated_masks)) != np.round(get_counts(output_masks)))} rounded counts '
+              f'differ')
+        print(f'  {", ".join(f"{name} {value:.4f}" for name, value in gated_metrics.items())}')
+        print(f'  gate {average_gate_time * 1000:.3f} ms/frame - expected inference time with reuse: '
+              f'{(1 - np.mean(is_reused)) * average_inference_time * 1000 + average_gate_time * 1000:.3f} ms/frame')
+
+
+if __name__ == '__main__':
+    main()